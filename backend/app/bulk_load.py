@@ -0,0 +1,398 @@
+"""
+bulk_load.py
+------------
+COPY-based bulk writer for pipeline outputs (trades, tags_raw, trade_scores,
+day_scores, daily_pnl) into the Supabase/Postgres schema.
+
+Frames are converted column-wise (unparseable numbers become 0, missing text '')
+and streamed to Postgres with psycopg's copy API in CSV chunks, so an import costs
+a handful of round-trips instead of one (or two) per row.
+
+Trades are written under one stable account per user (TG_ACCOUNT_ID, else a UUID
+derived from the user id), and daily_pnl gets one pre-aggregated row per day via a
+single set-based upsert, so the table holds O(days x accounts) rows.
+
+staged_replace() swaps a user's whole data set atomically: it loads the tables
+concurrently into staging tables and replaces the live rows in one short
+transaction.
+
+Benchmark against the row-by-row path (needs DATABASE_URL and TG_USER_ID):
+    python -m app.bulk_load --bench 20000
+"""
+
+from __future__ import annotations
+import argparse
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from .db import connection, write_share
+from .ingest import daily_pnl
+
+COPY_CHUNK_ROWS = 50_000
+
+# Per-user tables written by an import, parents before children
+USER_TABLES = ("trades", "daily_pnl", "tags_raw", "trade_scores", "day_scores")
+# staged_replace() staging tables: <prefix><table>_<import token>, dropped after the swap
+STAGE_PREFIX = "tg_stage_"
+
+# Namespace for deriving a user's default account id (uuid5)
+ACCOUNT_NAMESPACE = uuid.UUID("6c1f3f0e-7d43-4f3e-9a8e-2b1d0c7a5e91")
+
+TRADE_COLS = [
+    "trade_id","user_id","account_id","ticker","side","trade_date","trade_time","qty","entry_price","exit_price",
+    "fees","realized_pnl","strategy","hold_time_sec","note","mood","manual_tags","screenshot_url",
+]
+TRADE_TEXT_COLS = ["ticker","side","strategy","note","mood","manual_tags","screenshot_url"]
+TAG_COLS = ["user_id","trade_id","trade_date","tag","confidence","rationale","scope","source"]
+TRADE_SCORE_ID_COLS = ("user_id","trade_id","trade_date","ticker")
+DAY_SCORE_ID_COLS = ("user_id","trade_date")
+
+
+def default_account_id(user_id: str) -> str:
+    """Stable account id for a user: TG_ACCOUNT_ID if set, else uuid5(user_id)."""
+    return os.environ.get("TG_ACCOUNT_ID") or str(uuid.uuid5(ACCOUNT_NAMESPACE, f"{user_id}:default"))
+
+
+# ---------- Column-wise conversion ----------
+def _num(s: pd.Series, default: float = 0.0) -> pd.Series:
+    return pd.to_numeric(s, errors="coerce").fillna(default)
+
+def _day(s: pd.Series) -> pd.Series:
+    return pd.to_datetime(s, errors="coerce").dt.date
+
+def _text(s: pd.Series) -> pd.Series:
+    return s.fillna("").astype(str)
+
+def _col(df: pd.DataFrame, name: str, default="") -> pd.Series:
+    return df[name] if name in df.columns else pd.Series(default, index=df.index)
+
+def trades_frame(trades: pd.DataFrame, user_id: str, account_id: str, trade_ids: np.ndarray) -> pd.DataFrame:
+    """trades_roundtrips rows -> public.trades COPY rows (TRADE_COLS order) with pre-assigned ids."""
+    out = pd.DataFrame(index=trades.index)
+    out["trade_id"] = trade_ids
+    out["user_id"] = user_id
+    out["account_id"] = account_id
+    out["ticker"] = _text(trades["ticker"])
+    out["side"] = _text(trades["side"]).str.lower()
+    out["trade_date"] = _day(trades["trade_date"])
+    out["trade_time"] = None
+    for c in ("qty","entry_price","exit_price","realized_pnl"):
+        out[c] = _num(trades[c])
+    out["fees"] = _num(_col(trades, "fees", 0.0))
+    out["hold_time_sec"] = pd.to_numeric(_col(trades, "hold_time_sec", np.nan), errors="coerce")
+    for c in ("strategy","note","mood","manual_tags","screenshot_url"):
+        out[c] = _text(_col(trades, c))
+    return out[TRADE_COLS]
+
+def tags_frame(tags: pd.DataFrame, user_id: str, id_map) -> pd.DataFrame:
+    """run_all_rules rows -> public.tags_raw rows; trade tags whose trade_id is unmapped are dropped."""
+    out = pd.DataFrame(index=tags.index)
+    out["user_id"] = user_id
+    csv_ids = pd.to_numeric(tags["trade_id"], errors="coerce")
+    out["trade_id"] = csv_ids.map(id_map).astype("Int64")
+    out["trade_date"] = _day(tags["trade_date"])
+    out["tag"] = _text(tags["tag"])
+    out["confidence"] = _num(_col(tags, "confidence", 1.0), 1.0)
+    out["rationale"] = _text(_col(tags, "rationale"))
+    out["scope"] = _text(_col(tags, "scope", "trade"))
+    out["source"] = _text(_col(tags, "source", "rule")).replace("", "rule")
+    keep = csv_ids.isna() | out["trade_id"].notna()
+    return out.loc[keep, TAG_COLS]
+
+def trade_scores_frame(scores: pd.DataFrame, user_id: str, id_map) -> pd.DataFrame:
+    cols = [c for c in scores.columns if c not in TRADE_SCORE_ID_COLS]
+    out = pd.DataFrame(index=scores.index)
+    out["user_id"] = user_id
+    out["trade_id"] = pd.to_numeric(scores["trade_id"], errors="coerce").map(id_map).astype("Int64")
+    out["trade_date"] = _day(scores["trade_date"])
+    out["ticker"] = _text(scores["ticker"])
+    for c in cols:
+        out[c] = _num(scores[c])
+    return out[out["trade_id"].notna()]
+
+def day_scores_frame(scores: pd.DataFrame, user_id: str) -> pd.DataFrame:
+    cols = [c for c in scores.columns if c not in DAY_SCORE_ID_COLS]
+    out = pd.DataFrame(index=scores.index)
+    out["user_id"] = user_id
+    out["trade_date"] = _day(scores["trade_date"])
+    for c in cols:
+        out[c] = _num(scores[c])
+    return out
+
+
+# ---------- COPY ----------
+def copy_frame(cur, table: str, df: pd.DataFrame, text_cols=()) -> int:
+    """
+    Stream df into `table` with COPY ... FROM STDIN (FORMAT csv).
+    Empty cells load as NULL except in text_cols, which load as ''.
+    """
+    if df.empty:
+        return 0
+    opts = "FORMAT csv"
+    text_cols = [c for c in text_cols if c in df.columns]
+    if text_cols:
+        opts += f", FORCE_NOT_NULL ({','.join(text_cols)})"
+    with cur.copy(f"COPY {table} ({','.join(df.columns)}) FROM STDIN ({opts})") as copy:
+        for start in range(0, len(df), COPY_CHUNK_ROWS):
+            copy.write(df.iloc[start:start + COPY_CHUNK_ROWS].to_csv(index=False, header=False))
+    return len(df)
+
+def upsert_daily_pnl(cur, user_id: str, account_id: str, daily: pd.DataFrame,
+                     table: str = "public.daily_pnl") -> int:
+    """
+    Write ingest.daily_pnl() rows with one set-based upsert (unnest of day/pnl arrays).
+    Days already present for the account are overwritten with the new totals.
+    """
+    if daily.empty:
+        return 0
+    cur.execute(f"""
+        insert into {table} (user_id, account_id, day, realized_pnl)
+        select %s, %s, d.day, d.realized_pnl
+        from unnest(%s::date[], %s::numeric[]) as d(day, realized_pnl)
+        on conflict (user_id, account_id, day)
+        do update set realized_pnl = excluded.realized_pnl
+    """, (user_id, account_id, list(daily["day"]), [float(x) for x in daily["realized_pnl"]]))
+    return len(daily)
+
+def reserve_trade_ids(cur, n: int) -> np.ndarray:
+    """Reserve n ids from the public.trades id sequence in one round-trip."""
+    if n == 0:
+        return np.empty(0, dtype=np.int64)
+    cur.execute("""
+        select nextval(pg_get_serial_sequence('public.trades', 'trade_id'))
+        from generate_series(1, %s)
+    """, (n,))
+    return np.array([r[0] for r in cur.fetchall()], dtype=np.int64)
+
+def trade_id_map(trades: pd.DataFrame, db_ids: np.ndarray) -> pd.Series:
+    """Pipeline trade_id (1..N from fifo_round_trips) -> database trade_id."""
+    csv_ids = pd.to_numeric(trades["trade_id"], errors="coerce") if "trade_id" in trades.columns \
+        else pd.Series(np.arange(1, len(trades) + 1))
+    return pd.Series(db_ids, index=csv_ids.to_numpy())
+
+def _copy_jobs(user_id: str, trades: pd.DataFrame, tags, trade_scores, day_scores,
+               account_id: str, id_map: pd.Series) -> Dict[str, tuple]:
+    """
+    {table: (build, text_cols)} for every COPY-loaded table, parents first.
+    Frames are built lazily so each job can run on its own connection/thread;
+    once trade ids are reserved the jobs are independent of each other.
+    """
+    # Plain dict: a shared Series would build its lookup engine lazily, racing across threads
+    ids, lookup = id_map.to_numpy(), id_map.to_dict()
+    jobs = {"trades": (lambda: trades_frame(trades, user_id, account_id, ids), TRADE_TEXT_COLS)}
+    if tags is not None and not tags.empty:
+        jobs["tags_raw"] = (lambda: tags_frame(tags, user_id, lookup), ["tag","rationale","scope","source"])
+    if trade_scores is not None and not trade_scores.empty:
+        jobs["trade_scores"] = (lambda: trade_scores_frame(trade_scores, user_id, lookup), ["ticker"])
+    if day_scores is not None and not day_scores.empty:
+        jobs["day_scores"] = (lambda: day_scores_frame(day_scores, user_id), [])
+    return jobs
+
+def bulk_import(con, user_id: str, trades: pd.DataFrame,
+                tags: Optional[pd.DataFrame] = None,
+                trade_scores: Optional[pd.DataFrame] = None,
+                day_scores: Optional[pd.DataFrame] = None,
+                account_id: Optional[str] = None) -> Dict[str, int]:
+    """
+    Load pipeline frames for one user in a single transaction via COPY.
+    Trades go under `account_id` (default_account_id(user_id) if None).
+
+    Database trade_ids are reserved up front from the trades sequence and written
+    explicitly, so tags and scores are keyed directly with no read-back of the
+    user's trades. Returns row counts per table.
+    """
+    account_id = account_id or default_account_id(user_id)
+    counts = {}
+    with con.transaction(), con.cursor() as cur:
+        id_map = trade_id_map(trades, reserve_trade_ids(cur, len(trades)))
+        for table, (build, text_cols) in _copy_jobs(user_id, trades, tags, trade_scores, day_scores,
+                                                    account_id, id_map).items():
+            counts[table] = copy_frame(cur, f"public.{table}", build(), text_cols)
+        counts["daily_pnl"] = upsert_daily_pnl(cur, user_id, account_id, daily_pnl(trades.assign(user_id=user_id)))
+    return counts
+
+def _live_columns(cur, table: str) -> list:
+    """Writable (non-generated) columns of public.<table>, in table order."""
+    cur.execute("""
+        select column_name from information_schema.columns
+        where table_schema = 'public' and table_name = %s and is_generated = 'NEVER'
+        order by ordinal_position
+    """, (table,))
+    return [r[0] for r in cur.fetchall()]
+
+def stage_workers(n_tables: int) -> int:
+    """
+    Concurrent table loads for one import: its db.write_share() of the pool,
+    minus the caller's own connection; 1 means load on the caller's connection.
+    Without a pool (CLI) connections are one-off and every table gets its own.
+    """
+    share = write_share()
+    if share is None:
+        return max(n_tables, 1)
+    return max(1, min(n_tables, share - 1))
+
+def _stage_copy(table: str, build, text_cols) -> int:
+    """One COPY job on its own (pooled) connection."""
+    with connection() as con, con.cursor() as cur:
+        return copy_frame(cur, table, build(), text_cols)
+
+def staged_replace(con, user_id: str, trades: pd.DataFrame,
+                   tags: Optional[pd.DataFrame] = None,
+                   trade_scores: Optional[pd.DataFrame] = None,
+                   day_scores: Optional[pd.DataFrame] = None,
+                   account_id: Optional[str] = None) -> Dict[str, int]:
+    """
+    Atomically replace everything stored for user_id with the given frames.
+
+    Frames are COPYed into per-import UNLOGGED staging tables (LIKE the live
+    tables), which takes no locks on the live tables. With trade ids reserved up
+    front the tables are independent, so they are loaded concurrently on pooled
+    connections (stage_workers() of them, within the import's share of the pool) and
+    staging wall time approaches the largest table.
+    Only the final swap touches the live tables: one transaction deletes the
+    user's rows and INSERT ... SELECTs the staged ones. Readers keep seeing the
+    old rows until that commit, and any failure leaves the old data intact.
+    Staging tables are dropped afterwards. Returns staged row counts.
+    """
+    account_id = account_id or default_account_id(user_id)
+    stage = {t: f"public.{STAGE_PREFIX}{t}_{uuid.uuid4().hex[:12]}" for t in USER_TABLES}
+    counts = {}
+    try:
+        with con.cursor() as cur:
+            for table in USER_TABLES:
+                cur.execute(f"create unlogged table {stage[table]} (like public.{table} including all)")
+            id_map = trade_id_map(trades, reserve_trade_ids(cur, len(trades)))
+
+        jobs = _copy_jobs(user_id, trades, tags, trade_scores, day_scores, account_id, id_map)
+        daily = daily_pnl(trades.assign(user_id=user_id))
+        workers = stage_workers(len(jobs))
+        if workers == 1:
+            with con.cursor() as cur:
+                for t, (build, text_cols) in jobs.items():
+                    counts[t] = copy_frame(cur, stage[t], build(), text_cols)
+                counts["daily_pnl"] = upsert_daily_pnl(cur, user_id, account_id, daily, table=stage["daily_pnl"])
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as ex:
+                futures = {t: ex.submit(_stage_copy, stage[t], build, text_cols)
+                           for t, (build, text_cols) in jobs.items()}
+                with con.cursor() as cur:
+                    counts["daily_pnl"] = upsert_daily_pnl(cur, user_id, account_id, daily, table=stage["daily_pnl"])
+                counts.update({t: f.result() for t, f in futures.items()})
+
+        # Swap: children out first, parents in first
+        with con.transaction(), con.cursor() as cur:
+            for table in reversed(USER_TABLES):
+                cur.execute(f"delete from public.{table} where user_id = %s", (user_id,))
+            for table in USER_TABLES:
+                cols = ",".join(_live_columns(cur, table))
+                cur.execute(f"insert into public.{table} ({cols}) select {cols} from {stage[table]}")
+    finally:
+        with con.cursor() as cur:
+            cur.execute(f"drop table if exists {', '.join(stage.values())}")
+    return counts
+
+
+# ---------- Benchmark ----------
+def _synthetic_outputs(n_trades: int):
+    """Tile the bundled round-trips to n_trades and run features -> rules -> labels."""
+    from .features import compute_features
+    from .rulespec import run_rule_specs
+    from .labels import build_labels_scatter
+
+    src = pd.read_csv(Path(__file__).resolve().parents[1] / "data" / "trades_roundtrips.csv")
+    reps = int(np.ceil(n_trades / len(src)))
+    span = pd.to_datetime(src["trade_date"]).max() - pd.to_datetime(src["trade_date"]).min() + pd.Timedelta(days=1)
+    trades = pd.concat(
+        [src.assign(trade_date=(pd.to_datetime(src["trade_date"]) + i * span).dt.date) for i in range(reps)],
+        ignore_index=True,
+    ).head(n_trades)
+    trades["trade_id"] = np.arange(1, len(trades) + 1)
+    tags = run_rule_specs(compute_features(trades))
+    trade_scores, day_scores, _ = build_labels_scatter(trades, tags, propagate_day_to_trades=False)
+    return trades, tags, trade_scores, day_scores
+
+def _clear(con, user_id: str):
+    with con.cursor() as cur:
+        for table in ("tags_raw","trade_scores","day_scores","daily_pnl","trades"):
+            cur.execute(f"DELETE FROM public.{table} WHERE user_id = %s", (user_id,))
+
+def _insert_rows(cur, table: str, df: pd.DataFrame, returning: str = None) -> list:
+    """One INSERT round-trip per row (the old importer's write pattern)."""
+    cols = list(df.columns)
+    sql = f"insert into {table} ({','.join(cols)}) values ({','.join(['%s'] * len(cols))})"
+    if returning:
+        sql += f" returning {returning}"
+    out = []
+    for row in df.astype(object).where(df.notna(), None).itertuples(index=False):
+        cur.execute(sql, tuple(row))
+        if returning:
+            out.append(cur.fetchone()[0])
+    return out
+
+def row_by_row_import(con, user_id: str, trades: pd.DataFrame, tags=None, trade_scores=None,
+                      day_scores=None) -> Dict[str, int]:
+    """
+    Benchmark baseline: the row-by-row importer this module replaced. Each trade is
+    inserted with its own round-trip (ids come back via RETURNING) plus a per-trade
+    daily_pnl upsert, then every tag and score row is inserted one at a time.
+    """
+    account_id = default_account_id(user_id)
+    counts = {}
+    with con.transaction(), con.cursor() as cur:
+        rows = trades_frame(trades, user_id, account_id, np.zeros(len(trades), dtype=np.int64))
+        ids = _insert_rows(cur, "public.trades", rows.drop(columns="trade_id"), returning="trade_id")
+        for day, pnl in zip(rows["trade_date"], rows["realized_pnl"]):
+            cur.execute("""
+                insert into public.daily_pnl (user_id, account_id, day, realized_pnl)
+                values (%s, %s, %s, %s)
+                on conflict (user_id, account_id, day)
+                do update set realized_pnl = public.daily_pnl.realized_pnl + excluded.realized_pnl
+            """, (user_id, account_id, day, float(pnl)))
+        counts["trades"] = len(ids)
+        id_map = trade_id_map(trades, np.array(ids, dtype=np.int64))
+        frames = {"tags_raw": (tags, lambda df: tags_frame(df, user_id, id_map)),
+                  "trade_scores": (trade_scores, lambda df: trade_scores_frame(df, user_id, id_map)),
+                  "day_scores": (day_scores, lambda df: day_scores_frame(df, user_id))}
+        for table, (df, build) in frames.items():
+            if df is not None and not df.empty:
+                rows = build(df)
+                _insert_rows(cur, f"public.{table}", rows)
+                counts[table] = len(rows)
+    return counts
+
+def main():
+    from .ingest_to_supabase import UID, require_env
+
+    ap = argparse.ArgumentParser(description="Benchmark COPY bulk_import vs the row-by-row importer.")
+    ap.add_argument("--bench", type=int, default=20_000, help="number of synthetic trades")
+    args = ap.parse_args()
+    require_env()
+
+    trades, tags, trade_scores, day_scores = _synthetic_outputs(args.bench)
+    total = len(trades) + len(tags) + len(trade_scores) + len(day_scores)
+    print(f"Rows: {len(trades)} trades, {len(tags)} tags, {len(trade_scores)} trade scores, {len(day_scores)} day scores")
+
+    with connection() as con:
+        _clear(con, UID)
+        t0 = time.perf_counter()
+        row_by_row_import(con, UID, trades, tags, trade_scores, day_scores)
+        t_legacy = time.perf_counter() - t0
+
+        _clear(con, UID)
+        t0 = time.perf_counter()
+        counts = bulk_import(con, UID, trades, tags, trade_scores, day_scores)
+        t_bulk = time.perf_counter() - t0
+        _clear(con, UID)
+
+    print(f"row-by-row: {t_legacy:.2f}s  ({total / t_legacy:,.0f} rows/s)")
+    print(f"COPY:       {t_bulk:.2f}s  ({total / t_bulk:,.0f} rows/s)  {counts}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+cache.py
+--------
+In-process, per-user cache for data the API re-reads on every request but that
+only changes when the user's data is rewritten (stored trades and behavioral
+data, the coaching summary, the similar-trade index).
+
+Entries are keyed by (user_id, generation, name). The generation is a per-user
+counter bumped whenever that user's data changes (/api/import-csv,
+/api/reset-data), so stale entries are never served: they simply stop being
+reachable and age out of the LRU. A value computed while a bump happens is
+stored under the generation it started with, never the new one.
+
+Only successful computations are cached; an exception propagates to the caller
+and the next request retries.
+
+The cache lives in the API process. Writes made by other processes (the
+ingest_to_supabase CLI, import_data.py) are not seen until the next bump or a
+restart.
+
+Configuration (env):
+    TG_CACHE_MAX_ENTRIES   max cached entries across all users (default 256; 0 disables)
+"""
+
+from __future__ import annotations
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+class UserCache:
+    """Thread-safe LRU of per-user values, invalidated by a per-user generation counter."""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, int, Hashable], Any]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def generation(self, user_id: str) -> int:
+        with self._lock:
+            return self._generations.get(user_id, 0)
+
+    def bump(self, user_id: str) -> int:
+        """Mark user_id's data as changed; drops their entries and returns the new generation."""
+        with self._lock:
+            gen = self._generations.get(user_id, 0) + 1
+            self._generations[user_id] = gen
+            for key in [k for k in self._entries if k[0] == user_id]:
+                del self._entries[key]
+            return gen
+
+    def get_or_compute(self, user_id: str, name: Hashable, compute: Callable[[], Any]) -> Any:
+        """Return the cached value for (user_id, name), computing and storing it on a miss."""
+        with self._lock:
+            key = (user_id, self._generations.get(user_id, 0), name)
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        value = compute()  # outside the lock: may do DB/file I/O
+
+        with self._lock:
+            if self.max_entries > 0 and key[1] == self._generations.get(user_id, 0):
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries,
+                    "hits": self.hits, "misses": self.misses}
+
+
+user_cache = UserCache(int(os.environ.get("TG_CACHE_MAX_ENTRIES", "256")))
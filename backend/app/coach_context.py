@@ -0,0 +1,342 @@
+"""
+coach_context.py
+----------------
+Precomputed coaching context for /api/chat.
+
+build_summary() turns one user's pipeline outputs (trades, tags, trade_scores,
+day_scores) into a compact summary. The summary is a list of sections, each a
+list of ready-to-print lines. Sections are ranked (most useful first) and so
+are the lines within each section:
+
+    TRADING OVERVIEW          totals, win rate, P&L, avg win/loss, profit factor
+    BEHAVIOR FLAG RATES       share of trades/days with score >= FLAG_THRESHOLD
+    STREAKS                   longest win/loss runs, current run
+    WORST TICKERS             tickers by total P&L, ascending
+    REPRESENTATIVE TRADES     biggest loss/win + the strongest example per behavior
+    MOST FLAGGED TRADES       top trades by summed flagged score (labels.compress_scores
+                              over the stored SparseLabels)
+    RECENT TRADES             newest first
+    BEST TICKERS
+    RULE TAGS                 tag frequencies from the rule engine
+
+The importer (ingest_to_supabase.import_outputs) builds the summary from the
+stored rows once per import, so trade ids match the database, and saves it to
+data/coaching/<user_id>.json. If the file is missing, load_or_build() rebuilds it
+the same way. At request time render_context() fills a token budget
+from request-specific sections and the summary, in rank order. The prompt
+therefore stays bounded no matter how much history the user has.
+
+Tokens are estimated at ~4 characters each; no tokenizer dependency.
+
+Configuration (env):
+    TG_CHAT_CONTEXT_TOKENS   budget for the context block of the system prompt (default 1500)
+    TG_CHAT_HISTORY_TOKENS   budget for conversation history sent with a message (default 2000)
+"""
+
+from __future__ import annotations
+import json
+import os
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from .cache import user_cache
+from .labels import SparseLabels, compress_scores
+
+SUMMARY_DIR = Path(__file__).resolve().parent.parent / "data" / "coaching"
+SUMMARY_VERSION = 2
+CONTEXT_TOKENS = int(os.environ.get("TG_CHAT_CONTEXT_TOKENS", "1500"))
+HISTORY_TOKENS = int(os.environ.get("TG_CHAT_HISTORY_TOKENS", "2000"))
+
+# Same cut-off the prompt tells the model to use for "meaningful" scores
+FLAG_THRESHOLD = 0.6
+# Outcome scores restate P&L; they are covered by the overview, not flag rates
+OUTCOME_COLS = {"outcome_win", "outcome_loss", "outcome_breakeven"}
+ID_COLS = {"user_id", "trade_id", "trade_date", "day", "ticker"}
+
+RECENT_TRADES = 20
+MOST_FLAGGED = 10
+TICKERS = 8
+RULE_TAGS = 15
+
+Section = Dict[str, object]  # {"title": str, "lines": [str, ...]}
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+# ---------- Build ----------
+def _score_cols(df: Optional[pd.DataFrame]) -> List[str]:
+    if df is None or df.empty:
+        return []
+    return [c for c in df.columns
+            if c not in ID_COLS and c not in OUTCOME_COLS and pd.api.types.is_numeric_dtype(df[c])]
+
+def _trade_line(t, extra: str = "") -> str:
+    line = f"- {t['ticker']} ({t['side']}) on {t['trade_date']}: ${t['realized_pnl']:.2f}"
+    mood = t.get("mood") or ""
+    if mood:
+        line += f", Mood: {mood}"
+    return line + extra
+
+def _ordered_trades(trades: pd.DataFrame) -> pd.DataFrame:
+    t = trades.copy()
+    t["trade_date"] = pd.to_datetime(t["trade_date"]).dt.strftime("%Y-%m-%d")
+    t["realized_pnl"] = pd.to_numeric(t["realized_pnl"], errors="coerce").fillna(0.0)
+    for c in ("ticker", "side", "mood"):
+        t[c] = t[c].fillna("").astype(str) if c in t.columns else ""
+    keys = [c for c in ("trade_date", "trade_time", "trade_id") if c in t.columns]
+    return t.sort_values(keys, kind="stable").reset_index(drop=True)
+
+def _overview(t: pd.DataFrame) -> Section:
+    pnl = t["realized_pnl"].to_numpy()
+    n = len(pnl)
+    wins, losses = pnl[pnl > 0], pnl[pnl < 0]
+    lines = [
+        f"- Total Trades: {n} ({t['trade_date'].iloc[0]} to {t['trade_date'].iloc[-1]}, "
+        f"{t['trade_date'].nunique()} trading days)",
+        f"- Win Rate: {len(wins) / n * 100:.1f}% ({len(wins)} wins, {len(losses)} losses)",
+        f"- Total P&L: ${pnl.sum():.2f}",
+        f"- Average P&L per Trade: ${pnl.mean():.2f}",
+    ]
+    if len(wins) and len(losses):
+        lines.append(f"- Average Win: ${wins.mean():.2f}, Average Loss: ${losses.mean():.2f}")
+        lines.append(f"- Profit Factor: {wins.sum() / -losses.sum():.2f}")
+    return {"title": "TRADING OVERVIEW", "lines": lines}
+
+def _flag_rates(t: pd.DataFrame, scored: Optional[pd.DataFrame], score_cols: List[str],
+                day_scores: Optional[pd.DataFrame]) -> Section:
+    rows = []  # (rate, line)
+    if scored is not None:
+        n = len(scored)
+        for c in score_cols:
+            flagged = scored[c].fillna(0).to_numpy() >= FLAG_THRESHOLD
+            k = int(flagged.sum())
+            if k:
+                avg = scored.loc[flagged, "realized_pnl"].mean()
+                rows.append((k / n, f"- {c}: {k} of {n} trades ({k / n * 100:.1f}%), "
+                                    f"avg P&L ${avg:.2f} when flagged"))
+    if day_scores is not None and not day_scores.empty:
+        n = len(day_scores)
+        day_pnl = t.groupby("trade_date")["realized_pnl"].sum()
+        days = day_scores["trade_date"].to_numpy()
+        for c in _score_cols(day_scores):
+            flagged = day_scores[c].fillna(0).to_numpy() >= FLAG_THRESHOLD
+            k = int(flagged.sum())
+            if k:
+                avg = day_pnl.reindex(days[flagged]).fillna(0).mean()
+                rows.append((k / n, f"- {c}: {k} of {n} days ({k / n * 100:.1f}%), "
+                                    f"avg day P&L ${avg:.2f} when flagged"))
+    rows.sort(key=lambda r: -r[0])
+    return {"title": f"BEHAVIOR FLAG RATES (score >= {FLAG_THRESHOLD})", "lines": [r[1] for r in rows]}
+
+def _streaks(t: pd.DataFrame) -> Section:
+    sign = np.sign(t["realized_pnl"].to_numpy())
+    run = np.r_[0, np.cumsum(sign[1:] != sign[:-1])]
+    runs = pd.DataFrame({"sign": sign, "run": run, "date": t["trade_date"].to_numpy(),
+                         "pnl": t["realized_pnl"].to_numpy()})
+    agg = runs.groupby("run").agg(sign=("sign", "first"), n=("sign", "size"),
+                                  start=("date", "first"), end=("date", "last"), pnl=("pnl", "sum"))
+    lines = []
+    for s, label in ((1, "win"), (-1, "loss")):
+        r = agg[agg["sign"] == s]
+        if not r.empty:
+            best = r.loc[r["n"].idxmax()]
+            lines.append(f"- Longest {label} streak: {int(best['n'])} trades "
+                         f"({best['start']} to {best['end']}, ${best['pnl']:.2f})")
+    last = agg.iloc[-1]
+    label = {1: "winning", -1: "losing", 0: "breakeven"}[int(last["sign"])]
+    lines.append(f"- Current streak: {int(last['n'])} {label} trade(s) since {last['start']}")
+    return {"title": "STREAKS", "lines": lines}
+
+def _tickers(t: pd.DataFrame, worst: bool) -> Section:
+    g = t.assign(win=t["realized_pnl"] > 0).groupby("ticker").agg(
+        total=("realized_pnl", "sum"), n=("win", "size"), wins=("win", "sum"))
+    g = g[g["total"] < 0].sort_values("total") if worst else g[g["total"] > 0].sort_values("total", ascending=False)
+    lines = [f"- {tk}: ${total:.2f} over {n} trades, win rate {wins / n * 100:.0f}%"
+             for tk, total, n, wins in g.head(TICKERS).itertuples()]
+    return {"title": "WORST TICKERS (by total P&L)" if worst else "BEST TICKERS (by total P&L)", "lines": lines}
+
+def _representative(t: pd.DataFrame, scored: Optional[pd.DataFrame], score_cols: List[str],
+                    order: List[str]) -> Section:
+    lines, seen = [], set()
+    i = t["realized_pnl"].idxmin()
+    if t.at[i, "realized_pnl"] < 0:
+        lines.append(_trade_line(t.loc[i], " (biggest loss)"))
+        seen.add(i)
+    i = t["realized_pnl"].idxmax()
+    if t.at[i, "realized_pnl"] > 0:
+        lines.append(_trade_line(t.loc[i], " (biggest win)"))
+        seen.add(i)
+    if scored is not None:
+        flags = scored[score_cols].fillna(0).to_numpy() >= FLAG_THRESHOLD
+        for c in order:
+            if c not in score_cols:
+                continue
+            cand = scored[scored[c].fillna(0) >= FLAG_THRESHOLD]
+            cand = cand[~cand["_pos"].isin(seen)]
+            if cand.empty:
+                continue
+            best = cand.sort_values([c, "realized_pnl"], ascending=[False, True]).iloc[0]
+            pos = int(best["_pos"])
+            seen.add(pos)
+            row_flags = [f for f, on in zip(score_cols, flags[scored.index.get_loc(best.name)]) if on]
+            lines.append(_trade_line(t.loc[pos], f" (example of {c}; flags: {', '.join(row_flags)})"))
+    return {"title": "REPRESENTATIVE TRADES", "lines": lines}
+
+def _most_flagged(scored: Optional[pd.DataFrame], score_cols: List[str],
+                  labels: Optional[SparseLabels] = None) -> Section:
+    lines = []
+    source = None
+    if labels is not None:
+        source = labels.select(score_cols)
+    elif scored is not None:
+        source = scored[["trade_id", "trade_date", "ticker"] + score_cols]
+    if source is not None:
+        top = compress_scores(source, threshold=FLAG_THRESHOLD, top_n=MOST_FLAGGED, as_frame=True)
+        days = pd.to_datetime(top["trade_date"]).dt.strftime("%Y-%m-%d")
+        lines = [f"- {ticker} on {day} (trade_id={tid}): {', '.join(tags)}"
+                 for tid, day, ticker, tags in zip(top["trade_id"].tolist(), days.tolist(),
+                                                   top["ticker"].tolist(), top["tags"].tolist())]
+    return {"title": f"MOST FLAGGED TRADES (score >= {FLAG_THRESHOLD})", "lines": lines}
+
+def _recent(t: pd.DataFrame) -> Section:
+    return {"title": f"RECENT TRADES (last {RECENT_TRADES}, newest first)",
+            "lines": [_trade_line(r) for _, r in t.iloc[::-1].head(RECENT_TRADES).iterrows()]}
+
+def _rule_tags(tags: Optional[pd.DataFrame]) -> Section:
+    lines = []
+    if tags is not None and not tags.empty and "tag" in tags.columns:
+        counts = tags["tag"].value_counts()
+        lines = [f"- {tag}: {n} occurrences" for tag, n in counts.head(RULE_TAGS).items()]
+    return {"title": "RULE TAGS (rule engine)", "lines": lines}
+
+def build_summary(trades: pd.DataFrame, tags: Optional[pd.DataFrame] = None,
+                  trade_scores: Optional[pd.DataFrame] = None,
+                  day_scores: Optional[pd.DataFrame] = None,
+                  user_id: Optional[str] = None,
+                  labels: Optional[SparseLabels] = None) -> dict:
+    """
+    Ranked coaching summary for one user's pipeline outputs (JSON-serializable).
+    labels (Storage.labels()) feeds MOST FLAGGED TRADES from the sparse scores.
+    """
+    sections: List[Section] = []
+    if trades is not None and not trades.empty:
+        t = _ordered_trades(trades)
+
+        scored, score_cols = None, _score_cols(trade_scores)
+        if score_cols and "trade_id" in t.columns:
+            scored = (t.assign(_pos=np.arange(len(t)))
+                       .merge(trade_scores[["trade_id"] + score_cols], on="trade_id", how="inner"))
+        if day_scores is not None and not day_scores.empty:
+            day_scores = day_scores.rename(columns={"day": "trade_date"})
+            day_scores = day_scores.assign(
+                trade_date=pd.to_datetime(day_scores["trade_date"]).dt.strftime("%Y-%m-%d"))
+
+        rates = _flag_rates(t, scored, score_cols, day_scores)
+        order = [line[2:].split(":", 1)[0] for line in rates["lines"]]
+        sections = [
+            _overview(t),
+            rates,
+            _streaks(t),
+            _tickers(t, worst=True),
+            _representative(t, scored, score_cols, order),
+            _most_flagged(scored, score_cols, labels),
+            _recent(t),
+            _tickers(t, worst=False),
+            _rule_tags(tags),
+        ]
+    return {
+        "version": SUMMARY_VERSION,
+        "user_id": user_id,
+        "built_at": datetime.now(timezone.utc).isoformat(),
+        "sections": [s for s in sections if s["lines"]],
+    }
+
+def summary_from_storage(storage, user_id: str) -> dict:
+    """Rebuild the summary from what is stored for user_id (used when no saved summary exists)."""
+    trades = pd.DataFrame(storage.trades(user_id))
+    data = storage.behavioral_data(user_id)
+    return build_summary(
+        trades,
+        tags=pd.DataFrame(data["tags"]),
+        trade_scores=pd.DataFrame(data["trade_scores"]),
+        day_scores=pd.DataFrame(data["day_scores"]),
+        user_id=user_id,
+        labels=storage.labels(user_id),
+    )
+
+
+# ---------- Persist ----------
+def summary_path(user_id: str) -> Path:
+    return SUMMARY_DIR / f"{user_id}.json"
+
+def save_summary(summary: dict) -> Path:
+    path = summary_path(summary["user_id"])
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_text(json.dumps(summary))
+    os.replace(tmp, path)  # readers see the old or the new file, never half of one
+    return path
+
+def load_summary(user_id: str) -> Optional[dict]:
+    path = summary_path(user_id)
+    if not path.exists():
+        return None
+    summary = json.loads(path.read_text())
+    if summary.get("version") != SUMMARY_VERSION or summary.get("user_id") != user_id:
+        return None
+    return summary
+
+def summary_version(user_id: str) -> Optional[str]:
+    """
+    Identity of the saved summary file (inode, mtime, size), or None; every import
+    and reset replaces the file, in any process. A stat, not a read, so it is cheap
+    enough to check on every cached lookup.
+    """
+    try:
+        st = summary_path(user_id).stat()
+    except FileNotFoundError:
+        return None
+    return f"{st.st_ino}-{st.st_mtime_ns}-{st.st_size}"
+
+def discard_summary(user_id: str) -> None:
+    summary_path(user_id).unlink(missing_ok=True)
+
+def load_or_build(user_id: str, storage) -> dict:
+    summary = load_summary(user_id)
+    if summary is None:
+        generation = user_cache.generation(user_id)
+        summary = summary_from_storage(storage, user_id)
+        # An import or reset during the rebuild owns the file now; don't overwrite it
+        if user_cache.generation(user_id) == generation:
+            save_summary(summary)
+    return summary
+
+
+# ---------- Render ----------
+def render_context(sections: List[Section], budget_tokens: int = CONTEXT_TOKENS) -> str:
+    """
+    Concatenate sections in order, each as "TITLE:" plus as many of its lines as
+    still fit in budget_tokens. A section whose first line does not fit is skipped;
+    later (shorter) sections may still fit.
+    """
+    out, used = [], 0
+    for section in sections:
+        header = f"\n\n{section['title']}:\n"
+        cost, lines = estimate_tokens(header), []
+        for line in section["lines"]:
+            c = estimate_tokens(line) + 1
+            if used + cost + c > budget_tokens:
+                break
+            lines.append(line)
+            cost += c
+        if lines:
+            out.append(header + "\n".join(lines) + "\n")
+            used += cost
+    return "".join(out)
@@ -0,0 +1,96 @@
+"""
+db.py
+-----
+Process-wide psycopg connection pool shared by the API and the importer.
+
+The FastAPI app opens the pool at startup (open_pool) and closes it at shutdown;
+every DB touch point borrows a connection with `with connection() as con:`.
+Outside the API (scripts, CLI importer) no pool is open and connection() falls
+back to a one-off autocommit connection.
+
+Configuration (env):
+    DATABASE_URL              Postgres/Supabase connection string
+    TG_DB_POOL_MIN            min pooled connections (default 1)
+    TG_DB_POOL_MAX            max pooled connections (default 10)
+    TG_DB_PREPARE_THRESHOLD   psycopg prepare_threshold (default 5; "none" disables
+                              server-side prepared statements, e.g. behind a
+                              transaction-mode pooler)
+    TG_DB_POOL_MAX_IDLE       seconds before an idle connection is closed (default 300)
+
+The API opens the pool with the connections its request handlers may hold
+reserved; imports share the rest (write_share()) for concurrent table loads.
+"""
+
+from __future__ import annotations
+import os
+from contextlib import contextmanager
+from typing import Optional
+
+import psycopg
+from psycopg_pool import ConnectionPool
+
+_pool: Optional[ConnectionPool] = None
+_write_share: Optional[int] = None
+
+
+def database_url() -> Optional[str]:
+    return os.environ.get("DATABASE_URL")
+
+def _prepare_threshold() -> Optional[int]:
+    raw = os.environ.get("TG_DB_PREPARE_THRESHOLD", "5").strip().lower()
+    return None if raw in ("", "none", "off") else int(raw)
+
+def _connect_kwargs() -> dict:
+    return {"autocommit": True, "prepare_threshold": _prepare_threshold()}
+
+def open_pool(wait: bool = False, reserved: int = 0, writers: int = 1) -> Optional[ConnectionPool]:
+    """
+    Create and open the shared pool (no-op without DATABASE_URL or if already open).
+
+    reserved connections are left to request handlers; the rest is split among
+    `writers` imports that may run at once (see write_share()).
+    """
+    global _pool, _write_share
+    url = database_url()
+    if _pool is not None or not url:
+        return _pool
+    _pool = ConnectionPool(
+        url,
+        min_size=int(os.environ.get("TG_DB_POOL_MIN", "1")),
+        max_size=int(os.environ.get("TG_DB_POOL_MAX", "10")),
+        max_idle=float(os.environ.get("TG_DB_POOL_MAX_IDLE", "300")),
+        kwargs=_connect_kwargs(),
+        check=ConnectionPool.check_connection,
+        name="tradegist",
+        open=False,
+    )
+    _pool.open(wait=wait)
+    _write_share = max((_pool.max_size - reserved) // max(writers, 1), 1)
+    return _pool
+
+def close_pool() -> None:
+    global _pool, _write_share
+    if _pool is not None:
+        _pool.close()
+        _pool = None
+        _write_share = None
+
+def get_pool() -> Optional[ConnectionPool]:
+    return _pool
+
+def write_share() -> Optional[int]:
+    """Pooled connections one import may hold at once (None without a pool: connections are one-off)."""
+    return _write_share if _pool is not None else None
+
+@contextmanager
+def connection():
+    """Borrow an autocommit connection from the pool (or open a one-off one)."""
+    if _pool is not None:
+        with _pool.connection() as con:
+            yield con
+        return
+    url = database_url()
+    if not url:
+        raise RuntimeError("DATABASE_URL not set")
+    with psycopg.connect(url, **_connect_kwargs()) as con:
+        yield con
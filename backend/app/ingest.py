@@ -12,6 +12,7 @@ INPUT columns (case-insensitive): date, ticker, action, quantity, price, amount
 Notes:
 - For non-trades, quantity/price can be empty.
 - For trades, we use FIFO lot matching to reconstruct round-trips (long/short).
+- daily_pnl() rolls round-trips up to one realized PnL row per (user_id, day).
 """
 
 import argparse
@@ -32,6 +33,8 @@ CASHEVENTS_COLS = [
     "event_id","user_id","date","event_type","amount","note"
 ]
 
+DAILY_PNL_COLS = ["user_id","day","realized_pnl","trades"]
+
 # ---------- Helpers ----------
 
 def _pick(df: pd.DataFrame, name_candidates) -> str:
@@ -195,6 +198,22 @@ def fifo_round_trips(execs: pd.DataFrame) -> pd.DataFrame:
             trades[col] = "" if col not in ("fees","realized_pnl","qty","entry_price","exit_price","hold_time_sec") else 0.0
     return trades[TRADES_COLS]
 
+def daily_pnl(trades: pd.DataFrame) -> pd.DataFrame:
+    """
+    Realized PnL per (user_id, day) from round-trip trades, in one grouped aggregation.
+    Output columns: DAILY_PNL_COLS
+    """
+    if trades.empty:
+        return pd.DataFrame(columns=DAILY_PNL_COLS)
+    df = trades.assign(
+        day=pd.to_datetime(trades["trade_date"]).dt.date,
+        realized_pnl=pd.to_numeric(trades["realized_pnl"], errors="coerce").fillna(0.0),
+    )
+    out = (df.groupby(["user_id","day"], sort=True)
+             .agg(realized_pnl=("realized_pnl","sum"), trades=("realized_pnl","size"))
+             .reset_index())
+    return out[DAILY_PNL_COLS]
+
 def main():
     ap = argparse.ArgumentParser(description="Ingest minimal ledger (date,ticker,action,quantity,price,amount).")
     ap.add_argument("path", help="CSV/XLSX path")
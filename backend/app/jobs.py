@@ -0,0 +1,162 @@
+"""
+jobs.py
+-------
+Background jobs for long-running work (CSV imports), so the HTTP request that
+starts one returns a job id right away instead of holding a connection open
+through ingest, features, rules, labels and the DB import.
+
+Jobs run on their own bounded thread pool (TG_IMPORT_WORKERS), separate from
+the API's run_blocking limiter. Queued imports wait for a free worker and can
+never take the threads interactive requests need.
+
+A job records per-stage status, row counts and timings:
+
+    with job.stage("features") as st:
+        feat = compute_features(trades)
+        st["rows"] = len(feat)
+
+Readers poll job.snapshot(); job.version increases on every change, so a
+progress stream only sends when something moved. Finished jobs are kept in
+memory for TG_IMPORT_JOB_TTL seconds, then dropped.
+
+Configuration (env):
+    TG_IMPORT_WORKERS   concurrent import jobs (default 2)
+    TG_IMPORT_JOB_TTL   seconds a finished job stays queryable (default 3600)
+"""
+
+from __future__ import annotations
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+IMPORT_WORKERS = int(os.environ.get("TG_IMPORT_WORKERS", "2"))
+JOB_TTL = float(os.environ.get("TG_IMPORT_JOB_TTL", "3600"))
+
+FINISHED = ("done", "failed")
+
+
+class Job:
+    """One background job: status, stages, result; all changes bump version."""
+
+    def __init__(self, kind: str, user_id: str, **info):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.user_id = user_id
+        self.info = info
+        self.status = "queued"
+        self.stages: List[Dict[str, Any]] = []
+        self.result: Optional[dict] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.version = 0
+        self._lock = threading.Lock()
+
+    def _changed(self) -> None:
+        self.version += 1
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Record a pipeline stage; the yielded dict takes extra fields (rows, or
+        error for a failure the pipeline recovers from).
+        """
+        st = {"name": name, "status": "running", "rows": None, "seconds": None}
+        with self._lock:
+            self.stages.append(st)
+            self._changed()
+        t0 = time.perf_counter()
+        try:
+            yield st
+        except Exception:
+            with self._lock:
+                st.update(status="failed", seconds=round(time.perf_counter() - t0, 3))
+                self._changed()
+            raise
+        with self._lock:
+            st.update(status="failed" if st.get("error") else "done",
+                      seconds=round(time.perf_counter() - t0, 3))
+            self._changed()
+
+    def _set(self, **fields) -> None:
+        with self._lock:
+            for k, v in fields.items():
+                setattr(self, k, v)
+            self._changed()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "kind": self.kind,
+                **self.info,
+                "status": self.status,
+                "stages": [dict(s) for s in self.stages],
+                "result": self.result,
+                "error": self.error,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "seconds": round((self.finished_at or time.time()) - self.started_at, 3)
+                           if self.started_at else None,
+                "version": self.version,
+            }
+
+
+class JobQueue:
+    """Bounded worker pool plus an in-memory registry of recent jobs."""
+
+    def __init__(self, max_workers: int, ttl: float):
+        self.max_workers = max(max_workers, 1)
+        self.ttl = ttl
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def _run(self, job: Job, fn: Callable[[Job], dict]) -> None:
+        job._set(status="running", started_at=time.time())
+        try:
+            result = fn(job)
+            job._set(status="done", result=result, finished_at=time.time())
+        except Exception as e:
+            traceback.print_exc()
+            job._set(status="failed", error=str(e), finished_at=time.time())
+
+    def submit(self, kind: str, user_id: str, fn: Callable[[Job], dict], **info) -> Job:
+        """Queue fn(job) and return the job immediately."""
+        job = Job(kind, user_id, **info)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=kind)
+            self._executor.submit(self._run, job, fn)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _prune(self) -> None:
+        cutoff = time.time() - self.ttl
+        for job_id in [k for k, j in self._jobs.items() if j.finished and j.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+import_jobs = JobQueue(IMPORT_WORKERS, JOB_TTL)
@@ -7,9 +7,29 @@ Outputs:
 - trade_scores: one row per (user_id, trade_id) with confidence per TRADE_TAGS
 - day_scores:   one row per (user_id, trade_date) with confidence per DAY_TAGS
 - trade_scores_with_day: trade_scores enriched with day tag scores for that trade_date
+
+build_labels() pivots with pandas; build_labels_scatter() produces the same frames by
+scattering confidences into preallocated float64 matrices (no pivot_table / merges).
+Benchmark both with:  python -m app.labels --bench 2000000
+
+SparseLabels stores trade_scores(_with_day) as a trade x tag CSR matrix holding only
+emitted scores, with threshold queries (above/flagged), densification (to_dense) and
+a long [.., tag, score] form for CSV/DB I/O (to_long/from_long). tags_raw is already
+that long form, so Storage.labels() reads a user's labels back without the dense
+score tables.
+
+compress_scores() reduces any of these score tables (frame, CSV/parquet path,
+LazyTradeDayScores or SparseLabels) to per-trade lists of tags at or above a
+threshold, optionally only the top-N trades by flagged score.
+Benchmark with:  python -m app.labels --bench-compress 1000000
 """
 
 from __future__ import annotations
+import argparse
+import gc
+import time
+from pathlib import Path
+import numpy as np
 import pandas as pd
 
 # Keep these lists in sync with rules.py
@@ -53,7 +73,8 @@ def _pivot_scores(df: pd.DataFrame, index_cols, tag_list):
     )
     return wide
 
-def build_labels(trades: pd.DataFrame, tags: pd.DataFrame, propagate_day_to_trades: bool = True):
+def build_labels(trades: pd.DataFrame, tags: pd.DataFrame, propagate_day_to_trades: bool = True,
+                 return_sparse: bool = False):
     """
     Parameters
     ----------
@@ -62,14 +83,18 @@ def build_labels(trades: pd.DataFrame, tags: pd.DataFrame, propagate_day_to_trad
     tags : DataFrame
         Output of run_all_rules(); columns:
         [user_id, trade_id (nullable), trade_date, tag, confidence, rationale, scope, source]
-    propagate_day_to_trades : bool
+    propagate_day_to_trades : bool | "lazy"
         If True, merge day-level scores onto each trade row (by user_id + trade_date).
+        If "lazy", return a LazyTradeDayScores view instead of the joined frame.
+    return_sparse : bool
+        If True, also return a SparseLabels (trade x tag CSR) of trade_scores_with_day.
 
     Returns
     -------
     trade_scores : DataFrame
     day_scores : DataFrame
-    trade_scores_with_day : DataFrame
+    trade_scores_with_day : DataFrame (LazyTradeDayScores if propagate_day_to_trades="lazy")
+    sparse : SparseLabels (only if return_sparse=True)
     """
     t = tags.copy()
     t["trade_date"] = pd.to_datetime(t["trade_date"])
@@ -99,7 +124,9 @@ def build_labels(trades: pd.DataFrame, tags: pd.DataFrame, propagate_day_to_trad
     day_scores[DAY_TAGS] = day_scores[DAY_TAGS].fillna(0.0)
 
     # --- Optionally propagate day scores to trades
-    if propagate_day_to_trades:
+    if propagate_day_to_trades == "lazy":
+        trade_scores_with_day = LazyTradeDayScores(trade_scores, day_scores)
+    elif propagate_day_to_trades:
         trade_scores_with_day = trade_scores.merge(day_scores, on=["user_id","trade_date"], how="left", suffixes=("", "_day"))
         for c in DAY_TAGS:
             if c not in trade_scores_with_day.columns:
@@ -108,4 +135,472 @@ def build_labels(trades: pd.DataFrame, tags: pd.DataFrame, propagate_day_to_trad
     else:
         trade_scores_with_day = trade_scores.copy()
 
+    if return_sparse:
+        sparse = SparseLabels.from_tags(trades, tags, propagate_day_to_trades)
+        return trade_scores, day_scores, trade_scores_with_day, sparse
     return trade_scores, day_scores, trade_scores_with_day
+
+
+# ---------- Scatter-based builder ----------
+def _row_index(keys: pd.DataFrame, cols) -> pd.MultiIndex:
+    return pd.MultiIndex.from_arrays([keys[c] for c in cols])
+
+def _trade_keys(df: pd.DataFrame, numeric_ids: bool) -> pd.MultiIndex:
+    # tags carry trade_id as float (NaN for day rows); compare ids in one dtype
+    ids = pd.to_numeric(df["trade_id"], errors="coerce").astype(float) if numeric_ids else df["trade_id"].astype(str)
+    return pd.MultiIndex.from_arrays([df["user_id"], ids])
+
+def _conf(df: pd.DataFrame) -> np.ndarray:
+    if "confidence" not in df.columns:
+        return np.ones(len(df), dtype=np.float64)
+    return pd.to_numeric(df["confidence"], errors="coerce").fillna(0.0).to_numpy(np.float64)
+
+def _label_index(trades: pd.DataFrame, tags: pd.DataFrame):
+    """
+    Map trades/days to row indices and tags to column indices once.
+
+    Returns
+    -------
+    base : trade rows [user_id, trade_id, trade_date, ticker]
+    days : day rows [user_id, trade_date]
+    trade_day : day row of each trade row
+    trade_coo, day_coo : (rows, cols, conf) of matched trade / day tags
+    """
+    base = trades[["user_id","trade_id","trade_date","ticker"]].copy()
+    base["trade_date"] = pd.to_datetime(base["trade_date"])
+    base = base.reset_index(drop=True)
+
+    days = base[["user_id","trade_date"]].drop_duplicates().reset_index(drop=True)
+    day_index = _row_index(days, ["user_id","trade_date"])
+    trade_day = day_index.get_indexer(_row_index(base, ["user_id","trade_date"]))
+
+    tr = tags.loc[(tags["scope"]=="trade").to_numpy()]
+    numeric_ids = pd.api.types.is_numeric_dtype(base["trade_id"])
+    tr_rows = _trade_keys(base, numeric_ids).get_indexer(_trade_keys(tr, numeric_ids))
+    tr_cols = pd.Index(TRADE_TAGS).get_indexer(tr["tag"])
+
+    dr = tags.loc[(tags["scope"]=="day").to_numpy()]
+    dr_rows = day_index.get_indexer(pd.MultiIndex.from_arrays([dr["user_id"], pd.to_datetime(dr["trade_date"])]))
+    dr_cols = pd.Index(DAY_TAGS).get_indexer(dr["tag"])
+
+    def matched(rows, cols, conf):
+        ok = (rows >= 0) & (cols >= 0)
+        return rows[ok], cols[ok], conf[ok]
+
+    return (base, days, trade_day,
+            matched(tr_rows, tr_cols, _conf(tr)),
+            matched(dr_rows, dr_cols, _conf(dr)))
+
+def _scatter_max(n_rows: int, n_cols: int, coo) -> np.ndarray:
+    """Max-reduce (rows, cols, conf) into a float64 matrix; unmatched cells are 0."""
+    rows, cols, conf = coo
+    m = np.full((n_rows, n_cols), -np.inf, dtype=np.float64)
+    np.maximum.at(m, (rows, cols), conf)
+    m[np.isneginf(m)] = 0.0
+    return m
+
+def _with_scores(base: pd.DataFrame, m: np.ndarray, tag_list) -> pd.DataFrame:
+    scores = pd.DataFrame(m, columns=tag_list, index=base.index)
+    return pd.concat([base, scores], axis=1)
+
+def build_labels_scatter(trades: pd.DataFrame, tags: pd.DataFrame, propagate_day_to_trades: bool = True):
+    """
+    Same contract as build_labels(), built by index mapping + scatter instead of pivots.
+
+    Trades and days are mapped to row indices and tags to column indices once;
+    confidences are max-reduced into preallocated float64 matrices, so scores are
+    bit-identical to build_labels(). Day scores are propagated to trades by
+    gathering day rows through the trade -> day index.
+    """
+    base, days, trade_day, trade_coo, day_coo = _label_index(trades, tags)
+    trade_m = _scatter_max(len(base), len(TRADE_TAGS), trade_coo)
+    day_m = _scatter_max(len(days), len(DAY_TAGS), day_coo)
+
+    trade_scores = _with_scores(base, trade_m, TRADE_TAGS)
+    day_scores = _with_scores(days, day_m, DAY_TAGS)
+
+    # --- Optionally propagate day scores to trades (gather, no merge)
+    if propagate_day_to_trades == "lazy":
+        trade_scores_with_day = LazyTradeDayScores(trade_scores, day_scores, trade_day)
+    elif propagate_day_to_trades:
+        trade_scores_with_day = _with_scores(base, np.hstack([trade_m, day_m[trade_day]]), TRADE_TAGS + DAY_TAGS)
+    else:
+        trade_scores_with_day = trade_scores.copy()
+
+    return trade_scores, day_scores, trade_scores_with_day
+
+
+# ---------- Lazy day propagation ----------
+class LazyTradeDayScores:
+    """
+    trade_scores_with_day without the join.
+
+    Keeps trade_scores and day_scores separate plus a precomputed trade -> day row
+    index; a trade's day scores are gathered only when a consumer asks for them.
+    """
+
+    def __init__(self, trade_scores: pd.DataFrame, day_scores: pd.DataFrame, trade_day: np.ndarray = None):
+        self.trade_scores = trade_scores.reset_index(drop=True)
+        self.day_scores = day_scores.reset_index(drop=True)
+        if trade_day is None:
+            days = _row_index(self.day_scores.assign(trade_date=pd.to_datetime(self.day_scores["trade_date"])),
+                              ["user_id","trade_date"])
+            trade_day = days.get_indexer(_row_index(
+                self.trade_scores.assign(trade_date=pd.to_datetime(self.trade_scores["trade_date"])),
+                ["user_id","trade_date"]))
+        self.trade_day = np.asarray(trade_day)
+
+    def __len__(self) -> int:
+        return len(self.trade_scores)
+
+    @property
+    def columns(self):
+        return list(self.trade_scores.columns) + DAY_TAGS
+
+    def day_scores_for(self, positions=None) -> pd.DataFrame:
+        """DAY_TAGS scores for trade rows at `positions` (all trades if None); 0.0 if the day is unscored."""
+        idx = self.trade_day if positions is None else self.trade_day[np.asarray(positions)]
+        m = np.zeros((len(idx), len(DAY_TAGS)), dtype=np.float64)
+        ok = idx >= 0
+        m[ok] = self.day_scores[DAY_TAGS].to_numpy(np.float64)[idx[ok]]
+        return pd.DataFrame(m, columns=DAY_TAGS)
+
+    def take(self, positions) -> pd.DataFrame:
+        """Joined trade + day scores for a subset of trade rows."""
+        positions = np.asarray(positions)
+        trade = self.trade_scores.iloc[positions].reset_index(drop=True)
+        return pd.concat([trade, self.day_scores_for(positions)], axis=1)
+
+    def for_trades(self, trade_ids) -> pd.DataFrame:
+        """Joined rows for the given trade_ids."""
+        return self.take(np.flatnonzero(self.trade_scores["trade_id"].isin(list(trade_ids)).to_numpy()))
+
+    def to_frame(self) -> pd.DataFrame:
+        """Materialize the full trade_scores_with_day frame (e.g. for export)."""
+        return self.take(np.arange(len(self.trade_scores)))
+
+
+# ---------- Sparse labels ----------
+class SparseLabels:
+    """
+    CSR matrix of trade x tag confidences; only emitted (non-zero) scores are stored.
+
+    rows : DataFrame [user_id, trade_id, trade_date, ticker], one per matrix row
+    tags : column tag codes (TRADE_TAGS, plus DAY_TAGS when day scores are propagated)
+    indptr, indices, data : CSR arrays (data is float32, columns sorted within a row)
+    """
+
+    def __init__(self, rows: pd.DataFrame, tags, indptr: np.ndarray, indices: np.ndarray, data: np.ndarray):
+        self.rows = rows.reset_index(drop=True)
+        self.tags = list(tags)
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+
+    @classmethod
+    def from_coo(cls, rows: pd.DataFrame, tags, r: np.ndarray, c: np.ndarray, v: np.ndarray) -> "SparseLabels":
+        """Build from (row, col, value) triplets; duplicates keep the max value, zeros are dropped."""
+        key = np.asarray(r, dtype=np.int64) * len(tags) + np.asarray(c, dtype=np.int64)
+        v = np.asarray(v, dtype=np.float32)
+        order = np.argsort(key, kind="stable")
+        key, v = key[order], v[order]
+        starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]]) if len(key) else np.empty(0, dtype=np.int64)
+        key, v = key[starts], (np.maximum.reduceat(v, starts) if len(v) else v)
+        keep = v != 0
+        key, v = key[keep], v[keep]
+        r, c = np.divmod(key, len(tags))
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(r, minlength=len(rows)), out=indptr[1:])
+        return cls(rows, tags, indptr, c.astype(np.int32), v)
+
+    @classmethod
+    def from_tags(cls, trades: pd.DataFrame, tags: pd.DataFrame, propagate_day_to_trades: bool = True) -> "SparseLabels":
+        """Build directly from run_all_rules() output without densifying."""
+        base, days, trade_day, (tr_r, tr_c, tr_v), (dr_r, dr_c, dr_v) = _label_index(trades, tags)
+        if not propagate_day_to_trades:
+            return cls.from_coo(base, TRADE_TAGS, tr_r, tr_c, tr_v)
+
+        # Expand each day tag onto every trade of that day
+        by_day = np.argsort(trade_day, kind="stable")
+        counts = np.bincount(trade_day, minlength=len(days))
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        k = counts[dr_r]
+        offsets = np.arange(k.sum()) - np.repeat(np.cumsum(k) - k, k)
+        exp_r = by_day[np.repeat(starts[dr_r], k) + offsets]
+        return cls.from_coo(
+            base, TRADE_TAGS + DAY_TAGS,
+            np.concatenate([tr_r, exp_r]),
+            np.concatenate([tr_c, np.repeat(dr_c, k) + len(TRADE_TAGS)]),
+            np.concatenate([tr_v, np.repeat(dr_v, k)]),
+        )
+
+    @property
+    def shape(self):
+        return (len(self.rows), len(self.tags))
+
+    @property
+    def nnz(self) -> int:
+        return len(self.data)
+
+    def _row_of_nnz(self) -> np.ndarray:
+        return np.repeat(np.arange(len(self.rows)), np.diff(self.indptr))
+
+    def to_dense(self) -> pd.DataFrame:
+        """Densify to the trade_scores(_with_day) layout."""
+        m = np.zeros(self.shape, dtype=np.float32)
+        m[self._row_of_nnz(), self.indices] = self.data
+        return _with_scores(self.rows, m, self.tags)
+
+    def to_long(self) -> pd.DataFrame:
+        """One row per stored score: [user_id, trade_id, trade_date, ticker, tag, score]."""
+        out = self.rows.iloc[self._row_of_nnz()].reset_index(drop=True)
+        out["tag"] = np.asarray(self.tags, dtype=object)[self.indices]
+        out["score"] = self.data
+        return out
+
+    @classmethod
+    def from_long(cls, long: pd.DataFrame, rows: pd.DataFrame = None, tags=None) -> "SparseLabels":
+        """Inverse of to_long(); pass `rows` to keep trades with no scores."""
+        tags = list(tags or TRADE_TAGS + DAY_TAGS)
+        if rows is None:
+            rows = long[["user_id","trade_id","trade_date","ticker"]].drop_duplicates()
+        rows = rows.reset_index(drop=True)
+        r = _row_index(rows, ["user_id","trade_id"]).get_indexer(_row_index(long, ["user_id","trade_id"]))
+        c = pd.Index(tags).get_indexer(long["tag"])
+        ok = (r >= 0) & (c >= 0)
+        return cls.from_coo(rows, tags, r[ok], c[ok], long["score"].to_numpy(np.float32)[ok])
+
+    def select(self, tags) -> "SparseLabels":
+        """Only the given tag columns (in that order); unknown tags are skipped."""
+        tags = [t for t in tags if t in self.tags]
+        remap = np.full(len(self.tags), -1, dtype=np.int64)
+        remap[[self.tags.index(t) for t in tags]] = np.arange(len(tags))
+        c = remap[self.indices]
+        keep = c >= 0
+        return SparseLabels.from_coo(self.rows, tags, self._row_of_nnz()[keep], c[keep], self.data[keep])
+
+    def above(self, threshold: float = 0.6):
+        """
+        Rows with at least one score >= threshold:
+          [{ trade_id, trade_date, ticker, tags: [codes with score >= threshold] }, ...]
+        """
+        hit = self.data >= threshold
+        if not hit.any():
+            return []
+        r = self._row_of_nnz()[hit]
+        names = np.asarray(self.tags, dtype=object)[self.indices[hit]]
+        uniq, first = np.unique(r, return_index=True)
+        bounds = np.r_[first, len(r)].tolist()
+        names = names.tolist()
+        meta = self.rows.iloc[uniq]
+        days = pd.to_datetime(meta["trade_date"]).dt.strftime("%Y-%m-%d")
+        return [
+            {"trade_id": tid, "trade_date": day, "ticker": str(tkr), "tags": names[bounds[i]:bounds[i + 1]]}
+            for i, (tid, day, tkr) in enumerate(zip(meta["trade_id"].tolist(), days.tolist(), meta["ticker"].tolist()))
+        ]
+
+    def flagged(self, tag: str, threshold: float = 0.6) -> pd.DataFrame:
+        """Rows (trade metadata) whose `tag` score is >= threshold."""
+        j = self.tags.index(tag)
+        hit = (self.indices == j) & (self.data >= threshold)
+        return self.rows.iloc[self._row_of_nnz()[hit]].reset_index(drop=True)
+
+
+# ---------- Compressed flags ----------
+COMPRESS_ID_COLS = ("trade_id", "trade_date", "ticker")
+
+def _numeric_score_cols(df: pd.DataFrame):
+    return [c for c in df.columns if c not in COMPRESS_ID_COLS
+            and (pd.api.types.is_numeric_dtype(df[c]) or pd.api.types.is_bool_dtype(df[c]))]
+
+def _flag_matrix(source, threshold: float, with_score: bool = False):
+    """(row metadata, tag names, n x k hit mask, per-row sum of flagged scores or None) for a scores source."""
+    if isinstance(source, (str, Path)):
+        path = Path(source)
+        source = pd.read_parquet(path) if path.suffix == ".parquet" else pd.read_csv(path)
+
+    if isinstance(source, SparseLabels):
+        row = source._row_of_nnz()
+        h = source.data >= threshold
+        hit = np.zeros(source.shape, dtype=bool)
+        hit[row[h], source.indices[h]] = True
+        score = np.bincount(row[h], weights=source.data[h], minlength=len(source.rows)) if with_score else None
+        return source.rows, source.tags, hit, score
+
+    if isinstance(source, LazyTradeDayScores):
+        meta = source.trade_scores
+        cols = _numeric_score_cols(meta)
+        blocks = [(c, meta[c].to_numpy()) for c in cols]
+        day = source.day_scores_for()
+        blocks += [(c, day[c].to_numpy()) for c in DAY_TAGS]
+    else:
+        meta = source
+        blocks = [(c, source[c].to_numpy()) for c in _numeric_score_cols(source)]
+
+    # One column at a time: no n x k float copy of the whole table
+    hit = np.empty((len(meta), len(blocks)), dtype=bool)
+    score = np.zeros(len(meta), dtype=np.float64) if with_score else None
+    for j, (_, v) in enumerate(blocks):
+        if v.dtype == object:
+            v = pd.to_numeric(v, errors="coerce")
+        np.greater_equal(v, threshold, out=hit[:, j])  # NaN compares False
+        if with_score:
+            score += np.where(hit[:, j], v, 0)
+    return meta, [c for c, _ in blocks], hit, score
+
+def _str_list(meta: pd.DataFrame, col: str, n: int) -> list:
+    """str() of every value, formatted once per distinct value."""
+    if col not in meta.columns:
+        return [""] * n
+    codes, uniques = pd.factorize(meta[col], use_na_sentinel=True)
+    names = np.asarray([str(u) for u in uniques] + ["nan"], dtype=object)
+    return names[codes].tolist()
+
+def _id_list(meta: pd.DataFrame) -> list:
+    if "trade_id" not in meta.columns:
+        return [None] * len(meta)
+    ids = pd.to_numeric(meta["trade_id"], errors="coerce")
+    na = ids.isna().to_numpy()
+    vals = ids.fillna(0).astype(np.int64).to_numpy().astype(object)
+    vals[na] = None
+    return vals.tolist()
+
+def _flag_patterns(hit: np.ndarray, tags):
+    """(tag-name tuple per distinct flag pattern, pattern index per row), from the column masks."""
+    n, k = hit.shape
+    if k == 0:
+        return [()], np.zeros(n, dtype=np.int64)
+    if k <= 63:
+        codes = np.zeros(n, dtype=np.int64)
+        for j in range(k):
+            codes |= hit[:, j].astype(np.int64) << j
+    else:
+        packed = np.ascontiguousarray(np.packbits(hit, axis=1))
+        codes = packed.view(np.dtype((np.void, packed.shape[1]))).ravel()
+    _, first, inverse = np.unique(codes, return_index=True, return_inverse=True)
+    patterns = [tuple(t for t, on in zip(tags, row) if on) for row in hit[first].tolist()]
+    return patterns, inverse.ravel()
+
+def compress_scores(source, threshold: float = 0.6, top_n: int = None, as_frame: bool = False):
+    """
+    Per-trade lists of behavior tags with score >= threshold:
+      [{ trade_id, trade_date, ticker, tags: [codes with score >= threshold] }, ...]
+
+    source : a trade_scores(_with_day) frame, a path to one (.csv or .parquet),
+             a LazyTradeDayScores or a SparseLabels.
+    top_n  : if given, only the top_n trades by summed flagged score (trades with
+             at least one flag), highest first; otherwise every row in input order.
+    as_frame : return a DataFrame [trade_id, trade_date, ticker, tags] instead, with
+             the id columns as given and tags as shared tuples. No per-row Python
+             objects, so use this for bulk (e.g. 1M-row) tables.
+
+    Score columns are the numeric columns other than trade_id/trade_date/ticker.
+    """
+    meta, tags, hit, score = _flag_matrix(source, threshold, with_score=top_n is not None)
+    if len(meta) == 0:
+        return pd.DataFrame(columns=list(COMPRESS_ID_COLS) + ["tags"]) if as_frame else []
+
+    if top_n is not None:
+        rows = np.flatnonzero(hit.any(axis=1))
+        if len(rows) > top_n:
+            part = np.argpartition(-score[rows], top_n - 1)[:top_n]
+            rows = rows[part]
+        rows = rows[np.lexsort((rows, -score[rows]))]
+        meta = meta.iloc[rows]
+        hit = hit[rows]
+
+    patterns, inverse = _flag_patterns(hit, tags)
+    if as_frame:
+        out = meta[[c for c in COMPRESS_ID_COLS if c in meta.columns]].reset_index(drop=True)
+        pattern_arr = np.empty(len(patterns), dtype=object)
+        pattern_arr[:] = patterns
+        out["tags"] = pattern_arr[inverse]
+        return out
+
+    # Millions of small containers: cyclic GC passes would only rescan them
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return [
+            {"trade_id": tid, "trade_date": day, "ticker": tkr, "tags": list(patterns[p])}
+            for tid, day, tkr, p in zip(_id_list(meta), _str_list(meta, "trade_date", len(meta)),
+                                        _str_list(meta, "ticker", len(meta)), inverse.tolist())
+        ]
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+# ---------- Benchmark ----------
+def _synthetic(n_tags: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    n_trades = max(n_tags // 4, 1)
+    users = np.array([f"user_{i}" for i in range(max(n_trades // 5000, 1))])
+    trades = pd.DataFrame({
+        "user_id": users[rng.integers(0, len(users), n_trades)],
+        "trade_id": np.arange(1, n_trades + 1),
+        "trade_date": pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 1000, n_trades), unit="D"),
+        "ticker": np.array(["AAPL","MSFT","TSLA","NVDA","AMD"])[rng.integers(0, 5, n_trades)],
+    })
+    n_day = n_tags // 3
+    pick = rng.integers(0, n_trades, n_tags)
+    tags = pd.DataFrame({
+        "user_id": trades["user_id"].to_numpy()[pick],
+        "trade_id": np.where(np.arange(n_tags) < n_day, np.nan, trades["trade_id"].to_numpy()[pick]),
+        "trade_date": trades["trade_date"].to_numpy()[pick],
+        "scope": np.where(np.arange(n_tags) < n_day, "day", "trade"),
+    })
+    tags["tag"] = np.where(tags["scope"]=="day",
+                           np.array(DAY_TAGS)[rng.integers(0, len(DAY_TAGS), n_tags)],
+                           np.array(TRADE_TAGS)[rng.integers(0, len(TRADE_TAGS), n_tags)])
+    tags["confidence"] = rng.choice([0.5, 0.6, 0.75, 0.8, 0.85, 0.9, 1.0], n_tags)
+    return trades, tags
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark build_labels vs build_labels_scatter.")
+    ap.add_argument("--bench", type=int, default=1_000_000, help="number of synthetic tags")
+    ap.add_argument("--bench-compress", type=int, default=None, metavar="ROWS",
+                    help="benchmark compress_scores on a ROWS-row trade_scores_with_day table instead")
+    args = ap.parse_args()
+
+    if args.bench_compress:
+        rng = np.random.default_rng(0)
+        n = args.bench_compress
+        # Mostly-zero scores, like real label matrices (~10% of cells emitted)
+        scores = np.where(rng.random((n, len(TRADE_TAGS + DAY_TAGS))) < 0.1,
+                          rng.choice(np.float32([0.5, 0.6, 0.75, 0.85, 0.9]), (n, len(TRADE_TAGS + DAY_TAGS))),
+                          np.float32(0))
+        df = pd.concat([pd.DataFrame({
+            "trade_id": np.arange(1, n + 1),
+            "trade_date": (pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 1000, n), unit="D")).strftime("%Y-%m-%d"),
+            "ticker": np.array(["AAPL","MSFT","TSLA","NVDA","AMD"])[rng.integers(0, 5, n)],
+        }), pd.DataFrame(scores, columns=TRADE_TAGS + DAY_TAGS)], axis=1)
+        for top_n, as_frame in ((None, True), (10, False), (None, False)):
+            t0 = time.perf_counter()
+            out = compress_scores(df, top_n=top_n, as_frame=as_frame)
+            print(f"compress_scores({n} rows, top_n={top_n}, as_frame={as_frame}): "
+                  f"{time.perf_counter() - t0:.3f}s, {len(out)} records")
+        return
+
+    trades, tags = _synthetic(args.bench)
+    print(f"Synthetic: {len(trades)} trades, {len(tags)} tags")
+
+    t0 = time.perf_counter()
+    ref = build_labels(trades, tags)
+    t1 = time.perf_counter()
+    new = build_labels_scatter(trades, tags)
+    t2 = time.perf_counter()
+    print(f"build_labels:         {t1 - t0:.2f}s")
+    print(f"build_labels_scatter: {t2 - t1:.2f}s  ({(t1 - t0) / max(t2 - t1, 1e-9):.1f}x)")
+
+    keys = [["user_id","trade_id"], ["user_id","trade_date"], ["user_id","trade_id"]]
+    for name, a, b, k in zip(["trade_scores","day_scores","trade_scores_with_day"], ref, new, keys):
+        a = a.sort_values(k).reset_index(drop=True)
+        b = b.sort_values(k).reset_index(drop=True)
+        score_cols = [c for c in a.columns if c not in ("user_id","trade_id","trade_date","ticker")]
+        same = np.array_equal(a[score_cols].to_numpy(), b[score_cols].to_numpy()) \
+            and (a[score_cols].dtypes == b[score_cols].dtypes).all()
+        print(f"  {name}: {'exact match' if same else 'MISMATCH'}")
+
+if __name__ == "__main__":
+    main()
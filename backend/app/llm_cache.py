@@ -0,0 +1,179 @@
+"""
+llm_cache.py
+------------
+Persistent cache of LLM chat replies, so repeated questions over unchanged data
+("how am I doing?") skip the model call.
+
+Key: sha256 over (user_id, normalized message, client context, recent history,
+model, system prompt). Messages are normalized by case, whitespace and trailing
+punctuation, so "How am I doing?" and "how am i doing" share an entry. The system
+prompt carries the server-side context, so a reply is only reused for the same
+rendered context.
+
+Each entry also records the user's data version (the identity of the saved
+coaching summary file, coach_context.summary_version). get() drops an entry whose
+version no longer matches, so imports from another process (the CLI importers)
+or before a restart invalidate it as well. Within the API process,
+invalidate_user() drops a user's replies on import/reset, and a reply computed
+across such a change is discarded rather than stored (see put(..., generation)).
+
+Entries live in a small SQLite file and expire after TG_LLM_CACHE_TTL seconds.
+Above TG_LLM_CACHE_MAX_ENTRIES the least recently used entries are evicted.
+
+Configuration (env):
+    TG_LLM_CACHE_PATH          SQLite file (default backend/data/llm_cache.sqlite3)
+    TG_LLM_CACHE_TTL           seconds a reply stays valid (default 86400; 0 disables the cache)
+    TG_LLM_CACHE_MAX_ENTRIES   max stored replies (default 1000)
+"""
+
+from __future__ import annotations
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+from .cache import user_cache
+
+DEFAULT_PATH = Path(__file__).resolve().parent.parent / "data" / "llm_cache.sqlite3"
+HISTORY_TURNS = 10  # matches the history window sent to the model
+
+SCHEMA = """
+create table if not exists llm_responses (
+  key        text primary key,
+  user_id    text not null,
+  model      text not null,
+  response   text not null,
+  data_version text,
+  created_at real not null,
+  used_at    real not null
+);
+create index if not exists llm_responses_user on llm_responses (user_id);
+create index if not exists llm_responses_used on llm_responses (used_at);
+"""
+
+
+def normalize_message(message: str) -> str:
+    """Lowercase, collapse whitespace, drop trailing punctuation."""
+    return re.sub(r"\s+", " ", (message or "").lower()).strip().rstrip("?!.… ")
+
+def _digest(obj: Any) -> str:
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path: Path, ttl: float, max_entries: int):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._ready = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._ready:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        con = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        if not self._ready:
+            with self._lock:
+                if not self._ready:
+                    con.execute("pragma journal_mode = wal")
+                    cols = [r[1] for r in con.execute("pragma table_info(llm_responses)")]
+                    if cols and "data_version" not in cols:
+                        # Entries from before data versions: unverifiable, drop them
+                        con.execute("drop table llm_responses")
+                    con.executescript(SCHEMA)
+                    self._ready = True
+        return con
+
+    def key(self, user_id: str, message: str, context: Optional[dict],
+            history: Optional[list], model: str, system_prompt: str = "") -> str:
+        recent = [(m.get("role"), m.get("content")) for m in (history or [])[-HISTORY_TURNS:]]
+        return _digest({
+            "user": user_id,
+            "message": normalize_message(message),
+            "context": _digest(context or {}),
+            "history": _digest(recent),
+            "model": model,
+            "system": _digest(system_prompt),
+        })
+
+    def get(self, key: str, data_version: Optional[str] = None) -> Optional[str]:
+        """Cached reply for key, unless it expired or was stored for another data_version."""
+        if not self.enabled:
+            return None
+        now = time.time()
+        con = self._connect()
+        try:
+            row = con.execute("select response, created_at, data_version from llm_responses where key = ?",
+                              (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl or row[2] != data_version:
+                con.execute("delete from llm_responses where key = ?", (key,))
+                return None
+            con.execute("update llm_responses set used_at = ? where key = ?", (now, key))
+            return row[0]
+        finally:
+            con.close()
+
+    def put(self, key: str, user_id: str, model: str, response: str,
+            data_version: Optional[str] = None, generation: Optional[int] = None) -> None:
+        """
+        Store a reply. Pass the user's data version and generation read before
+        building the prompt; if the generation has moved on since, the reply is
+        based on old data and is dropped.
+        """
+        if not self.enabled or not response:
+            return
+        now = time.time()
+        con = self._connect()
+        try:
+            con.execute("begin immediate")
+            con.execute("""
+                insert into llm_responses (key, user_id, model, response, data_version, created_at, used_at)
+                values (?, ?, ?, ?, ?, ?, ?)
+                on conflict (key) do update set
+                  response = excluded.response, data_version = excluded.data_version,
+                  created_at = excluded.created_at, used_at = excluded.used_at
+            """, (key, user_id, model, response, data_version, now, now))
+            # Checked under the write lock: callers bump the generation before
+            # invalidate_user() deletes, so a stale reply is either rolled back
+            # here or deleted there
+            if generation is not None and generation != user_cache.generation(user_id):
+                con.execute("rollback")
+                return
+            con.execute("delete from llm_responses where created_at < ?", (now - self.ttl,))
+            con.execute("""
+                delete from llm_responses where key in (
+                  select key from llm_responses order by used_at desc limit -1 offset ?)
+            """, (self.max_entries,))
+            con.execute("commit")
+        except Exception:
+            con.execute("rollback")
+            raise
+        finally:
+            con.close()
+
+    def invalidate_user(self, user_id: str) -> int:
+        if not self.enabled:
+            return 0
+        con = self._connect()
+        try:
+            return con.execute("delete from llm_responses where user_id = ?", (user_id,)).rowcount
+        finally:
+            con.close()
+
+
+response_cache = ResponseCache(
+    Path(os.environ.get("TG_LLM_CACHE_PATH") or DEFAULT_PATH),
+    ttl=float(os.environ.get("TG_LLM_CACHE_TTL", "86400")),
+    max_entries=int(os.environ.get("TG_LLM_CACHE_MAX_ENTRIES", "1000")),
+)
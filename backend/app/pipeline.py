@@ -57,17 +57,20 @@ def main():
     if not tags.empty:
         tags["trade_date"] = pd.to_datetime(tags["trade_date"])
 
-    trade_scores, day_scores, trade_scores_with_day = build_labels(
-        trades, tags, propagate_day_to_trades=True
+    trade_scores, day_scores, trade_scores_with_day, sparse = build_labels(
+        trades, tags, propagate_day_to_trades=True, return_sparse=True
     )
 
     trade_scores.to_csv(outdir / "trade_scores.csv", index=False)
     day_scores.to_csv(outdir / "day_scores.csv", index=False)
     trade_scores_with_day.to_csv(outdir / "trade_scores_with_day.csv", index=False)
+    # Same scores, one row per emitted (trade, tag): size follows the tags, not trades x tags
+    sparse.to_long().to_csv(outdir / "trade_labels_long.csv", index=False)
 
     print(f"  - trade_scores: {trade_scores.shape}")
     print(f"  - day_scores: {day_scores.shape}")
     print(f"  - trade_scores_with_day: {trade_scores_with_day.shape}")
+    print(f"  - trade_labels_long: {sparse.nnz} stored scores of {sparse.shape[0] * sparse.shape[1]} cells")
 
     # ---------- 5. Preview ----------
     print("\n[5/5] Preview outputs:")
@@ -0,0 +1,332 @@
+"""
+report.py
+---------
+PDF behavior report for /api/report (server-side inputs) and the legacy
+/api/generate-report (client-posted trades).
+
+build_report() is a plain top-level function over JSON-ready trades and
+behavioral data, so it can run in a worker process. reportlab layout is pure
+CPU and would otherwise hold the GIL (or the event loop) while it works.
+Reports render on a small spawn-based process pool; the API awaits the result.
+
+Large histories: with trade_log=True a trade-by-trade appendix follows the
+summary, as one small table per TRADE_LOG_ROWS trades. reportlab then
+paginates linearly instead of re-splitting one huge table. The worker writes
+the PDF straight into the cache file and returns its path, and the API streams
+that file. The document never crosses the process boundary and is never held
+in API memory.
+
+Finished PDFs are cached on disk under data/reports/<key>.pdf, keyed by a
+sha256 of the trades, behavioral data and report options (report_key()). A
+repeat download of the same data is a file read. The newest
+TG_REPORT_CACHE_MAX_ENTRIES files are kept, except that a file served within
+the last TG_REPORT_SERVE_SECONDS is never pruned while it may still be
+streaming. Because the key is the content, a data change simply produces a new
+key; the PDF itself holds nothing time-dependent (no render timestamp).
+
+Configuration (env):
+    TG_REPORT_WORKERS             report rendering processes (default 2)
+    TG_REPORT_CACHE_MAX_ENTRIES   cached PDFs kept on disk (default 50; 0 disables reuse)
+    TG_REPORT_SERVE_SECONDS       recently used PDFs are not pruned for this long (default 600)
+"""
+
+from __future__ import annotations
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.platypus import PageBreak, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+REPORT_DIR = Path(__file__).resolve().parent.parent / "data" / "reports"
+REPORT_WORKERS = int(os.environ.get("TG_REPORT_WORKERS", "2"))
+REPORT_CACHE_MAX_ENTRIES = int(os.environ.get("TG_REPORT_CACHE_MAX_ENTRIES", "50"))
+REPORT_SERVE_SECONDS = float(os.environ.get("TG_REPORT_SERVE_SECONDS", "600"))
+TRADE_LOG_ROWS = 45      # trades per appendix table (about one A4 page)
+FLAG_THRESHOLD = 0.6
+
+RECOMMENDATIONS = [
+    "Implement a maximum daily loss limit to prevent emotional trading",
+    "Use consistent position sizing based on account size and risk tolerance",
+    "Take breaks after consecutive losses to avoid revenge trading",
+    "Track mood patterns and their impact on trading decisions",
+    "Develop a pre-trade checklist for discipline and consistency",
+    "Review and analyze losing trades to identify behavioral patterns",
+    "Set realistic profit targets and stick to your trading plan",
+]
+
+
+def report_stats(trades: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Totals, win rate, best/worst trade and ticker count in one pass over trades."""
+    total = wins = 0
+    total_pnl = 0.0
+    best = worst = None
+    tickers = set()
+    for t in trades:
+        pnl = t.get('realized_pnl', 0) or 0
+        total += 1
+        wins += pnl > 0
+        total_pnl += pnl
+        best = pnl if best is None or pnl > best else best
+        worst = pnl if worst is None or pnl < worst else worst
+        tickers.add(t.get('ticker', ''))
+    return {
+        "total_trades": total,
+        "winning_trades": wins,
+        "win_rate": (wins / total * 100) if total > 0 else 0,
+        "total_pnl": total_pnl,
+        "avg_pnl": total_pnl / total if total > 0 else 0,
+        "best": best or 0,
+        "worst": worst or 0,
+        "tickers": len(tickers),
+    }
+
+
+def report_key(trades: List[Dict[str, Any]], behavioral_data: Optional[Dict[str, Any]], **options) -> str:
+    """Cache key over the report inputs and build_report() options."""
+    payload = json.dumps({"trades": trades, "behavioral": behavioral_data or {}, "options": options},
+                         sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _trade_log(trades: List[Dict[str, Any]], behavioral_data: Dict[str, Any], heading_style, styles) -> list:
+    """'Trade Log' appendix flowables: oldest first, one table per TRADE_LOG_ROWS trades."""
+    flags: Dict[Any, List[str]] = {}
+    for row in behavioral_data.get("trade_scores") or []:
+        hits = [k for k, v in row.items()
+                if k != "trade_id" and not k.startswith("outcome_")
+                and isinstance(v, (int, float)) and v >= FLAG_THRESHOLD]
+        if hits:
+            flags[row.get("trade_id")] = hits
+
+    ordered = sorted(trades, key=lambda t: (str(t.get('trade_date') or ''), t.get('trade_id') or 0))
+    header = ['Date', 'Ticker', 'Side', 'Qty', 'P&L', 'Flags']
+    style = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.darkblue),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 7),
+        ('ALIGN', (3, 1), (4, -1), 'RIGHT'),
+        ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
+    ])
+    out = [PageBreak(), Paragraph(f"Trade Log ({len(ordered)} trades)", heading_style)]
+    for start in range(0, len(ordered), TRADE_LOG_ROWS):
+        rows = [header]
+        for t in ordered[start:start + TRADE_LOG_ROWS]:
+            rows.append([
+                str(t.get('trade_date') or '')[:10],
+                str(t.get('ticker', '')),
+                str(t.get('side', '')),
+                f"{t.get('qty', 0) or 0:g}",
+                f"${t.get('realized_pnl', 0) or 0:.2f}",
+                ", ".join(flags.get(t.get('trade_id'), []))[:60],
+            ])
+        table = Table(rows, colWidths=[0.9*inch, 0.8*inch, 0.6*inch, 0.6*inch, 0.9*inch, 2.6*inch])
+        table.setStyle(style)
+        out.append(table)
+    return out
+
+
+def build_report(target, trades: List[Dict[str, Any]], behavioral_data: Optional[Dict[str, Any]] = None,
+                 period: Optional[str] = None, trade_log: bool = False) -> None:
+    """Render the report PDF into target (a filename or a binary file object)."""
+    behavioral_data = behavioral_data or {}
+    doc = SimpleDocTemplate(target, pagesize=A4, topMargin=1*inch, bottomMargin=1*inch)
+    styles = getSampleStyleSheet()
+
+    # Custom styles
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=24,
+        spaceAfter=30,
+        alignment=TA_CENTER,
+        textColor=colors.darkblue
+    )
+
+    heading_style = ParagraphStyle(
+        'CustomHeading',
+        parent=styles['Heading2'],
+        fontSize=16,
+        spaceAfter=12,
+        textColor=colors.darkblue
+    )
+
+    s = report_stats(trades)
+    total_trades, winning_trades = s["total_trades"], s["winning_trades"]
+    win_rate, total_pnl, avg_pnl = s["win_rate"], s["total_pnl"], s["avg_pnl"]
+
+    # Build PDF content
+    story = []
+
+    # Title
+    story.append(Paragraph("Trading Behavior Analysis Report", title_style))
+    if period:
+        story.append(Paragraph(period, ParagraphStyle('Period', parent=styles['Normal'], alignment=TA_CENTER)))
+    story.append(Spacer(1, 20))
+
+    # Executive Summary
+    story.append(Paragraph("Executive Summary", heading_style))
+    story.append(Paragraph(f"""
+    This comprehensive report analyzes your trading behavior patterns based on {total_trades} trades.
+    Your current win rate is {win_rate:.1f}%, with a total P&L of ${total_pnl:.2f} and average P&L per trade of ${avg_pnl:.2f}.
+    This indicates {'strong' if win_rate > 60 else 'moderate' if win_rate > 40 else 'room for improvement in'} performance consistency.
+    """, styles['Normal']))
+    story.append(Spacer(1, 12))
+
+    # Trading Statistics Table
+    story.append(Paragraph("Trading Statistics", heading_style))
+    stats_data = [
+        ['Metric', 'Value'],
+        ['Total Trades', str(total_trades)],
+        ['Winning Trades', str(winning_trades)],
+        ['Losing Trades', str(total_trades - winning_trades)],
+        ['Win Rate', f"{win_rate:.1f}%"],
+        ['Total P&L', f"${total_pnl:.2f}"],
+        ['Average P&L per Trade', f"${avg_pnl:.2f}"],
+        ['Best Trade', f"${s['best']:.2f}"],
+        ['Worst Trade', f"${s['worst']:.2f}"]
+    ]
+
+    stats_table = Table(stats_data, colWidths=[2*inch, 2*inch])
+    stats_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.darkblue),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 12),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.lightgrey),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('FONTSIZE', (0, 1), (-1, -1), 10)
+    ]))
+    story.append(stats_table)
+    story.append(Spacer(1, 20))
+
+    # Behavioral Analysis
+    story.append(Paragraph("Behavioral Analysis", heading_style))
+
+    # Analyze trading patterns
+    analysis_text = f"""
+    Based on your trading data, here are the key behavioral patterns identified:
+
+    <b>Performance Analysis:</b>
+    • Your win rate of {win_rate:.1f}% {'exceeds' if win_rate > 60 else 'meets' if win_rate > 40 else 'falls below'} the typical trader average of 50-60%
+    • Average P&L of ${avg_pnl:.2f} per trade suggests {'strong' if avg_pnl > 0 else 'room for improvement in'} position sizing
+    • Total P&L of ${total_pnl:.2f} indicates {'profitable' if total_pnl > 0 else 'unprofitable'} trading performance
+
+    <b>Risk Management Assessment:</b>
+    • {'Good' if abs(s['worst']) < abs(avg_pnl) * 2 else 'Poor'} risk management based on worst trade vs average trade ratio
+    • {'Consistent' if s['tickers'] < total_trades * 0.3 else 'Diversified'} trading approach across tickers
+
+    <b>Behavioral Insights:</b>
+    • Focus on maintaining discipline during {'winning' if win_rate > 60 else 'losing'} streaks
+    • {'Consider' if avg_pnl < 0 else 'Continue'} implementing consistent position sizing rules
+    • Track emotional patterns that may impact trading decisions
+    """
+
+    story.append(Paragraph(analysis_text, styles['Normal']))
+    story.append(Spacer(1, 20))
+
+    # Recommendations
+    story.append(Paragraph("Key Recommendations", heading_style))
+    for i, rec in enumerate(RECOMMENDATIONS, 1):
+        story.append(Paragraph(f"{i}. {rec}", styles['Normal']))
+
+    story.append(Spacer(1, 20))
+
+    # Action Plan
+    story.append(Paragraph("30-Day Action Plan", heading_style))
+    action_plan = f"""
+    <b>Week 1:</b> Implement daily loss limits and position sizing rules
+    <b>Week 2:</b> Start tracking mood and emotional state before each trade
+    <b>Week 3:</b> Review all trades and identify recurring behavioral patterns
+    <b>Week 4:</b> Refine your trading plan based on behavioral insights
+
+    <b>Success Metrics:</b>
+    • Maintain win rate above {max(40, win_rate - 5):.0f}%
+    • Keep average loss below ${abs(avg_pnl) * 1.5:.2f}
+    • Complete daily trading journal entries
+    • Follow pre-trade checklist 100% of the time
+    """
+
+    story.append(Paragraph(action_plan, styles['Normal']))
+    story.append(Spacer(1, 20))
+
+    # Footer: derived from the data, not the clock, so a cached copy stays accurate
+    last_day = max((str(t.get('trade_date') or '')[:10] for t in trades), default='')
+    if last_day:
+        story.append(Paragraph(f"Covers trades through {last_day}",
+                               ParagraphStyle('Footer', parent=styles['Normal'], fontSize=8, alignment=TA_CENTER)))
+
+    if trade_log and trades:
+        story.extend(_trade_log(trades, behavioral_data, heading_style, styles))
+
+    doc.build(story)
+
+
+# ---------- PDF cache ----------
+def report_path(key: str) -> Path:
+    return REPORT_DIR / f"{key}.pdf"
+
+
+def cached_report(key: str) -> Optional[Path]:
+    path = report_path(key)
+    if REPORT_CACHE_MAX_ENTRIES <= 0 or not path.exists():
+        return None
+    path.touch()  # mtime doubles as last-used time for pruning
+    return path
+
+
+def render_report_file(key: str, trades: List[Dict[str, Any]], behavioral_data: Optional[Dict[str, Any]] = None,
+                       **options) -> Path:
+    """build_report() into the cache file for key and return its path; runs in a worker process."""
+    REPORT_DIR.mkdir(parents=True, exist_ok=True)
+    path = report_path(key)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    build_report(str(tmp), trades, behavioral_data, **options)
+    os.replace(tmp, path)  # concurrent readers see the old file or the whole new one
+    # Keep the newest files. Anything used within the serving window may still be
+    # streaming to a client (cached_report() touches on use), so it survives too
+    cutoff = time.time() - REPORT_SERVE_SECONDS
+    files = sorted(REPORT_DIR.glob("*.pdf"), key=lambda p: p.stat().st_mtime, reverse=True)
+    for old in files[max(REPORT_CACHE_MAX_ENTRIES, 1):]:
+        try:
+            if old != path and old.stat().st_mtime < cutoff:
+                old.unlink(missing_ok=True)
+        except FileNotFoundError:
+            pass
+    return path
+
+
+# ---------- Worker pool ----------
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def report_pool() -> ProcessPoolExecutor:
+    """Process pool for render_report_file (spawned on first use: forking the threaded API process is unsafe)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=REPORT_WORKERS,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def shutdown_report_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
@@ -0,0 +1,360 @@
+"""
+rulespec.py
+-----------
+Declarative rule specs compiled to vectorized evaluation over the features frame.
+
+A RuleSpec describes one behavior tag:
+    tag         -> tag code emitted (e.g. "size_inconsistency")
+    scope       -> evaluation frame: 'trade' | 'day' | 'ticker_day'
+    when        -> boolean expression over the frame's columns (pandas eval syntax)
+    confidence  -> float | expression | Cases
+    rationale   -> template ("{col:fmt}") | Cases of templates
+
+Evaluation frames (built at most once per run, only if a spec needs them):
+    trade      : the features frame itself (ft_* columns, realized_pnl, ...)
+    day        : one row per (user_id, trade_date) with day aggregates
+                 trades, rows, pnl, tickers, top_frac, has_loss, has_revenge_immediate
+    ticker_day : one row per (user_id, trade_date, ticker) with lifetime ticker stats
+                 n, mean_pnl, total, recent_mean
+
+Tunables from rules.py are available in expressions as @NAME, e.g. "ft_size_z >= @SIZE_Z_THRESHOLD".
+'ticker_day' rules are emitted with scope='day', like rules.rule_ticker_bias_basic.
+Rows whose confidence evaluates to <= 0 are not emitted.
+
+Output matches rules.run_all_rules():
+    [user_id, trade_id (nullable), trade_date, tag, confidence, rationale, scope, source]
+
+Incremental mode (run_rule_specs_incremental) re-evaluates only the changed
+(user_id, trade_date) partitions and the days touched by changed (user_id, ticker)
+lifetime stats, replacing those tags in an existing tag table.
+"""
+
+from __future__ import annotations
+from dataclasses import dataclass
+from string import Formatter
+from typing import Callable, Dict, Iterable, Optional, Sequence, Set, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from . import rules as _rules
+
+TAG_COLS = ["user_id","trade_id","trade_date","tag","confidence","rationale","scope","source"]
+
+# Constants usable as @NAME inside expressions
+PARAMS: Dict[str, float] = {
+    name: getattr(_rules, name) for name in dir(_rules)
+    if name.isupper() and isinstance(getattr(_rules, name), (int, float))
+}
+
+# (condition, value) pairs; first matching condition wins, None is the catch-all
+Cases = Tuple[Tuple[Optional[str], Union[float, str]], ...]
+
+
+@dataclass(frozen=True)
+class RuleSpec:
+    tag: str
+    scope: str
+    when: str
+    confidence: Union[float, str, Cases]
+    rationale: Union[str, Cases]
+
+
+# ---------- Evaluation frames ----------
+def _trade_frame(f: pd.DataFrame) -> pd.DataFrame:
+    return f.reset_index(drop=True)
+
+def _day_frame(f: pd.DataFrame) -> pd.DataFrame:
+    helpers = f.assign(
+        _loss=f["realized_pnl"] < -_rules.EPS_PNL,
+        _rev=(f["ft_prev_outcome_day"]=="loss") & f["ft_immediate_after_prev"].astype(bool),
+    )
+    day = (helpers.groupby(["user_id","trade_date"])
+                  .agg(trades=("trade_id","nunique"),
+                       rows=("trade_id","size"),
+                       pnl=("realized_pnl","sum"),
+                       tickers=("ticker","nunique"),
+                       has_loss=("_loss","any"),
+                       has_revenge_immediate=("_rev","any")))
+    per_ticker = f.groupby(["user_id","trade_date","ticker"]).size()
+    top = per_ticker.groupby(level=[0, 1]).agg(["max","sum"])
+    day["top_frac"] = (top["max"] / top["sum"]).reindex(day.index).fillna(0.0)
+    return day.reset_index()
+
+def _ticker_day_frame(f: pd.DataFrame) -> pd.DataFrame:
+    keys = ["user_id","ticker"]
+    life = (f.groupby(keys)
+              .agg(n=("trade_id","nunique"),
+                   mean_pnl=("realized_pnl","mean"),
+                   total=("realized_pnl","sum")))
+    ordered = f.sort_values(["user_id","ticker","trade_date","trade_id"])
+    recent = (ordered.groupby(keys).tail(_rules.TICKER_BIAS_RECENT_K)
+                     .groupby(keys)["realized_pnl"].mean()
+                     .rename("recent_mean"))
+    td = f[["user_id","trade_date","ticker"]].drop_duplicates()
+    return td.join(life, on=keys).join(recent, on=keys).reset_index(drop=True)
+
+FRAMES: Dict[str, Callable[[pd.DataFrame], pd.DataFrame]] = {
+    "trade": _trade_frame,
+    "day": _day_frame,
+    "ticker_day": _ticker_day_frame,
+}
+
+
+# ---------- Vectorized evaluation helpers ----------
+def _eval(frame: pd.DataFrame, expr: Union[str, float]) -> np.ndarray:
+    if not isinstance(expr, str):
+        return np.full(len(frame), expr)
+    out = frame.eval(expr, local_dict=PARAMS)
+    return np.broadcast_to(np.asarray(out), (len(frame),))
+
+def _case_choice(frame: pd.DataFrame, cases: Cases) -> np.ndarray:
+    """Index of the first matching case per row (-1 if none)."""
+    conds = [np.ones(len(frame), dtype=bool) if c is None else _eval(frame, c).astype(bool)
+             for c, _ in cases]
+    return np.select(conds, np.arange(len(cases)), default=-1)
+
+def _render(template: str, frame: pd.DataFrame, idx: np.ndarray) -> np.ndarray:
+    """Render a '{col:fmt}' template for the selected rows only."""
+    out = np.full(len(idx), "", dtype=object)
+    for literal, field, spec, _ in Formatter().parse(template):
+        if literal:
+            out = out + literal
+        if field is not None:
+            vals = frame[field].to_numpy()[idx]
+            out = out + np.array([format(v, spec) for v in vals], dtype=object)
+    return out
+
+def _confidence(spec: RuleSpec, frame: pd.DataFrame, idx: np.ndarray) -> np.ndarray:
+    if isinstance(spec.confidence, tuple):
+        choice = _case_choice(frame, spec.confidence)[idx]
+        values = [_eval(frame, v)[idx] for _, v in spec.confidence]
+        return np.select([choice == i for i in range(len(values))], values, default=0.0).astype(float)
+    return _eval(frame, spec.confidence)[idx].astype(float)
+
+def _rationale(spec: RuleSpec, frame: pd.DataFrame, idx: np.ndarray) -> np.ndarray:
+    if isinstance(spec.rationale, tuple):
+        choice = _case_choice(frame, spec.rationale)[idx]
+        out = np.full(len(idx), "", dtype=object)
+        for i, (_, template) in enumerate(spec.rationale):
+            sel = choice == i
+            if sel.any():
+                out[sel] = _render(template, frame, idx[sel])
+        return out
+    return _render(spec.rationale, frame, idx)
+
+
+# ---------- Compiler ----------
+def compile_rules(specs: Sequence[RuleSpec]) -> Callable[[pd.DataFrame], pd.DataFrame]:
+    """
+    Validate specs and return a function features -> tags.
+
+    Each evaluation frame is built once and shared by every spec on it; masks,
+    confidences and rationales are computed column-wise and all tags are
+    assembled with a single DataFrame construction.
+    """
+    for s in specs:
+        if s.scope not in FRAMES:
+            raise ValueError(f"Unknown rule scope {s.scope!r} for tag {s.tag!r}")
+    specs = list(specs)
+
+    def evaluate(features: pd.DataFrame) -> pd.DataFrame:
+        if features.empty or not specs:
+            return _rules._empty_tags()
+        frames = {scope: FRAMES[scope](features) for scope in {s.scope for s in specs}}
+
+        cols = {c: [] for c in TAG_COLS}
+        for s in specs:
+            frame = frames[s.scope]
+            idx = np.flatnonzero(_eval(frame, s.when).astype(bool))
+            if len(idx) == 0:
+                continue
+            conf = _confidence(s, frame, idx)
+            keep = conf > 0
+            idx, conf = idx[keep], conf[keep]
+            if len(idx) == 0:
+                continue
+            cols["user_id"].append(frame["user_id"].to_numpy()[idx])
+            cols["trade_id"].append(frame["trade_id"].to_numpy()[idx] if s.scope == "trade"
+                                    else np.full(len(idx), np.nan))
+            cols["trade_date"].append(frame["trade_date"].to_numpy()[idx])
+            cols["tag"].append(np.full(len(idx), s.tag, dtype=object))
+            cols["confidence"].append(conf)
+            cols["rationale"].append(_rationale(s, frame, idx))
+            cols["scope"].append(np.full(len(idx), "trade" if s.scope == "trade" else "day", dtype=object))
+            cols["source"].append(np.full(len(idx), "rule", dtype=object))
+
+        if not cols["tag"]:
+            return _rules._empty_tags()
+        tags = pd.DataFrame({c: np.concatenate(v) for c, v in cols.items()})
+        return tags.drop_duplicates(subset=["user_id","trade_id","trade_date","tag","rationale","scope"], keep="first")
+
+    return evaluate
+
+def run_rule_specs(features: pd.DataFrame, specs: Sequence[RuleSpec] = None) -> pd.DataFrame:
+    """Evaluate specs (default: RULE_SPECS) over a features frame."""
+    return compile_rules(RULE_SPECS if specs is None else specs)(features)
+
+
+# ---------- Incremental evaluation ----------
+DAY_KEYS = ["user_id","trade_date"]
+TICKER_KEYS = ["user_id","ticker"]
+_DAY_HASH_COLS = ["trade_id","ticker","realized_pnl"]
+
+def _isin(df: pd.DataFrame, cols, keys) -> np.ndarray:
+    if not len(keys) or df.empty:
+        return np.zeros(len(df), dtype=bool)
+    idx = pd.MultiIndex.from_arrays([df[c] for c in cols])
+    return idx.isin(pd.MultiIndex.from_tuples(list(keys), names=cols))
+
+def _day_keys(keys: Iterable[Tuple]) -> Set[Tuple]:
+    return {(u, pd.Timestamp(d)) for u, d in keys}
+
+def _partition_hashes(df: pd.DataFrame, keys, cols) -> pd.Series:
+    """Order-independent content hash per partition (sum of row hashes)."""
+    rows = pd.util.hash_pandas_object(df[cols], index=False)
+    return rows.groupby([df[k] for k in keys]).sum()
+
+def changed_partitions(old: pd.DataFrame, new: pd.DataFrame) -> Tuple[Set[Tuple], Set[Tuple]]:
+    """
+    Diff two features frames (compute_features output) for incremental evaluation.
+
+    Returns
+    -------
+    changed_days : set of (user_id, trade_date) whose trades or rule inputs differ
+    changed_tickers : set of (user_id, ticker) whose lifetime trade set differs
+
+    User-wide features (ft_size_z, ft_large_win/loss) are part of the day hash,
+    so a shift in a user's distribution marks every day it moved.
+    """
+    old = old.assign(trade_date=pd.to_datetime(old["trade_date"]))
+    new = new.assign(trade_date=pd.to_datetime(new["trade_date"]))
+    ft_cols = [c for c in new.columns if c.startswith("ft_") and c in old.columns]
+
+    def diff(keys, cols):
+        a = _partition_hashes(old, keys, cols)
+        b = _partition_hashes(new, keys, cols)
+        both = a.index.union(b.index)
+        a, b = a.reindex(both), b.reindex(both)
+        return set(both[(a != b).to_numpy()])
+
+    days = diff(DAY_KEYS, _DAY_HASH_COLS + ft_cols)
+    tickers = diff(TICKER_KEYS, ["trade_id","trade_date","realized_pnl"])
+    return days, tickers
+
+def run_rule_specs_incremental(
+    features: pd.DataFrame,
+    tags: pd.DataFrame,
+    changed_days: Iterable[Tuple],
+    changed_tickers: Iterable[Tuple] = (),
+    specs: Sequence[RuleSpec] = None,
+) -> pd.DataFrame:
+    """
+    Re-run only the rules affected by a change and merge into an existing tag table.
+
+    Parameters
+    ----------
+    features : DataFrame
+        Full, up-to-date compute_features() output (lifetime ticker stats need history).
+    tags : DataFrame
+        Existing tag table (run_all_rules / run_rule_specs output).
+    changed_days : iterable of (user_id, trade_date)
+        Partitions whose trades were added, removed or whose features changed.
+    changed_tickers : iterable of (user_id, ticker)
+        Tickers whose lifetime stats changed; every day they traded gets its
+        ticker-bias tags recomputed.
+
+    Tags owned by the specs are replaced on the affected days (and dropped if no
+    longer emitted); everything else in `tags` is kept as-is.
+    """
+    specs = list(RULE_SPECS if specs is None else specs)
+    base_specs = [s for s in specs if s.scope != "ticker_day"]
+    ticker_specs = [s for s in specs if s.scope == "ticker_day"]
+
+    f = features.assign(trade_date=pd.to_datetime(features["trade_date"]))
+    days = _day_keys(changed_days)
+    ticker_pairs = set(changed_tickers)
+
+    # Ticker-bias tags are day-scoped but depend on every ticker traded that day
+    ticker_days = days | set(zip(*(f.loc[_isin(f, TICKER_KEYS, ticker_pairs), c] for c in DAY_KEYS)))
+    on_ticker_days = _isin(f, DAY_KEYS, ticker_days)
+    history_pairs = set(zip(f.loc[on_ticker_days, "user_id"], f.loc[on_ticker_days, "ticker"]))
+
+    fresh = [compile_rules(base_specs)(f[_isin(f, DAY_KEYS, days)])]
+    if ticker_specs and ticker_days:
+        t = compile_rules(ticker_specs)(f[_isin(f, TICKER_KEYS, history_pairs)])
+        fresh.append(t[_isin(t.assign(trade_date=pd.to_datetime(t["trade_date"])), DAY_KEYS, ticker_days)])
+
+    old = tags.copy()
+    if not old.empty:
+        old["trade_date"] = pd.to_datetime(old["trade_date"])
+        base_owned = old["tag"].isin({s.tag for s in base_specs}).to_numpy()
+        ticker_owned = old["tag"].isin({s.tag for s in ticker_specs}).to_numpy()
+        replaced = ((base_owned & _isin(old, DAY_KEYS, days)) |
+                    (ticker_owned & _isin(old, DAY_KEYS, ticker_days)))
+        old = old[~replaced]
+
+    parts = [p for p in [old] + fresh if not p.empty]
+    if not parts:
+        return _rules._empty_tags()
+    merged = pd.concat(parts, ignore_index=True)
+    return merged.drop_duplicates(subset=["user_id","trade_id","trade_date","tag","rationale","scope"], keep="first")
+
+
+# ---------- The rules.py rule set, expressed as specs ----------
+_REVENGE_IMM = "ft_prev_outcome_day == 'loss' and ft_immediate_after_prev"
+_FOLLOW_IMM = "ft_prev_outcome_day == 'win' and ft_immediate_after_prev"
+
+RULE_SPECS = [
+    # core trade-level
+    RuleSpec("outcome_win", "trade", "ft_outcome == 'win'", 0.9,
+             "Win: PnL ${realized_pnl:.2f}"),
+    RuleSpec("outcome_loss", "trade", "ft_outcome == 'loss'", 0.9,
+             "Loss: PnL ${realized_pnl:.2f}"),
+    RuleSpec("outcome_breakeven", "trade", "ft_outcome == 'breakeven'", 0.8,
+             "Breakeven within tolerance"),
+    RuleSpec("large_win", "trade", "ft_large_win", 0.75,
+             "Top-decile win (PnL ${realized_pnl:.2f})"),
+    RuleSpec("large_loss", "trade", "ft_large_loss", 0.85,
+             "Worst-decile loss (PnL ${realized_pnl:.2f})"),
+    RuleSpec("revenge_immediate", "trade", _REVENGE_IMM,
+             (("ft_same_ticker_as_prev_day", 0.9), (None, 0.75)),
+             (("ft_same_ticker_as_prev_day", "Immediate re-entry after loss (same ticker)"),
+              (None, "Immediate re-entry after loss"))),
+    RuleSpec("size_inconsistency", "trade", "ft_size_z >= @SIZE_Z_THRESHOLD", 0.75,
+             "Size {ft_size_z:.1f}σ above median (notional ${ft_notional:,.0f})"),
+
+    # core day-level
+    RuleSpec("overtrading_day", "day", "trades >= @OVERTRADING_SOFT", 0.8,
+             "{trades:d} trades; day PnL ${pnl:.2f}"),
+    RuleSpec("revenge_day", "day",
+             "has_revenge_immediate or (has_loss and rows >= @OVERTRADING_SOFT)", 0.75,
+             "Loss-anchored high-activity episode"),
+    RuleSpec("chop_day", "day", "trades >= @OVERTRADING_SOFT and abs(pnl) <= @CHOP_ABS_PNL_MAX", 0.6,
+             "High activity ({trades:d}) with flat PnL ${pnl:.2f}"),
+    RuleSpec("ticker_bias_lifetime", "ticker_day",
+             "n >= @TICKER_BIAS_MIN_TRADES and mean_pnl <= @TICKER_BIAS_MEAN_PNL_MAX", 0.8,
+             "Ticker {ticker} negative expectancy (n={n:d}, avg ${mean_pnl:.2f}, total ${total:.2f})"),
+    RuleSpec("ticker_bias_recent", "ticker_day", "recent_mean <= @TICKER_BIAS_RECENT_MEAN_MAX", 0.7,
+             f"Ticker {{ticker}}: last {_rules.TICKER_BIAS_RECENT_K} trades mean ${{recent_mean:.2f}}"),
+
+    # positive reinforcement
+    RuleSpec("follow_through_win_immediate", "trade", _FOLLOW_IMM,
+             (("ft_same_ticker_as_prev_day", 0.85), (None, 0.7)),
+             (("ft_same_ticker_as_prev_day", "Immediate follow-through after win (same ticker)"),
+              (None, "Immediate follow-through after win"))),
+    RuleSpec("disciplined_after_loss_immediate", "trade",
+             f"{_REVENGE_IMM} and ft_size_z <= @DISCIPLINED_SIZE_Z_MAX", 0.8,
+             "Composed re-entry after loss (size {ft_size_z:.1f}σ, within discipline)"),
+    RuleSpec("consistent_size", "trade", "abs(ft_size_z) <= @CONSISTENT_SIZE_Z_ABS_MAX", 0.6,
+             "Consistent position sizing ({ft_size_z:.1f}σ from typical)"),
+    RuleSpec("focused_day", "day", "tickers == 1 or top_frac >= 0.8",
+             (("tickers == 1 and pnl > 0 and rows <= 5", 1.0),
+              ("tickers == 1 and pnl > 0", 0.85),
+              ("tickers == 1", 0.6),
+              (None, 0.5)),
+             "{tickers} tickers, PnL {pnl:.2f}, trades={rows}"),
+    RuleSpec("green_day_low_activity", "day", "rows <= 2 and pnl > 0",
+             (("pnl >= 200", 1.0), ("pnl >= 50", 0.8), (None, 0.6)),
+             "{rows} trades, PnL {pnl:.2f}"),
+]
@@ -0,0 +1,201 @@
+"""
+similar.py
+----------
+In-memory nearest-neighbour index over a user's trades, for "the last times you
+were in this situation" lookups (/api/similar-trades, chat context).
+
+Each trade becomes a small weighted vector built from compute_features() and the
+trade label scores:
+
+    size_z                 robust notional z-score (clipped to +-4, halved)
+    prev_win/loss/even     outcome of the previous trade that day (all 0 if first)
+    immediate, same_tkr    sequencing flags
+    short                  side
+    day_load               log1p(trades that day)
+    <behavior tags>        label scores (revenge_immediate, consistent_size, ...);
+                           outcome tags are left out, they describe the result,
+                           not the situation
+
+Distance is weighted squared Euclidean plus TICKER_PENALTY when tickers differ.
+Search is brute force over a contiguous float32 matrix, so a query over 100k
+trades costs a few milliseconds and there is no index build step to tune.
+
+Rows are keyed by the stored (database) trade_id, the id the UI uses. The index
+grows in place: upsert() replaces or appends rows and remove() tombstones them.
+Storage is amortized, so small updates do not rebuild the matrix.
+"""
+
+from __future__ import annotations
+import threading
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from .features import compute_features
+from .labels import TRADE_TAGS
+
+BEHAVIOR_TAGS = [t for t in TRADE_TAGS
+                 if t not in ("outcome_win", "outcome_loss", "outcome_breakeven", "large_win", "large_loss")]
+BASE_DIMS = ["size_z", "prev_win", "prev_loss", "prev_even", "immediate", "same_tkr", "short", "day_load"]
+DIMS = BASE_DIMS + BEHAVIOR_TAGS
+WEIGHTS = np.array([1.0, 1.0, 1.0, 1.0, 0.5, 0.5, 0.5, 0.5] + [1.0] * len(BEHAVIOR_TAGS), dtype=np.float32)
+TICKER_PENALTY = 1.0
+FLAG_THRESHOLD = 0.6
+
+
+def trade_vectors(features: pd.DataFrame, scores: Optional[pd.DataFrame] = None) -> np.ndarray:
+    """len(features) x len(DIMS) float32 matrix (compute_features() rows + optional trade_scores)."""
+    f = features
+    n = len(f)
+    m = np.zeros((n, len(DIMS)), dtype=np.float32)
+    m[:, 0] = np.clip(pd.to_numeric(f["ft_size_z"], errors="coerce").fillna(0).to_numpy(), -4, 4) / 2
+    prev = f["ft_prev_outcome_day"].astype(object).to_numpy()
+    m[:, 1] = prev == "win"
+    m[:, 2] = prev == "loss"
+    m[:, 3] = prev == "breakeven"
+    m[:, 4] = f["ft_immediate_after_prev"].to_numpy(bool)
+    m[:, 5] = f["ft_same_ticker_as_prev_day"].to_numpy(bool)
+    m[:, 6] = f["side"].astype(str).str.lower().isin(["short", "sell"]).to_numpy() if "side" in f else 0
+    m[:, 7] = np.log1p(f["ft_day_trades_count"].to_numpy(np.float32))
+    if scores is not None and not scores.empty:
+        s = scores.drop_duplicates("trade_id").set_index("trade_id")
+        s = s.reindex(f["trade_id"].to_numpy())
+        for j, tag in enumerate(BEHAVIOR_TAGS, start=len(BASE_DIMS)):
+            if tag in s.columns:
+                m[:, j] = pd.to_numeric(s[tag], errors="coerce").fillna(0).to_numpy(np.float32)
+    return m
+
+
+class TradeIndex:
+    """Brute-force k-NN over trade vectors; thread-safe, grows in place."""
+
+    def __init__(self, capacity: int = 1024):
+        self._lock = threading.Lock()
+        self._n = 0
+        self._alloc(max(capacity, 1))
+        self._pos: Dict[int, int] = {}
+        self._ticker_codes: Dict[str, int] = {}
+
+    def _alloc(self, cap: int) -> None:
+        def grow(old, shape, dtype, fill=0):
+            new = np.full(shape, fill, dtype=dtype)
+            if old is not None:
+                new[:len(old)] = old
+            return new
+        g = lambda name, shape, dtype, fill=0: grow(getattr(self, name, None), shape, dtype, fill)
+        self._X = g("_X", (cap, len(DIMS)), np.float32)
+        self._ids = g("_ids", cap, np.int64)
+        self._tkr = g("_tkr", cap, np.int32, -1)
+        self._day = g("_day", cap, "datetime64[D]", np.datetime64("NaT"))
+        self._pnl = g("_pnl", cap, np.float64)
+        self._alive = g("_alive", cap, bool, False)
+        self._meta = g("_meta", cap, object, None)   # (ticker, side) per row
+
+    def __len__(self) -> int:
+        return len(self._pos)
+
+    # ----- build / update -----
+    @classmethod
+    def build(cls, trades: pd.DataFrame, scores: Optional[pd.DataFrame] = None) -> "TradeIndex":
+        """Index from stored trades (needs trade_id, user_id, trade_date, ticker, qty, entry_price, realized_pnl)."""
+        index = cls(capacity=max(len(trades) * 2, 1024))
+        if not trades.empty:
+            index.upsert(compute_features(trades), scores)
+        return index
+
+    def upsert(self, features: pd.DataFrame, scores: Optional[pd.DataFrame] = None) -> None:
+        """Insert or replace rows for compute_features() output (keyed by trade_id)."""
+        if features.empty:
+            return
+        vec = trade_vectors(features, scores)
+        ids = features["trade_id"].to_numpy(np.int64)
+        tickers = features["ticker"].astype(str).to_numpy()
+        sides = features["side"].astype(str).to_numpy() if "side" in features else np.full(len(ids), "")
+        days = pd.to_datetime(features["trade_date"]).to_numpy("datetime64[D]")
+        pnl = pd.to_numeric(features["realized_pnl"], errors="coerce").fillna(0).to_numpy()
+        with self._lock:
+            rows = np.empty(len(ids), dtype=np.int64)
+            for i, tid in enumerate(ids.tolist()):
+                row = self._pos.get(tid)
+                if row is None:
+                    row = self._n
+                    self._n += 1
+                    self._pos[tid] = row
+                rows[i] = row
+            if self._n > len(self._X):
+                self._alloc(max(self._n, 2 * len(self._X)))
+            codes = np.array([self._ticker_codes.setdefault(t, len(self._ticker_codes)) for t in tickers.tolist()],
+                             dtype=np.int32)
+            self._X[rows] = vec
+            self._ids[rows] = ids
+            self._tkr[rows] = codes
+            self._day[rows] = days
+            self._pnl[rows] = pnl
+            self._alive[rows] = True
+            self._meta[rows] = list(zip(tickers.tolist(), sides.tolist()))
+
+    def remove(self, trade_ids: Iterable[int]) -> int:
+        """Tombstone rows; returns how many were present."""
+        with self._lock:
+            gone = [self._pos.pop(int(t)) for t in trade_ids if int(t) in self._pos]
+            self._alive[gone] = False
+            return len(gone)
+
+    # ----- query -----
+    def _result(self, row: int, dist: Optional[float] = None) -> dict:
+        ticker, side = self._meta[row]
+        v = self._X[row]
+        prev = "win" if v[1] else "loss" if v[2] else "breakeven" if v[3] else None
+        out = {
+            "trade_id": int(self._ids[row]),
+            "ticker": ticker,
+            "side": side,
+            "trade_date": str(self._day[row]),
+            "realized_pnl": float(self._pnl[row]),
+            "after": prev,
+            "size_z": round(float(v[0]) * 2, 2),
+            "behaviors": [t for t, s in zip(BEHAVIOR_TAGS, v[len(BASE_DIMS):]) if s >= FLAG_THRESHOLD],
+        }
+        if dist is not None:
+            out["distance"] = round(dist, 4)
+        return out
+
+    def similar(self, trade_id: int, k: int = 5, same_ticker: bool = False,
+                past_only: bool = True) -> Optional[dict]:
+        """
+        The k trades closest to trade_id ({"trade": ..., "similar": [...]}, nearest first,
+        newer first on ties), or None if trade_id is not indexed. past_only keeps trades
+        from earlier days, or earlier on the same day (by trade_id).
+        """
+        with self._lock:
+            row = self._pos.get(int(trade_id))
+            if row is None:
+                return None
+            n = self._n
+            X, alive = self._X[:n], self._alive[:n].copy()
+            alive[row] = False
+            if past_only:
+                day, ids = self._day[:n], self._ids[:n]
+                alive &= (day < day[row]) | ((day == day[row]) & (ids < ids[row]))
+            if same_ticker:
+                alive &= self._tkr[:n] == self._tkr[row]
+            cand = np.flatnonzero(alive)
+            if len(cand):
+                d = ((X[cand] - X[row]) ** 2) @ WEIGHTS
+                d += TICKER_PENALTY * (self._tkr[cand] != self._tkr[row])
+                if len(cand) > k:
+                    part = np.argpartition(d, k - 1)[:k]
+                    cand, d = cand[part], d[part]
+                order = np.lexsort((-self._day[cand].astype(np.int64), d))
+                cand, d = cand[order], d[order]
+            return {"trade": self._result(row),
+                    "similar": [self._result(r, float(x)) for r, x in zip(cand.tolist(), d.tolist())]}
+
+
+def build_index(user_id: str, trades: List[dict], trade_scores: List[dict]) -> TradeIndex:
+    """TradeIndex from Storage.trades() and Storage.behavioral_data()["trade_scores"] rows."""
+    trades = pd.DataFrame(trades)
+    if trades.empty:
+        return TradeIndex()
+    return TradeIndex.build(trades.assign(user_id=user_id), pd.DataFrame(trade_scores))
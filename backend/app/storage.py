@@ -0,0 +1,381 @@
+"""
+storage.py
+----------
+Storage backends for the per-user tables (trades, tags_raw, trade_scores,
+day_scores, daily_pnl) behind one interface, so the API and the importers do
+not care where the rows live:
+
+    PostgresStorage  Supabase/Postgres via the shared pool (app/db.py);
+                     writes use sync_outputs() / staged_replace()
+    SQLiteStorage    embedded single-file database (stdlib sqlite3, WAL mode)
+                     with the same tables, columns and read queries; writes
+                     apply the same natural-key diff (sync.diff_rows())
+
+get_storage() picks the backend from the environment:
+    TG_STORAGE        "postgres" | "sqlite" (default: postgres if DATABASE_URL
+                      is set, else sqlite)
+    TG_SQLITE_PATH    database file (default backend/data/tradegist.sqlite3)
+
+Reads are written once, in Postgres SQL, on the base class; the SQLite backend
+only rewrites placeholders and drops the schema prefix.
+"""
+
+from __future__ import annotations
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .bulk_load import USER_TABLES, _copy_jobs, default_account_id, staged_replace, trade_id_map, trades_frame
+from .db import connection
+from .ingest import daily_pnl
+from .labels import SparseLabels
+from .sync import SPECS, assign_trade_ids, child_wires, diff_rows, sync_outputs
+
+DEFAULT_SQLITE_PATH = Path(__file__).resolve().parents[1] / "data" / "tradegist.sqlite3"
+
+TRADE_FIELDS = [
+    "trade_id","ticker","side","trade_date","trade_time","qty","entry_price","exit_price","fees",
+    "realized_pnl","strategy","hold_time_sec","note","mood","manual_tags","screenshot_url",
+]
+TRADE_SCORE_COLS = [
+    "outcome_win","outcome_loss","outcome_breakeven","large_win","large_loss","revenge_immediate",
+    "size_inconsistency","follow_through_win_immediate","disciplined_after_loss_immediate","consistent_size",
+]
+DAY_SCORE_COLS = [
+    "overtrading_day","revenge_day","chop_day","ticker_bias_lifetime","ticker_bias_recent",
+    "focused_day","green_day_low_activity",
+]
+
+
+def _iso(v):
+    return v.isoformat() if hasattr(v, "isoformat") else v
+
+def _float(v, default=0):
+    return float(v) if v else default
+
+
+class Storage:
+    """Backend-neutral reads; subclasses provide _rows() and the write paths."""
+    name = "base"
+
+    def _rows(self, sql: str, params=()) -> List[tuple]:
+        raise NotImplementedError
+
+    def trades(self, user_id: str) -> List[dict]:
+        """All of the user's trades, newest first, as JSON-ready dicts."""
+        rows = self._rows(f"""
+            select {','.join(TRADE_FIELDS)}
+            from public.trades
+            where user_id = %s
+            order by trade_date desc, trade_id desc
+        """, (user_id,))
+        out = []
+        for r in rows:
+            d = dict(zip(TRADE_FIELDS, r))
+            d["trade_date"] = _iso(d["trade_date"]) if d["trade_date"] else None
+            d["trade_time"] = _iso(d["trade_time"]) if d["trade_time"] else None
+            for c in ("qty","entry_price","exit_price","fees","realized_pnl"):
+                d[c] = _float(d[c])
+            for c in ("strategy","note","mood","manual_tags","screenshot_url"):
+                d[c] = d[c] or ""
+            out.append(d)
+        return out
+
+    def behavioral_data(self, user_id: str) -> Dict[str, list]:
+        """trade_scores, day_scores and tags for the user, as lists of dicts."""
+        trade_scores = self._rows(f"""
+            select trade_id, {','.join(TRADE_SCORE_COLS)}
+            from public.trade_scores
+            where user_id = %s
+        """, (user_id,))
+        day_scores = self._rows(f"""
+            select day, {','.join(DAY_SCORE_COLS)}
+            from public.day_scores
+            where user_id = %s
+        """, (user_id,))
+        tags = self._rows("""
+            select trade_id, tag, confidence
+            from public.tags_raw
+            where user_id = %s
+        """, (user_id,))
+        return {
+            "trade_scores": [dict(zip(["trade_id"] + TRADE_SCORE_COLS, r)) for r in trade_scores],
+            "day_scores": [{"day": _iso(r[0]) if r[0] else None, **dict(zip(DAY_SCORE_COLS, r[1:]))}
+                           for r in day_scores],
+            "tags": [{"trade_id": r[0], "tag": r[1], "confidence": r[2]} for r in tags],
+        }
+
+    def labels(self, user_id: str, propagate_day_to_trades: bool = False) -> SparseLabels:
+        """
+        The user's label scores as a SparseLabels, built from tags_raw (already
+        one row per emitted tag) instead of the dense score tables. Rows are the
+        stored trades, oldest first.
+        """
+        trades = pd.DataFrame(self._rows("""
+            select trade_id, trade_date, ticker
+            from public.trades
+            where user_id = %s
+            order by trade_date, trade_id
+        """, (user_id,)), columns=["trade_id","trade_date","ticker"])
+        tags = pd.DataFrame(self._rows("""
+            select trade_id, trade_date, tag, confidence, scope
+            from public.tags_raw
+            where user_id = %s
+        """, (user_id,)), columns=["trade_id","trade_date","tag","confidence","scope"])
+        return SparseLabels.from_tags(trades.assign(user_id=user_id), tags.assign(user_id=user_id),
+                                      propagate_day_to_trades)
+
+    def table_counts(self, user_id: str) -> Dict[str, int]:
+        return {t: self._rows(f"select count(*) from public.{t} where user_id = %s", (user_id,))[0][0]
+                for t in USER_TABLES}
+
+    def sanity_checks(self, user_id: str) -> dict:
+        total_pnl = self._rows("select coalesce(sum(realized_pnl),0) from public.trades where user_id=%s",
+                               (user_id,))[0][0]
+        total_trades = self._rows("select count(*) from public.trades where user_id=%s", (user_id,))[0][0]
+        recent = self._rows("""
+            select user_id, day, realized_pnl
+            from public.v_daily_series
+            where user_id=%s
+            order by day desc limit 5
+        """, (user_id,))
+        return {
+            "sum_realized_pnl_in_trades": float(total_pnl),
+            "trade_count": int(total_trades),
+            "recent_daily_rows": [{"user_id": str(r[0]), "day": str(r[1]), "pnl": float(r[2])} for r in recent],
+        }
+
+    def delete_user(self, user_id: str) -> Tuple[Dict[str, int], int]:
+        """Delete all of the user's rows in one transaction; returns (per-table counts, remaining trades)."""
+        raise NotImplementedError
+
+    def write_outputs(self, user_id: str, trades: pd.DataFrame,
+                      tags: Optional[pd.DataFrame] = None,
+                      trade_scores: Optional[pd.DataFrame] = None,
+                      day_scores: Optional[pd.DataFrame] = None,
+                      full_replace: bool = False,
+                      account_id: Optional[str] = None) -> Dict[str, Dict[str, int]]:
+        """
+        Make the user's stored rows equal to the pipeline outputs, atomically.
+        Returns {table: {"inserted", "updated", "deleted"}}.
+        """
+        raise NotImplementedError
+
+
+class PostgresStorage(Storage):
+    name = "postgres"
+
+    def _rows(self, sql, params=()):
+        with connection() as con:
+            return con.execute(sql, params).fetchall()
+
+    def delete_user(self, user_id):
+        deleted = {}
+        with connection() as con:
+            with con.transaction(), con.cursor() as cur:
+                for table in reversed(USER_TABLES):
+                    cur.execute(f"delete from public.{table} where user_id = %s", (user_id,))
+                    deleted[table] = cur.rowcount
+                cur.execute("select count(*) from public.trades where user_id = %s", (user_id,))
+                remaining = cur.fetchone()[0]
+        return deleted, remaining
+
+    def write_outputs(self, user_id, trades, tags=None, trade_scores=None, day_scores=None,
+                      full_replace=False, account_id=None):
+        with connection() as con:
+            if not full_replace:
+                return sync_outputs(con, user_id, trades, tags, trade_scores, day_scores, account_id)
+            counts = staged_replace(con, user_id, trades, tags, trade_scores, day_scores, account_id)
+        return {t: {"inserted": n, "updated": 0, "deleted": 0} for t, n in counts.items()}
+
+
+SQLITE_SCHEMA = f"""
+create table if not exists trades (
+    trade_id integer primary key, user_id text not null, account_id text not null,
+    ticker text, side text, trade_date text, trade_time text, qty real, entry_price real, exit_price real,
+    fees real, realized_pnl real, strategy text, hold_time_sec real, note text, mood text,
+    manual_tags text, screenshot_url text
+);
+create index if not exists trades_user_idx on trades (user_id, trade_date);
+create table if not exists tags_raw (
+    id integer primary key, user_id text, trade_id integer references trades (trade_id) on delete cascade,
+    trade_date text, tag text, confidence real, rationale text, scope text, source text
+);
+create index if not exists tags_raw_user_idx on tags_raw (user_id);
+create index if not exists tags_raw_trade_idx on tags_raw (trade_id);
+create table if not exists trade_scores (
+    user_id text, trade_id integer references trades (trade_id) on delete cascade, trade_date text, ticker text,
+    {', '.join(f'{c} real' for c in TRADE_SCORE_COLS)},
+    primary key (user_id, trade_id)
+);
+create index if not exists trade_scores_trade_idx on trade_scores (trade_id);
+create table if not exists day_scores (
+    user_id text, trade_date text, day text generated always as (trade_date) virtual,
+    {', '.join(f'{c} real' for c in DAY_SCORE_COLS)},
+    primary key (user_id, trade_date)
+);
+create table if not exists daily_pnl (
+    user_id text, account_id text, day text, realized_pnl real,
+    unique (user_id, account_id, day)
+);
+create view if not exists v_daily_series as
+    select user_id, day, sum(realized_pnl) as realized_pnl from daily_pnl group by user_id, day;
+"""
+
+# SQLite declared type -> the SQL type sync.diff_rows() compares as (REAL is 8-byte)
+SQLITE_TYPES = {"real": "double precision", "integer": "bigint", "text": "text"}
+
+
+class SQLiteStorage(Storage):
+    """Embedded backend: one sqlite3 file, a connection per call, WAL so reads never wait on an import."""
+    name = "sqlite"
+
+    def __init__(self, path=None):
+        self.path = Path(path or os.environ.get("TG_SQLITE_PATH") or DEFAULT_SQLITE_PATH)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as con:
+            con.execute("pragma journal_mode = wal")
+            con.executescript(SQLITE_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        con = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+        try:
+            con.execute("pragma foreign_keys = on")
+            yield con
+        finally:
+            con.close()
+
+    @contextmanager
+    def _transaction(self):
+        with self._connect() as con:
+            con.execute("begin immediate")
+            try:
+                yield con
+            except BaseException:
+                con.execute("rollback")
+                raise
+            con.execute("commit")
+
+    @staticmethod
+    def _sql(sql: str) -> str:
+        return sql.replace("public.", "").replace("%s", "?")
+
+    def _rows(self, sql, params=()):
+        with self._connect() as con:
+            return con.execute(self._sql(sql), params).fetchall()
+
+    @staticmethod
+    def _params(df: pd.DataFrame, cols) -> list:
+        """Rows of df[cols] as sqlite3 parameters (NaN/NA -> NULL, dates -> ISO text)."""
+        return list(zip(*[df[c].astype(object).where(df[c].notna(), None).map(_iso).tolist() for c in cols]))
+
+    def _insert(self, con, table: str, df: pd.DataFrame) -> int:
+        if df.empty:
+            return 0
+        cols = list(df.columns)
+        con.executemany(f"insert into {table} ({','.join(cols)}) values ({','.join('?' * len(cols))})",
+                        self._params(df, cols))
+        return len(df)
+
+    def _diff(self, con, user_id: str, table: str, wire: pd.DataFrame):
+        """sync.diff_rows() against this user's stored rows: (diff, stored, matched)."""
+        spec = SPECS[table]
+        cols = list(dict.fromkeys(list(wire.columns) + list(spec.ident)))
+        stored = pd.read_sql_query(f"select {','.join(cols)} from {table} where user_id = ?", con, params=(user_id,))
+        types = {r[1]: SQLITE_TYPES.get(r[2].lower(), "text") for r in con.execute(f"pragma table_info({table})")}
+        diff, matched = diff_rows(spec, wire, stored, types)
+        return diff, stored, matched
+
+    def _apply_deletes(self, con, user_id: str, d) -> None:
+        ident = list(d.spec.ident)
+        where = " and ".join(f"{c} = ?" for c in ident)
+        con.executemany(f"delete from {d.spec.table} where user_id = ? and {where}",
+                        [(user_id, *row) for row in self._params(d.deletes, ident)])
+
+    def _apply_updates(self, con, user_id: str, d) -> None:
+        ident = list(d.spec.ident)
+        sets = [c for c in d.cols if c not in ident and c != "user_id"]
+        con.executemany(f"update {d.spec.table} set {', '.join(f'{c} = ?' for c in sets)} "
+                        f"where user_id = ? and {' and '.join(f'{c} = ?' for c in ident)}",
+                        [(*row[:len(sets)], user_id, *row[len(sets):]) for row in self._params(d.updates, sets + ident)])
+
+    def delete_user(self, user_id):
+        deleted = {}
+        with self._transaction() as con:
+            for table in reversed(USER_TABLES):
+                deleted[table] = con.execute(f"delete from {table} where user_id = ?", (user_id,)).rowcount
+            remaining = con.execute("select count(*) from trades where user_id = ?", (user_id,)).fetchone()[0]
+        return deleted, remaining
+
+    def write_outputs(self, user_id, trades, tags=None, trade_scores=None, day_scores=None,
+                      full_replace=False, account_id=None):
+        """
+        Same contract as PostgresStorage, in one transaction: by default the rows are
+        diffed on sync.SPECS natural keys (matched trades keep their trade_id, only
+        changes are written); full_replace deletes and reinserts everything.
+        """
+        account_id = account_id or default_account_id(user_id)
+        with self._transaction() as con:
+            if full_replace:
+                return self._replace(con, user_id, trades, tags, trade_scores, day_scores, account_id)
+            next_id = con.execute("select coalesce(max(trade_id), 0) + 1 from trades").fetchone()[0]
+            wire = trades_frame(trades, user_id, account_id, np.zeros(len(trades), dtype=np.int64))
+            d, stored, matched = self._diff(con, user_id, "trades", wire)
+            diffs = {"trades": d}
+            ids = assign_trade_ids(d, stored, matched, lambda n: np.arange(next_id, next_id + n, dtype=np.int64))
+            for table, w in child_wires(user_id, account_id, trades, tags, trade_scores, day_scores,
+                                        trade_id_map(trades, ids)).items():
+                diffs[table] = self._diff(con, user_id, table, w)[0]
+
+            # Children out first, parents in first
+            for table in reversed(USER_TABLES):
+                self._apply_deletes(con, user_id, diffs[table])
+            for table in USER_TABLES:
+                self._apply_updates(con, user_id, diffs[table])
+                self._insert(con, table, diffs[table].inserts[diffs[table].cols])
+        return {t: diffs[t].counts() for t in USER_TABLES}
+
+    def _replace(self, con, user_id, trades, tags, trade_scores, day_scores, account_id):
+        counts = {}
+        deleted = {t: con.execute(f"delete from {t} where user_id = ?", (user_id,)).rowcount
+                   for t in reversed(USER_TABLES)}
+        start = con.execute("select coalesce(max(trade_id), 0) from trades").fetchone()[0]
+        id_map = trade_id_map(trades, np.arange(start + 1, start + 1 + len(trades), dtype=np.int64))
+        for table, (build, _) in _copy_jobs(user_id, trades, tags, trade_scores, day_scores,
+                                            account_id, id_map).items():
+            counts[table] = self._insert(con, table, build())
+        daily = daily_pnl(trades.assign(user_id=user_id))
+        counts["daily_pnl"] = self._insert(con, "daily_pnl", pd.DataFrame({
+            "user_id": user_id, "account_id": account_id,
+            "day": daily["day"].to_numpy(), "realized_pnl": daily["realized_pnl"].to_numpy(),
+        }))
+        return {t: {"inserted": counts.get(t, 0), "updated": 0, "deleted": deleted[t]} for t in USER_TABLES}
+
+
+_storage: Optional[Storage] = None
+_storage_lock = threading.Lock()
+
+def storage_kind() -> str:
+    kind = os.environ.get("TG_STORAGE", "").strip().lower()
+    return kind or ("postgres" if os.environ.get("DATABASE_URL") else "sqlite")
+
+def get_storage() -> Storage:
+    """The process-wide storage backend (created on first use, see module docstring)."""
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            kind = storage_kind()
+            if kind == "postgres":
+                _storage = PostgresStorage()
+            elif kind == "sqlite":
+                _storage = SQLiteStorage()
+            else:
+                raise RuntimeError(f"Unknown TG_STORAGE: {kind!r} (expected 'postgres' or 'sqlite')")
+        return _storage
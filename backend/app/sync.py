@@ -0,0 +1,266 @@
+"""
+sync.py
+-------
+Differential writer: bring a user's stored pipeline outputs (trades, daily_pnl,
+tags_raw, trade_scores, day_scores) in line with a freshly computed set by
+writing only what changed.
+
+Every table is matched on a stable natural key and each row is fingerprinted
+with a hash of its values (compared after casting both sides to the column's SQL
+type: float4 scores exactly, numeric columns to NUMERIC_DECIMALS places):
+
+    trades        ticker, side, trade_date + occurrence within that group
+    daily_pnl     account_id, day
+    tags_raw      trade_id, trade_date, tag, scope + occurrence (by rationale)
+    trade_scores  trade_id
+    day_scores    trade_date
+
+Matched trades keep their database trade_id, so tags and scores of unchanged
+trades match too. Only the diff is sent: inserts via COPY, updates via COPY into
+a temp table plus one UPDATE ... FROM, deletes with one DELETE per table, all in
+a single transaction (readers see the old or the new state, never a mix).
+
+diff_rows(), assign_trade_ids() and child_wires() are backend independent;
+SQLiteStorage.write_outputs() applies the same diff to the embedded database.
+
+Once trade ids are settled, the other tables' diffs (reading and hashing the
+stored rows) are independent and run concurrently on pooled connections, up to
+bulk_load.stage_workers(); the writes stay on the caller's transaction.
+"""
+
+from __future__ import annotations
+import io
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .bulk_load import (
+    TRADE_TEXT_COLS, USER_TABLES,
+    copy_frame, day_scores_frame, default_account_id, reserve_trade_ids,
+    stage_workers, tags_frame, trade_id_map, trade_scores_frame, trades_frame,
+)
+from .db import connection
+from .ingest import daily_pnl
+
+NUMERIC_TYPES = ("numeric", "double precision", "bigint", "integer", "smallint")
+# Numeric columns compare at this many decimals (float8 -> numeric casts keep 15 digits)
+NUMERIC_DECIMALS = 9
+
+
+@dataclass(frozen=True)
+class TableSync:
+    table: str
+    key: Tuple[str, ...]                # natural key; "_ord" = occurrence within the rest of the key
+    ident: Tuple[str, ...]              # stored columns addressing a row for UPDATE/DELETE
+    order: Tuple[str, ...] = ()         # tie-break for occurrence numbering
+    text_cols: Tuple[str, ...] = ()     # COPY FORCE_NOT_NULL columns
+
+SPECS = {
+    "trades": TableSync("trades", ("ticker", "side", "trade_date", "_ord"), ("trade_id",),
+                        order=("trade_id",), text_cols=tuple(TRADE_TEXT_COLS)),
+    "daily_pnl": TableSync("daily_pnl", ("account_id", "day"), ("account_id", "day")),
+    "tags_raw": TableSync("tags_raw", ("trade_id", "trade_date", "tag", "scope", "_ord"), ("id",),
+                          order=("rationale",), text_cols=("tag", "rationale", "scope", "source")),
+    "trade_scores": TableSync("trade_scores", ("trade_id",), ("trade_id",), text_cols=("ticker",)),
+    "day_scores": TableSync("day_scores", ("trade_date",), ("trade_date",)),
+}
+
+
+@dataclass
+class TableDiff:
+    spec: TableSync
+    cols: list                      # columns written (wire frame columns)
+    inserts: pd.DataFrame
+    updates: pd.DataFrame
+    deletes: pd.DataFrame           # stored ident values
+
+    def counts(self) -> Dict[str, int]:
+        return {"inserted": len(self.inserts), "updated": len(self.updates), "deleted": len(self.deletes)}
+
+
+# ---------- Stored rows / canonical form ----------
+def _column_types(cur, table: str) -> Dict[str, str]:
+    cur.execute("""
+        select column_name, data_type from information_schema.columns
+        where table_schema = 'public' and table_name = %s
+    """, (table,))
+    return dict(cur.fetchall())
+
+def _stored(cur, table: str, cols, user_id: str) -> pd.DataFrame:
+    """The user's rows of public.<table> as strings (NULL and '' both read as '')."""
+    buf = io.BytesIO()
+    with cur.copy(f"COPY (select {','.join(cols)} from public.{table} where user_id = %s) "
+                  f"TO STDOUT (FORMAT csv, HEADER)", (user_id,)) as copy:
+        for block in copy:
+            buf.write(block)
+    buf.seek(0)
+    return pd.read_csv(buf, dtype=str, keep_default_na=False)
+
+def _canon(df: pd.DataFrame, types: Dict[str, str]) -> pd.DataFrame:
+    """Cast columns to what the database stores so hashes agree across both sides."""
+    out = pd.DataFrame(index=df.index)
+    for c in df.columns:
+        t = types.get(c, "text")
+        if t == "real":
+            out[c] = pd.to_numeric(df[c], errors="coerce").astype("float32")
+        elif t in NUMERIC_TYPES:
+            out[c] = pd.to_numeric(df[c], errors="coerce").astype("float64").round(NUMERIC_DECIMALS)
+        else:
+            out[c] = df[c].astype(object).where(df[c].notna(), "").astype(str)
+    return out
+
+def _keyed(canon: pd.DataFrame, spec: TableSync, values) -> pd.DataFrame:
+    """Natural key columns (+ occurrence number) and a row hash over `values`."""
+    base = [k for k in spec.key if k != "_ord"]
+    out = canon[base].copy()
+    if "_ord" in spec.key:
+        order = canon.sort_values(list(spec.order), kind="stable") if spec.order else canon
+        out["_ord"] = order.groupby(base, dropna=False, sort=False).cumcount().reindex(canon.index)
+    out["_h"] = pd.util.hash_pandas_object(canon[list(values)], index=False).to_numpy()
+    return out
+
+def diff_table(cur, user_id: str, spec: TableSync,
+               wire: pd.DataFrame) -> Tuple[TableDiff, pd.DataFrame, pd.Series]:
+    """
+    Diff new COPY-ready rows against the stored ones.
+    Returns the diff, the stored rows, and for every wire row the positional index
+    of its matched stored row (-1 if new).
+    """
+    stored_cols = list(dict.fromkeys(list(wire.columns) + list(spec.ident)))
+    stored = _stored(cur, spec.table, stored_cols, user_id)
+    diff, matched = diff_rows(spec, wire, stored, _column_types(cur, spec.table))
+    return diff, stored, matched
+
+def diff_rows(spec: TableSync, wire: pd.DataFrame, stored: pd.DataFrame,
+              types: Dict[str, str]) -> Tuple[TableDiff, pd.Series]:
+    """
+    diff_table() over already-read stored rows (wire columns + spec.ident), with
+    `types` mapping columns to their SQL type names. Backend independent.
+    """
+    cols = list(wire.columns)
+    values = [c for c in cols if c not in spec.key and c not in spec.ident and c != "user_id"]
+    new_k = _keyed(_canon(wire.reset_index(drop=True), types), spec, values)
+    old_k = _keyed(_canon(stored[cols], types), spec, values)
+
+    key = list(spec.key)
+    m = new_k.assign(_new=np.arange(len(new_k))).merge(
+        old_k.assign(_old=np.arange(len(old_k))), on=key, how="outer", suffixes=("", "_o"))
+    is_new, is_gone = m["_old"].isna(), m["_new"].isna()
+    changed = ~is_new & ~is_gone & (m["_h"] != m["_h_o"])
+
+    matched = pd.Series(-1, index=np.arange(len(new_k)), dtype=np.int64)
+    both = m[~is_new & ~is_gone]
+    matched.iloc[both["_new"].astype(np.int64).to_numpy()] = both["_old"].astype(np.int64).to_numpy()
+
+    w = wire.reset_index(drop=True)
+    upd_pos = m.loc[changed, ["_new", "_old"]].astype(np.int64)
+    updates = w.iloc[upd_pos["_new"].to_numpy()].copy()
+    for c in spec.ident:
+        updates[c] = stored[c].iloc[upd_pos["_old"].to_numpy()].to_numpy()
+    diff = TableDiff(
+        spec=spec,
+        cols=cols,
+        inserts=w.iloc[m.loc[is_new, "_new"].astype(np.int64).to_numpy()],
+        updates=updates[list(dict.fromkeys(cols + list(spec.ident)))],
+        deletes=stored.iloc[m.loc[is_gone, "_old"].astype(np.int64).to_numpy()][list(spec.ident)],
+    )
+    return diff, matched
+
+def assign_trade_ids(d: TableDiff, stored: pd.DataFrame, matched: pd.Series, reserve) -> np.ndarray:
+    """
+    Database trade_id per wire trade row: matched trades keep their stored id, new
+    ones get reserve(n) fresh ids (also written into d.inserts).
+    """
+    ids = np.empty(len(matched), dtype=np.int64)
+    old = matched.to_numpy() >= 0
+    ids[old] = stored["trade_id"].to_numpy(dtype=np.int64)[matched.to_numpy()[old]]
+    ids[~old] = reserve(int((~old).sum()))
+    d.inserts = d.inserts.assign(trade_id=ids[d.inserts.index.to_numpy()])
+    return ids
+
+def child_wires(user_id: str, account_id: str, trades: pd.DataFrame, tags, trade_scores, day_scores,
+                id_map: pd.Series) -> Dict[str, pd.DataFrame]:
+    """Wire rows of every table but trades, keyed by the settled database trade ids."""
+    daily = daily_pnl(trades.assign(user_id=user_id))
+    empty = pd.DataFrame(columns=["trade_id", "trade_date", "tag", "ticker"])
+    if trade_scores is not None and not trade_scores.empty:
+        score_rows = trade_scores_frame(trade_scores, user_id, id_map)
+    else:
+        score_rows = pd.DataFrame(columns=["user_id", "trade_id", "trade_date", "ticker"])
+    return {
+        "daily_pnl": pd.DataFrame({"user_id": user_id, "account_id": account_id,
+                                   "day": daily["day"].to_numpy(), "realized_pnl": daily["realized_pnl"].to_numpy()}),
+        "tags_raw": tags_frame(tags if tags is not None else empty, user_id, id_map),
+        "trade_scores": score_rows,
+        "day_scores": day_scores_frame(day_scores if day_scores is not None else empty[["trade_date"]], user_id),
+    }
+
+def _diff_pooled(user_id: str, spec: TableSync, wire: pd.DataFrame) -> TableDiff:
+    """diff_table on its own (pooled) connection."""
+    with connection() as con, con.cursor() as cur:
+        return diff_table(cur, user_id, spec, wire)[0]
+
+
+# ---------- Apply ----------
+def _delete(cur, user_id: str, d: TableDiff, types: Dict[str, str]) -> None:
+    if d.deletes.empty:
+        return
+    ident = list(d.spec.ident)
+    arrays = [[v if v != "" else None for v in d.deletes[c]] for c in ident]
+    casts = ",".join(f"%s::{types[c]}[]" for c in ident)
+    cur.execute(f"""
+        delete from public.{d.spec.table}
+        where user_id = %s and ({','.join(ident)}) in (select * from unnest({casts}))
+    """, (user_id, *arrays))
+
+def _update(cur, d: TableDiff) -> None:
+    if d.updates.empty:
+        return
+    t, tmp = d.spec.table, f"sync_{d.spec.table}"
+    cur.execute(f"create temp table {tmp} (like public.{t}) on commit drop")
+    copy_frame(cur, f"pg_temp.{tmp}", d.updates, d.spec.text_cols)
+    match = " and ".join(f"t.{c} = u.{c}" for c in ("user_id", *d.spec.ident))
+    sets = ", ".join(f"{c} = u.{c}" for c in d.cols if c not in d.spec.ident and c != "user_id")
+    cur.execute(f"update public.{t} t set {sets} from pg_temp.{tmp} u where {match}")
+
+def sync_outputs(con, user_id: str, trades: pd.DataFrame,
+                 tags: Optional[pd.DataFrame] = None,
+                 trade_scores: Optional[pd.DataFrame] = None,
+                 day_scores: Optional[pd.DataFrame] = None,
+                 account_id: Optional[str] = None) -> Dict[str, Dict[str, int]]:
+    """
+    Make the user's stored outputs equal to the given frames, writing only the diff.
+    Missing (None) tags/scores count as empty, like a full replace.
+    Returns {table: {"inserted", "updated", "deleted"}}.
+    """
+    account_id = account_id or default_account_id(user_id)
+    diffs = {}
+    with con.transaction(), con.cursor() as cur:
+        # Trades first: matched trades keep their stored id, new ones get fresh ids
+        wire = trades_frame(trades, user_id, account_id, np.zeros(len(trades), dtype=np.int64))
+        d, stored, matched = diff_table(cur, user_id, SPECS["trades"], wire)
+        diffs["trades"] = d
+        ids = assign_trade_ids(d, stored, matched, lambda n: reserve_trade_ids(cur, n))
+        wires = child_wires(user_id, account_id, trades, tags, trade_scores, day_scores, trade_id_map(trades, ids))
+
+        # Nothing is written yet, so other connections read the same stored rows
+        workers = stage_workers(len(wires))
+        if workers == 1:
+            for table, wire in wires.items():
+                diffs[table] = diff_table(cur, user_id, SPECS[table], wire)[0]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as ex:
+                futures = {t: ex.submit(_diff_pooled, user_id, SPECS[t], w) for t, w in wires.items()}
+                diffs.update({t: f.result() for t, f in futures.items()})
+
+        # Children out first, parents in first
+        for table in reversed(USER_TABLES):
+            _delete(cur, user_id, diffs[table], _column_types(cur, table))
+        for table in USER_TABLES:
+            d = diffs[table]
+            _update(cur, d)
+            copy_frame(cur, f"public.{table}", d.inserts[d.cols], d.spec.text_cols)
+    return {t: diffs[t].counts() for t in USER_TABLES}
@@ -0,0 +1,153 @@
+"""
+loadtest.py
+-----------
+Latency of cheap endpoints while a CSV import is running.
+
+Starts the API in-process with uvicorn, samples /api/health and /api/trades
+on their own for a baseline, then keeps sampling while an import job queued
+by POST /api/import-csv processes a ledger (until /api/import-jobs/{id} reports
+done or failed). If blocking work leaks onto the event loop the "during
+import" percentiles jump to roughly the import duration; they should stay flat.
+
+The upload is queued on the API's in-memory import job queue (app/jobs.py) and
+written with the default diff sync, into the same storage backend and TG_USER_ID
+as the API: that user's rows end up matching the synthetic ledger.
+
+    python loadtest.py --repeat 20 --concurrency 8
+"""
+
+from __future__ import annotations
+import argparse
+import io
+import json
+import socket
+import statistics
+import threading
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+import uvicorn
+
+import main
+from app.jobs import FINISHED
+
+DATA_DIR = Path(__file__).parent / "data"
+PROBES = ("/api/health", "/api/trades")
+JOB_POLL_INTERVAL = 0.2  # seconds between import job status checks
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def synthetic_ledger(path: Path, repeat: int) -> bytes:
+    """The sample ledger repeated `repeat` times, each copy shifted past the previous one."""
+    base = pd.read_csv(path, parse_dates=["date"])
+    span = (base["date"].max() - base["date"].min()).days + 1
+    copies = [base.assign(date=base["date"] + pd.Timedelta(days=k * span)) for k in range(repeat)]
+    buf = io.StringIO()
+    pd.concat(copies, ignore_index=True).assign(date=lambda d: d["date"].dt.strftime("%Y-%m-%d")).to_csv(buf, index=False)
+    return buf.getvalue().encode()
+
+def _multipart(field: str, filename: str, payload: bytes):
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"{field}\"; filename=\"{filename}\"\r\n"
+        f"Content-Type: text/csv\r\n\r\n"
+    ).encode() + payload + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+def _timed_get(url: str) -> float:
+    t0 = time.perf_counter()
+    with urllib.request.urlopen(url, timeout=120) as r:
+        r.read()
+    return (time.perf_counter() - t0) * 1000
+
+def sample(base: str, concurrency: int, until) -> dict:
+    """Hit every probe endpoint from `concurrency` workers until until() is true."""
+    lat = {p: [] for p in PROBES}
+    lock = threading.Lock()
+
+    def worker(i):
+        path = PROBES[i % len(PROBES)]
+        while not until():
+            ms = _timed_get(base + path)
+            with lock:
+                lat[path].append(ms)
+            time.sleep(0.01)
+
+    with ThreadPoolExecutor(concurrency) as ex:
+        list(ex.map(worker, range(concurrency)))
+    return lat
+
+def _report(label: str, lat: dict) -> None:
+    for path, xs in lat.items():
+        if not xs:
+            print(f"{label:>14} {path:<12} no samples")
+            continue
+        xs = sorted(xs)
+        p95 = xs[min(len(xs) - 1, int(len(xs) * 0.95))]
+        print(f"{label:>14} {path:<12} n={len(xs):5d}  p50={statistics.median(xs):7.1f}ms  "
+              f"p95={p95:7.1f}ms  max={xs[-1]:7.1f}ms")
+
+def main_cli():
+    ap = argparse.ArgumentParser(description="Probe endpoint latency while /api/import-csv runs.")
+    ap.add_argument("--ledger", default=str(DATA_DIR / "mock_trades_realistic.csv"))
+    ap.add_argument("--repeat", type=int, default=20, help="copies of the ledger to import")
+    ap.add_argument("--concurrency", type=int, default=8, help="concurrent probe workers")
+    ap.add_argument("--baseline", type=float, default=3.0, help="seconds of baseline sampling")
+    args = ap.parse_args()
+
+    payload = synthetic_ledger(Path(args.ledger), args.repeat)
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    base = f"http://127.0.0.1:{port}"
+
+    try:
+        t_end = time.perf_counter() + args.baseline
+        baseline = sample(base, args.concurrency, lambda: time.perf_counter() >= t_end)
+
+        done = threading.Event()
+        result = {}
+
+        def run_import():
+            body, ctype = _multipart("file", "loadtest.csv", payload)
+            req = urllib.request.Request(base + "/api/import-csv", data=body, headers={"Content-Type": ctype})
+            t0 = time.perf_counter()
+            try:
+                # 202 + job id: the import itself runs in the background, so wait for the job
+                with urllib.request.urlopen(req, timeout=120) as r:
+                    job_id = json.loads(r.read())["job_id"]
+                while True:
+                    with urllib.request.urlopen(f"{base}/api/import-jobs/{job_id}", timeout=120) as r:
+                        job = json.loads(r.read())
+                    if job["status"] in FINISHED:
+                        result["status"] = job["status"] if not job["error"] else f"{job['status']}: {job['error']}"
+                        break
+                    time.sleep(JOB_POLL_INTERVAL)
+            except Exception as e:
+                result["status"] = repr(e)
+            result["secs"] = time.perf_counter() - t0
+            done.set()
+
+        threading.Thread(target=run_import, daemon=True).start()
+        during = sample(base, args.concurrency, done.is_set)
+    finally:
+        server.should_exit = True
+
+    rows = payload.count(b"\n") - 1
+    print(f"import: {rows} ledger rows, status {result['status']}, {result['secs']:.2f}s")
+    _report("baseline", baseline)
+    _report("during import", during)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,4 +1,4 @@
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse, StreamingResponse
@@ -12,15 +12,10 @@ import sys
 import uvicorn
 import openai
 from dotenv import load_dotenv
-import io
 from datetime import datetime
-import uuid
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.lib import colors
-from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
+import functools
+import anyio
+import asyncio
 
 # Add the backend app directory to Python path
 sys.path.append(str(Path(__file__).parent.parent / "backend" / "app"))
@@ -30,6 +25,18 @@ from app.ingest import load_ledger, fifo_round_trips
 from app.features import compute_features
 from app.rules import run_all_rules
 from app.labels import build_labels
+from app.db import open_pool, close_pool
+from app.storage import get_storage
+from app.cache import user_cache
+from app.llm_cache import response_cache
+from app.similar import build_index
+from app.jobs import FINISHED, import_jobs
+from app.ingest_to_supabase import import_outputs, user_data_changed
+from app.report import cached_report, render_report_file, report_key, report_pool, shutdown_report_pool
+from app.coach_context import (
+    CONTEXT_TOKENS, HISTORY_TOKENS, discard_summary, estimate_tokens, load_or_build, render_context,
+    summary_version,
+)
 
 # Load environment variables
 load_dotenv()
@@ -45,6 +52,36 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+def startup_db_pool():
+    """Open the shared DB connection pool (see app/db.py for sizing/env)."""
+    # Every run_blocking thread may hold a connection; imports split the rest
+    open_pool(reserved=BLOCKING_WORKERS, writers=import_jobs.max_workers)
+
+@app.on_event("shutdown")
+def shutdown_db_pool():
+    close_pool()
+
+@app.on_event("shutdown")
+def shutdown_report_workers():
+    shutdown_report_pool()
+
+@app.on_event("shutdown")
+def shutdown_import_jobs():
+    import_jobs.shutdown()
+
+# Blocking work (sync psycopg, pandas pipeline) runs on a bounded worker pool so
+# async endpoints never stall the event loop. Keep this <= TG_DB_POOL_MAX.
+BLOCKING_WORKERS = int(os.environ.get("TG_BLOCKING_WORKERS", "8"))
+_blocking_limiter = None
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run fn(*args, **kwargs) on the bounded worker pool and await the result."""
+    global _blocking_limiter
+    if _blocking_limiter is None:
+        _blocking_limiter = anyio.CapacityLimiter(BLOCKING_WORKERS)
+    return await anyio.to_thread.run_sync(functools.partial(fn, *args, **kwargs), limiter=_blocking_limiter)
+
 # Pydantic models
 class TradeCreate(BaseModel):
     date: str
@@ -97,180 +134,145 @@ class AnalyticsResponse(BaseModel):
 trades_db = []
 user_id = os.environ.get("TG_USER_ID")
 
+def data_cache_name(uid, name):
+    """user_cache name tied to uid's saved data version, so imports by other processes (CLI) are noticed."""
+    return f"{name}:{summary_version(uid)}"
+
 def get_all_trades_from_supabase():
-    """Fetch all trades from Supabase for the current user"""
+    """Fetch all trades for the current user from the configured storage backend"""
     try:
-        import psycopg
-        from app.ingest_to_supabase import UID, DB
-        
-        if not DB:
-            print("Database connection not configured")
-            return []
+        from app.ingest_to_supabase import UID
         
-        with psycopg.connect(DB, autocommit=True) as con:
-            with con.cursor() as cur:
-                cur.execute("""
-                    SELECT trade_id, ticker, side, trade_date, trade_time, qty, 
-                           entry_price, exit_price, fees, realized_pnl, strategy, 
-                           hold_time_sec, note, mood, manual_tags, screenshot_url
-                    FROM public.trades 
-                    WHERE user_id = %s 
-                    ORDER BY trade_date DESC, trade_id DESC
-                """, (UID,))
-                
-                trades = cur.fetchall()
-                
-                # Convert to list of dictionaries
-                trade_list = []
-                for trade in trades:
-                    trade_dict = {
-                        'trade_id': trade[0],
-                        'ticker': trade[1],
-                        'side': trade[2],
-                        'trade_date': trade[3].isoformat() if trade[3] else None,
-                        'trade_time': trade[4].isoformat() if trade[4] else None,
-                        'qty': float(trade[5]) if trade[5] else 0,
-                        'entry_price': float(trade[6]) if trade[6] else 0,
-                        'exit_price': float(trade[7]) if trade[7] else 0,
-                        'fees': float(trade[8]) if trade[8] else 0,
-                        'realized_pnl': float(trade[9]) if trade[9] else 0,
-                        'strategy': trade[10] or '',
-                        'hold_time_sec': trade[11],
-                        'note': trade[12] or '',
-                        'mood': trade[13] or '',
-                        'manual_tags': trade[14] or '',
-                        'screenshot_url': trade[15] or ''
-                    }
-                    trade_list.append(trade_dict)
-                
-                print(f"Fetched {len(trade_list)} trades from Supabase")
-                return trade_list
+        trade_list = user_cache.get_or_compute(UID, data_cache_name(UID, "trades"), lambda: get_storage().trades(UID))
+        print(f"Fetched {len(trade_list)} trades from {get_storage().name}")
+        return trade_list
                 
     except Exception as e:
-        print(f"Error fetching trades from Supabase: {str(e)}")
+        print(f"Error fetching trades: {str(e)}")
         return []
-    
-def compress_scores(csv_path: str, threshold: float = 0.6):
-    """
-    Read a 'trade_scores_with_day.csv' style file and return a list of:
-      { trade_id, trade_date, ticker, tags: [codes with score >= threshold] }
-
-    Notes:
-    - Expects numeric scores in [0,1].
-    - id columns are detected ('trade_id','trade_date','ticker'); everything else
-      that's numeric is treated as a candidate behavior column.
-    """
-    df = pd.read_csv(csv_path)
-    if df.empty:
-        return []
-
-    # Identify identifier columns & candidate behavior columns
-    id_cols = {"trade_id", "trade_date", "ticker"}
-    # Treat non-object dtypes as numeric score columns
-    behavior_cols = [c for c in df.columns if c not in id_cols and df[c].dtype != "O"]
-
-    records = []
-    for _, r in df.iterrows():
-        tags = []
-        for c in behavior_cols:
-            try:
-                val = float(r.get(c, 0))
-                if val >= threshold:
-                    tags.append(c)
-            except Exception:
-                pass
-        records.append({
-            "trade_id": int(r["trade_id"]) if "trade_id" in df.columns and pd.notna(r.get("trade_id")) else None,
-            "trade_date": str(r.get("trade_date", "")),
-            "ticker": str(r.get("ticker", "")),
-            "tags": tags
-        })
-    return records
 
 def get_behavioral_data_from_supabase():
-    """Fetch behavioral data from Supabase for the current user"""
+    """Fetch behavioral data for the current user from the configured storage backend"""
     try:
-        import psycopg
-        from app.ingest_to_supabase import UID, DB
-        
-        if not DB:
-            print("Database connection not configured")
-            return {}
+        from app.ingest_to_supabase import UID
         
-        behavioral_data = {}
-        
-        with psycopg.connect(DB, autocommit=True) as con:
-            with con.cursor() as cur:
-                # Get trade scores
-                cur.execute("""
-                    SELECT trade_id, outcome_win, outcome_loss, outcome_breakeven,
-                           large_win, large_loss, revenge_immediate, size_inconsistency,
-                           follow_through_win_immediate, disciplined_after_loss_immediate,
-                           consistent_size
-                    FROM public.trade_scores 
-                    WHERE user_id = %s
-                """, (UID,))
-                trade_scores = cur.fetchall()
-                behavioral_data['trade_scores'] = [
-                    {
-                        'trade_id': score[0],
-                        'outcome_win': score[1],
-                        'outcome_loss': score[2],
-                        'outcome_breakeven': score[3],
-                        'large_win': score[4],
-                        'large_loss': score[5],
-                        'revenge_immediate': score[6],
-                        'size_inconsistency': score[7],
-                        'follow_through_win_immediate': score[8],
-                        'disciplined_after_loss_immediate': score[9],
-                        'consistent_size': score[10]
-                    } for score in trade_scores
-                ]
-                
-                # Get day scores
-                cur.execute("""
-                    SELECT day, overtrading_day, revenge_day, chop_day,
-                           ticker_bias_lifetime, ticker_bias_recent, focused_day,
-                           green_day_low_activity
-                    FROM public.day_scores 
-                    WHERE user_id = %s
-                """, (UID,))
-                day_scores = cur.fetchall()
-                behavioral_data['day_scores'] = [
-                    {
-                        'day': score[0].isoformat() if score[0] else None,
-                        'overtrading_day': score[1],
-                        'revenge_day': score[2],
-                        'chop_day': score[3],
-                        'ticker_bias_lifetime': score[4],
-                        'ticker_bias_recent': score[5],
-                        'focused_day': score[6],
-                        'green_day_low_activity': score[7]
-                    } for score in day_scores
-                ]
-                
-                # Get tags
-                cur.execute("""
-                    SELECT trade_id, tag, confidence
-                    FROM public.tags_raw 
-                    WHERE user_id = %s
-                """, (UID,))
-                tags = cur.fetchall()
-                behavioral_data['tags'] = [
-                    {
-                        'trade_id': tag[0],
-                        'tag': tag[1],
-                        'confidence': tag[2]
-                    } for tag in tags
-                ]
-                
-                print(f"Fetched behavioral data: {len(trade_scores)} trade scores, {len(day_scores)} day scores, {len(tags)} tags")
-                return behavioral_data
+        behavioral_data = user_cache.get_or_compute(UID, data_cache_name(UID, "behavioral_data"),
+                                                    lambda: get_storage().behavioral_data(UID))
+        print(f"Fetched behavioral data: {len(behavioral_data['trade_scores'])} trade scores, "
+              f"{len(behavioral_data['day_scores'])} day scores, {len(behavioral_data['tags'])} tags")
+        return behavioral_data
                 
     except Exception as e:
-        print(f"Error fetching behavioral data from Supabase: {str(e)}")
+        print(f"Error fetching behavioral data: {str(e)}")
         return {}
 
+def get_coaching_summary():
+    """Precomputed coaching summary (app/coach_context.py), cached per data generation."""
+    try:
+        from app.ingest_to_supabase import UID
+
+        return user_cache.get_or_compute(UID, data_cache_name(UID, "coaching_summary"),
+                                         lambda: load_or_build(UID, get_storage()))
+
+    except Exception as e:
+        print(f"Error loading coaching summary: {str(e)}")
+        return {"sections": []}
+
+def get_similar_index():
+    """Similar-trade index over the stored trades (app/similar.py), cached per data generation."""
+    from app.ingest_to_supabase import UID
+
+    return user_cache.get_or_compute(UID, data_cache_name(UID, "similar_index"), lambda: build_index(
+        UID, get_all_trades_from_supabase(),
+        get_behavioral_data_from_supabase().get("trade_scores", []),
+    ))
+
+def similar_trade_lines(trade_id, k=5):
+    """'Last k times you did this' lines for one stored trade, or [] if it is unknown."""
+    found = get_similar_index().similar(trade_id, k=k)
+    if not found or not found["similar"]:
+        return []
+    t, similar = found["trade"], found["similar"]
+    wins = sum(1 for s in similar if s["realized_pnl"] > 0)
+    avg = sum(s["realized_pnl"] for s in similar) / len(similar)
+    lines = [f"- {t['ticker']} ({t['side']}) on {t['trade_date']}: last {len(similar)} similar setups "
+             f"went {wins}W/{len(similar) - wins}L, avg ${avg:.2f}"]
+    for s in similar:
+        after = f", after a {s['after']}" if s["after"] else ""
+        flags = f", flags: {', '.join(s['behaviors'])}" if s["behaviors"] else ""
+        lines.append(f"  - {s['ticker']} ({s['side']}) {s['trade_date']}: ${s['realized_pnl']:.2f}{after}{flags}")
+    return lines
+
+def similar_trade_sections(ctx, max_trades=3):
+    """SIMILAR PAST TRADES section for the first few selected trades (blocking: may build the index)."""
+    lines = []
+    for trade in ctx.get('selectedTrades', [])[:max_trades]:
+        try:
+            lines.extend(similar_trade_lines(int(trade["trade_id"])))
+        except Exception:
+            pass
+    return [{"title": "SIMILAR PAST TRADES", "lines": lines}] if lines else []
+
+def client_context_sections(ctx):
+    """
+    Request-specific context from the client as (leading, trailing) section lists:
+    the user's selected trades lead the prompt, the client-side analytics follow
+    the precomputed summary.
+    """
+    leading, trailing = [], []
+
+    # Selected trades context
+    selected_trades = ctx.get('selectedTrades', [])
+    if selected_trades:
+        lines = []
+        for trade in selected_trades[:10]:  # Show up to 10 selected trades
+            try:
+                lines.append(
+                    f"- {trade.get('ticker', 'N/A')} ({trade.get('side', 'N/A')}) "
+                    f"on {trade.get('trade_date', 'N/A')}: "
+                    f"${float(trade.get('realized_pnl', 0)):.2f} P&L, "
+                    f"Mood: {trade.get('mood', 'N/A')}, "
+                    f"Tags: {trade.get('manual_tags', 'N/A')}"
+                )
+            except Exception:
+                pass
+        leading.append({"title": f"SELECTED TRADES FOR ANALYSIS ({len(selected_trades)} trades)", "lines": lines})
+
+    # Behavioral insights (from client context)
+    insights = ctx.get('insights', [])
+    if insights:
+        trailing.append({"title": "BEHAVIORAL INSIGHTS", "lines": [f"- {insight}" for insight in insights[:5]]})
+
+    # Patterns (from client context)
+    patterns = ctx.get('patterns', [])
+    if patterns:
+        trailing.append({"title": "IDENTIFIED PATTERNS", "lines": [f"- {pattern}" for pattern in patterns[:5]]})
+
+    # Mood analysis (from client context)
+    mood_analysis = ctx.get('moodAnalysis', {})
+    if mood_analysis:
+        lines = []
+        for mood, data in mood_analysis.items():
+            if isinstance(data, dict) and 'count' in data:
+                avg = data.get('avgPnl', 0) or 0
+                lines.append(f"- {mood}: {data.get('count', 0)} trades, Avg P&L: ${float(avg):.2f}")
+        trailing.append({"title": "MOOD ANALYSIS", "lines": lines})
+
+    # Risk metrics (from client context)
+    risk_metrics = ctx.get('riskMetrics', {})
+    if risk_metrics:
+        trailing.append({"title": "RISK METRICS",
+                         "lines": [f"- {metric}: {value}" for metric, value in risk_metrics.items()]})
+
+    # Tag frequency analysis (from client context)
+    tag_frequency = ctx.get('tagFrequency', [])
+    if tag_frequency:
+        trailing.append({"title": "BEHAVIORAL TAG FREQUENCY", "lines": [
+            f"- {tag.get('tag', 'N/A')}: {tag.get('frequency', 0)} occurrences" for tag in tag_frequency[:8]
+        ]})
+
+    return leading, trailing
+
 @app.get("/")
 async def root():
     return {"message": "Tradegist AI API", "version": "1.0.0"}
@@ -325,186 +327,39 @@ async def get_trade(trade_id: str):
             return trade
     raise HTTPException(status_code=404, detail="Trade not found")
 
-# AI Chat endpoint
-@app.post("/api/chat", response_model=ChatResponse)
-async def chat_with_ai(request: ChatMessage):
-    """Chat with AI trading behavior coach"""
-    try:
-        # ------------------------------------------------------------------
-        # 0) Gather DB-backed context (unchanged)
-        # ------------------------------------------------------------------
-        print("Fetching all trades from Supabase...")
-        all_trades_from_db = get_all_trades_from_supabase()
-        behavioral_data_from_db = get_behavioral_data_from_supabase()
-
-        # ------------------------------------------------------------------
-        # 1) Build context (keep your existing logic, but make it resilient)
-        # ------------------------------------------------------------------
-        context_info = ""
-        ctx = getattr(request, "context", None) or {}
-
-        if ctx:
-            selected_trades = ctx.get('selectedTrades', [])
-            all_trades = ctx.get('allTrades', [])
-
-            # Selected trades context
-            if selected_trades:
-                context_info += f"\n\nSELECTED TRADES FOR ANALYSIS ({len(selected_trades)} trades):\n"
-                for trade in selected_trades[:10]:  # Show up to 10 selected trades
-                    try:
-                        context_info += (
-                            f"- {trade.get('ticker', 'N/A')} ({trade.get('side', 'N/A')}) "
-                            f"on {trade.get('trade_date', 'N/A')}: "
-                            f"${float(trade.get('realized_pnl', 0)):.2f} P&L, "
-                            f"Mood: {trade.get('mood', 'N/A')}, "
-                            f"Tags: {trade.get('manual_tags', 'N/A')}\n"
-                        )
-                    except Exception:
-                        pass
-
-            # Overall trading statistics from Supabase
-            if all_trades_from_db:
-                total_trades = len(all_trades_from_db)
-                winning_trades = len([t for t in all_trades_from_db if (t.get('realized_pnl') or 0) > 0])
-                win_rate = (winning_trades / total_trades * 100) if total_trades > 0 else 0
-                total_pnl = sum([(t.get('realized_pnl') or 0) for t in all_trades_from_db])
-                avg_pnl = total_pnl / total_trades if total_trades > 0 else 0
-
-                context_info += f"\n\nCOMPLETE TRADING HISTORY FROM DATABASE ({total_trades} trades):\n"
-                context_info += f"- Total Trades: {total_trades}\n"
-                context_info += f"- Win Rate: {win_rate:.1f}%\n"
-                context_info += f"- Total P&L: ${total_pnl:.2f}\n"
-                context_info += f"- Average P&L per Trade: ${avg_pnl:.2f}\n"
-
-                # Add recent trades summary
-                recent_trades = all_trades_from_db[:20]  # Last 20 trades (assumes already sorted desc)
-                context_info += f"\n\nRECENT TRADES SUMMARY (Last 20):\n"
-                for trade in recent_trades:
-                    try:
-                        context_info += (
-                            f"- {trade.get('ticker', 'N/A')} ({trade.get('side', 'N/A')}) "
-                            f"on {trade.get('trade_date', 'N/A')}: "
-                            f"${float(trade.get('realized_pnl', 0)):.2f}, "
-                            f"Mood: {trade.get('mood', 'N/A')}\n"
-                        )
-                    except Exception:
-                        pass
-
-            # Behavioral insights (from client context)
-            insights = ctx.get('insights', [])
-            if insights:
-                context_info += f"\n\nBEHAVIORAL INSIGHTS:\n"
-                for insight in insights[:5]:
-                    context_info += f"- {insight}\n"
-
-            # Tag frequency analysis (from client context)
-            tag_frequency = ctx.get('tagFrequency', [])
-            if tag_frequency:
-                context_info += f"\n\nBEHAVIORAL TAG FREQUENCY:\n"
-                for tag in tag_frequency[:8]:
-                    context_info += f"- {tag.get('tag', 'N/A')}: {tag.get('frequency', 0)} occurrences\n"
-
-            # Mood analysis (from client context)
-            mood_analysis = ctx.get('moodAnalysis', {})
-            if mood_analysis:
-                context_info += f"\n\nMOOD ANALYSIS:\n"
-                for mood, data in mood_analysis.items():
-                    if isinstance(data, dict) and 'count' in data:
-                        avg = data.get('avgPnl', 0) or 0
-                        context_info += f"- {mood}: {data.get('count', 0)} trades, Avg P&L: ${float(avg):.2f}\n"
-
-            # Risk metrics (from client context)
-            risk_metrics = ctx.get('riskMetrics', {})
-            if risk_metrics:
-                context_info += f"\n\nRISK METRICS:\n"
-                for metric, value in risk_metrics.items():
-                    context_info += f"- {metric}: {value}\n"
-
-            # Patterns (from client context)
-            patterns = ctx.get('patterns', [])
-            if patterns:
-                context_info += f"\n\nIDENTIFIED PATTERNS:\n"
-                for pattern in patterns[:5]:
-                    context_info += f"- {pattern}\n"
-
-            # Behavioral data fetched from DB
-            if behavioral_data_from_db:
-                context_info += f"\n\nBEHAVIORAL DATA FROM DATABASE:\n"
-
-                # Trade scores analysis
-                trade_scores = behavioral_data_from_db.get('trade_scores', [])
-                if trade_scores:
-                    revenge_trades = len([s for s in trade_scores if (s.get('revenge_immediate') or 0) > 0.5])
-                    consistent_trades = len([s for s in trade_scores if (s.get('consistent_size') or 0) > 0.5])
-                    disciplined_trades = len([s for s in trade_scores if (s.get('disciplined_after_loss_immediate') or 0) > 0.5])
-
-                    context_info += f"- Trade Scores Analysis ({len(trade_scores)} scored trades):\n"
-                    if len(trade_scores) > 0:
-                        context_info += f"  * Revenge Trading: {revenge_trades} trades ({revenge_trades/len(trade_scores)*100:.1f}%)\n"
-                        context_info += f"  * Consistent Size: {consistent_trades} trades ({consistent_trades/len(trade_scores)*100:.1f}%)\n"
-                        context_info += f"  * Disciplined After Loss: {disciplined_trades} trades ({disciplined_trades/len(trade_scores)*100:.1f}%)\n"
-
-                # Day scores analysis
-                day_scores = behavioral_data_from_db.get('day_scores', [])
-                if day_scores:
-                    overtrading_days = len([d for d in day_scores if (d.get('overtrading_day') or 0) > 0.5])
-                    focused_days = len([d for d in day_scores if (d.get('focused_day') or 0) > 0.5])
-
-                    context_info += f"- Day Scores Analysis ({len(day_scores)} days):\n"
-                    if len(day_scores) > 0:
-                        context_info += f"  * Overtrading Days: {overtrading_days} days ({overtrading_days/len(day_scores)*100:.1f}%)\n"
-                        context_info += f"  * Focused Days: {focused_days} days ({focused_days/len(day_scores)*100:.1f}%)\n"
-
-                # Raw rule tags (if you store them)
-                tags = behavioral_data_from_db.get('tags', [])
-                if tags:
-                    tag_counts = {}
-                    for tag in tags:
-                        tag_name = tag.get('tag', 'Unknown')
-                        tag_counts[tag_name] = tag_counts.get(tag_name, 0) + 1
-
-                    context_info += f"- Behavioral Tags ({len(tags)} total tags):\n"
-                    for tag_name, count in sorted(tag_counts.items(), key=lambda x: x[1], reverse=True)[:10]:
-                        context_info += f"  * {tag_name}: {count} occurrences\n"
+@app.get("/api/similar-trades")
+async def similar_trades(trade_id: int, k: int = Query(5, ge=1, le=50),
+                         same_ticker: bool = False, past_only: bool = True):
+    """Stored trades most similar to trade_id (same situation and behavior flags), nearest first."""
+    index = await run_blocking(get_similar_index)
+    found = index.similar(trade_id, k=k, same_ticker=same_ticker, past_only=past_only)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Trade not found")
+    return found
 
-        # ------------------------------------------------------------------
-        # 2) Inject CSV context (NEW): raw trades + compressed behavior tags
-        # ------------------------------------------------------------------
-        try:
-            trades_csv_path = "data/trades_roundtrips.csv"
-            trades_df = pd.read_csv(trades_csv_path)
-            if not trades_df.empty:
-                context_info += f"\n\nRAW TRADES FROM CSV ({len(trades_df)} rows):\n"
-                for _, r in trades_df.head(10).iterrows():
-                    try:
-                        context_info += (
-                            f"- {r.get('ticker','N/A')} ({str(r.get('side','N/A')).lower()}) "
-                            f"on {r.get('trade_date','N/A')}, P&L ${float(r.get('realized_pnl',0) or 0):.2f}, "
-                            f"Mood: {r.get('mood','')}, Tags: {r.get('manual_tags','')}\n"
-                        )
-                    except Exception:
-                        pass
-        except Exception as e:
-            print(f"Could not load trades_roundtrips.csv: {e}")
-
-        try:
-            scores_csv_path = "data/trade_scores_with_day.csv"
-            compressed = compress_scores(scores_csv_path, threshold=0.6)
-            if compressed:
-                context_info += f"\n\nBEHAVIORAL TAGS (≥0.6 confidence) FROM SCORES FILE ({len(compressed)} trades):\n"
-                for r in compressed[:10]:
-                    tags_str = ", ".join(r["tags"]) if r["tags"] else "None"
-                    context_info += (
-                        f"- {r.get('ticker','')} on {r.get('trade_date','')} "
-                        f"(trade_id={r.get('trade_id')}): {tags_str}\n"
-                    )
-        except Exception as e:
-            print(f"Could not load trade_scores_with_day.csv: {e}")
-
-        # ------------------------------------------------------------------
-        # 3) Upgraded system prompt (behavior-first, actionable)
-        # ------------------------------------------------------------------
-        system_prompt = f"""
+# AI Chat endpoint
+CHAT_MODEL = os.environ.get("TG_CHAT_MODEL", "gpt-5-mini")
+
+async def build_chat_messages(request: ChatMessage):
+    """System prompt (with a token-budgeted context block), recent history and the user's message."""
+    # ------------------------------------------------------------------
+    # 0) Precomputed coaching summary (built at import, cached per user)
+    # ------------------------------------------------------------------
+    summary = await run_blocking(get_coaching_summary)
+
+    # ------------------------------------------------------------------
+    # 1) Fill the context budget: selected trades, then the ranked summary,
+    #    then client-side analytics, each as far as the budget allows
+    # ------------------------------------------------------------------
+    ctx = getattr(request, "context", None) or {}
+    leading, trailing = client_context_sections(ctx)
+    leading += await run_blocking(similar_trade_sections, ctx)
+    context_info = render_context(leading + summary["sections"] + trailing, CONTEXT_TOKENS)
+
+    # ------------------------------------------------------------------
+    # 3) Upgraded system prompt (behavior-first, actionable)
+    # ------------------------------------------------------------------
+    system_prompt = f"""
 You are Tradegist, a behavioral analyst and trading coach. Your purpose is to help traders understand the deeper psychological and behavioral drivers of their trading decisions, drawing on both their raw trade history and their behavioral scoring data.
 
 You can use markdown formatting to make your responses more readable and structured. Use:
@@ -544,228 +399,243 @@ User’s Trading Context:
 {context_info}
 """
 
+    # Build conversation messages including history
+    conversation_messages = [{"role": "system", "content": system_prompt}]
+    
+    # Add conversation history if provided: newest turns first, up to 10 and HISTORY_TOKENS
+    history, used = [], 0
+    for msg in reversed((request.conversation_history or [])[-10:]):
+        used += estimate_tokens(msg["content"])
+        if used > HISTORY_TOKENS:
+            break
+        history.append({
+            "role": msg["role"],
+            "content": msg["content"]
+        })
+    conversation_messages.extend(reversed(history))
+    
+    # Add current user message
+    conversation_messages.append({"role": "user", "content": request.message})
+    return conversation_messages
+
+def chat_client():
+    """Async OpenAI client; OPEN_AI_BASE_URL points it at another compatible server (e.g. a local fake)."""
+    api_key = os.getenv("OPEN_AI_KEY")
+    if not api_key:
+        raise Exception("OpenAI API key not found. Please set OPEN_AI_KEY environment variable.")
+    return openai.AsyncOpenAI(api_key=api_key, base_url=os.getenv("OPEN_AI_BASE_URL") or None)
+
+def extract_insights(ai_response):
+    """Light keyword-based insight extraction from the coach's reply."""
+    insights = []
+    low = (ai_response or "").lower()
+    if "overtrading" in low or "revenge" in low:
+        insights.append({
+            "type": "warning",
+            "title": "Behavioral Pattern Detected",
+            "message": "Focus on emotional control and trading discipline",
+            "recommendation": "Consider implementing trading breaks after losses"
+        })
+    if "improvement" in low or "better" in low:
+        insights.append({
+            "type": "info",
+            "title": "Growth Opportunity",
+            "message": "Areas identified for behavioral improvement",
+            "recommendation": "Focus on one improvement at a time"
+        })
+    return insights or None
+
+def reply_cache_state():
+    """(data generation, saved data version) for the current user; read before the prompt is built."""
+    from app.ingest_to_supabase import UID
+
+    return user_cache.generation(UID), summary_version(UID)
+
+def lookup_cached_reply(request: ChatMessage, conversation_messages, state):
+    """(cache key, cached reply or None) for this chat request and its built prompt."""
+    from app.ingest_to_supabase import UID
+
+    # The system prompt carries the server-side context: key on what the model would see
+    key = response_cache.key(UID, request.message, request.context, request.conversation_history, CHAT_MODEL,
+                             conversation_messages[0]["content"])
+    try:
+        return key, response_cache.get(key, data_version=state[1])
+    except Exception as e:
+        print(f"LLM response cache lookup failed: {e}")
+        return key, None
+
+def store_reply(key, state, ai_response):
+    from app.ingest_to_supabase import UID
+
+    generation, data_version = state
+    try:
+        response_cache.put(key, UID, CHAT_MODEL, ai_response, data_version=data_version, generation=generation)
+    except Exception as e:
+        print(f"LLM response cache store failed: {e}")
+
+CHAT_ERROR_MESSAGE = "I’m having trouble processing your request right now. Please try again in a moment."
+
+@app.post("/api/chat", response_model=ChatResponse)
+async def chat_with_ai(request: ChatMessage):
+    """Chat with AI trading behavior coach"""
+    try:
+        # Same question over unchanged data: answer from the response cache
+        cache_state = await run_blocking(reply_cache_state)
+        conversation_messages = await build_chat_messages(request)
+        cache_key, cached = await run_blocking(lookup_cached_reply, request, conversation_messages, cache_state)
+        if cached is not None:
+            return ChatResponse(response=cached, insights=extract_insights(cached))
+
         # ------------------------------------------------------------------
-        # 4) Call OpenAI with the upgraded prompt (unchanged flow)
+        # 4) Call OpenAI with the upgraded prompt
         # ------------------------------------------------------------------
-        api_key = os.getenv("OPEN_AI_KEY")
-        if not api_key:
-            raise Exception("OpenAI API key not found. Please set OPEN_AI_KEY environment variable.")
-
-        client = openai.OpenAI(api_key=api_key)
-        
-        # Build conversation messages including history
-        conversation_messages = [{"role": "system", "content": system_prompt}]
-        
-        # Add conversation history if provided
-        if request.conversation_history:
-            for msg in request.conversation_history[-10:]:  # Keep last 10 messages to avoid token limits
-                conversation_messages.append({
-                    "role": msg["role"],
-                    "content": msg["content"]
-                })
-        
-        # Add current user message
-        conversation_messages.append({"role": "user", "content": request.message})
-        
-        response = client.chat.completions.create(
-            model="gpt-5-mini",
+        client = chat_client()
+        response = await client.chat.completions.create(
+            model=CHAT_MODEL,
             messages=conversation_messages
         )
         ai_response = response.choices[0].message.content
+        await run_blocking(store_reply, cache_key, cache_state, ai_response)
 
         # ------------------------------------------------------------------
-        # 5) Light insight extraction (keep your existing structure)
+        # 5) Light insight extraction
         # ------------------------------------------------------------------
-        insights = []
-        low = ai_response.lower()
-        if "overtrading" in low or "revenge" in low:
-            insights.append({
-                "type": "warning",
-                "title": "Behavioral Pattern Detected",
-                "message": "Focus on emotional control and trading discipline",
-                "recommendation": "Consider implementing trading breaks after losses"
-            })
-        if "improvement" in low or "better" in low:
-            insights.append({
-                "type": "info",
-                "title": "Growth Opportunity",
-                "message": "Areas identified for behavioral improvement",
-                "recommendation": "Focus on one improvement at a time"
-            })
-
-        return ChatResponse(response=ai_response, insights=insights or None)
+        return ChatResponse(response=ai_response, insights=extract_insights(ai_response))
 
     except Exception as e:
         print(f"Chat API error: {str(e)}")
         return ChatResponse(
-            response="I’m having trouble processing your request right now. Please try again in a moment.",
+            response=CHAT_ERROR_MESSAGE,
             insights=None
         )
 
+def sse_event(event, data):
+    """One Server-Sent Events frame; data is JSON so newlines in tokens stay inside the frame."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/api/chat/stream")
+async def chat_with_ai_stream(request: ChatMessage):
+    """
+    Streaming variant of /api/chat (text/event-stream):
+      event: token     {"text": "..."}          for every content delta, as it arrives
+      event: insights  {"insights": [...]|null} final event, once the reply is complete
+      event: error     {"message": "..."}       instead of insights if anything fails
+    """
+    async def events():
+        stream = None
+        try:
+            cache_state = await run_blocking(reply_cache_state)
+            conversation_messages = await build_chat_messages(request)
+            cache_key, cached = await run_blocking(lookup_cached_reply, request, conversation_messages, cache_state)
+            if cached is not None:
+                yield sse_event("token", {"text": cached})
+                yield sse_event("insights", {"insights": extract_insights(cached)})
+                return
+
+            stream = await chat_client().chat.completions.create(
+                model=CHAT_MODEL,
+                messages=conversation_messages,
+                stream=True
+            )
+            parts = []
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield sse_event("token", {"text": delta})
+            ai_response = "".join(parts)
+            await run_blocking(store_reply, cache_key, cache_state, ai_response)
+            yield sse_event("insights", {"insights": extract_insights(ai_response)})
+        except Exception as e:
+            print(f"Chat stream error: {str(e)}")
+            yield sse_event("error", {"message": CHAT_ERROR_MESSAGE})
+        finally:
+            # Client went away mid-reply: stop pulling tokens from the LLM
+            if stream is not None:
+                await stream.close()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 
 # Report Generation endpoint
+# PDF reports render on a process pool straight into the on-disk cache
+# (app/report.py); identical concurrent requests share one render
+_report_renders: Dict[str, asyncio.Future] = {}
+
+async def report_file(trades, behavioral_data, **options):
+    """Path of the cached PDF for these inputs, rendering it on the report pool if needed."""
+    key = await run_blocking(report_key, trades, behavioral_data, **options)
+    path = await run_blocking(cached_report, key)
+    if path is not None:
+        print("Serving cached report")
+        return path
+    task = _report_renders.get(key)
+    if task is None:
+        task = asyncio.wrap_future(report_pool().submit(render_report_file, key, trades, behavioral_data, **options))
+        _report_renders[key] = task
+        task.add_done_callback(lambda _: _report_renders.pop(key, None))
+    return await asyncio.shield(task)
+
+def report_inputs(start_date=None, end_date=None, tickers=None):
+    """Stored trades in [start_date, end_date] (ISO dates, inclusive) for the given tickers, plus their behavioral rows."""
+    tickers = {t.upper() for t in tickers} if tickers else None
+    trades = [
+        t for t in get_all_trades_from_supabase()
+        if (not start_date or (t["trade_date"] or "")[:10] >= start_date)
+        and (not end_date or (t["trade_date"] or "")[:10] <= end_date)
+        and (tickers is None or (t["ticker"] or "").upper() in tickers)
+    ]
+    ids = {t["trade_id"] for t in trades}
+    days = {(t["trade_date"] or "")[:10] for t in trades}
+    data = get_behavioral_data_from_supabase()
+    behavioral_data = {
+        "trade_scores": [r for r in data.get("trade_scores", []) if r["trade_id"] in ids],
+        "day_scores": [r for r in data.get("day_scores", []) if (r["day"] or "")[:10] in days],
+        "tags": [r for r in data.get("tags", []) if r["trade_id"] in ids],
+    }
+    return trades, behavioral_data
+
+def pdf_response(path, filename="trading-behavior-report.pdf"):
+    return FileResponse(path, media_type="application/pdf", filename=filename)
+
+@app.get("/api/report")
+async def report(start_date: Optional[str] = None, end_date: Optional[str] = None,
+                 ticker: Optional[List[str]] = Query(None), trade_log: bool = True):
+    """Behavior report over the stored trades, optionally limited to a date range (YYYY-MM-DD) and tickers."""
+    for value in (start_date, end_date):
+        if value:
+            try:
+                datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                raise HTTPException(status_code=422, detail=f"Invalid date {value!r}, expected YYYY-MM-DD")
+    try:
+        trades, behavioral_data = await run_blocking(report_inputs, start_date, end_date, ticker)
+        print(f"Generating report for {len(trades)} stored trades")
+        period = None
+        if start_date or end_date or ticker:
+            period = f"{start_date or 'start'} to {end_date or 'today'}"
+            if ticker:
+                period += f" · {', '.join(sorted(t.upper() for t in ticker))}"
+        path = await report_file(trades, behavioral_data, period=period, trade_log=trade_log)
+        return pdf_response(path)
+
+    except Exception as e:
+        print(f"Report generation error: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Report generation failed: {str(e)}")
+
 @app.post("/api/generate-report")
 async def generate_report(request: ReportRequest):
-    """Generate comprehensive trading behavior report"""
+    """Generate comprehensive trading behavior report from client-posted data (prefer GET /api/report)"""
     try:
         print(f"Generating report for {len(request.trades)} trades")
-        
-        # Create PDF buffer
-        buffer = io.BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=1*inch, bottomMargin=1*inch)
-        styles = getSampleStyleSheet()
-        
-        # Custom styles
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=24,
-            spaceAfter=30,
-            alignment=TA_CENTER,
-            textColor=colors.darkblue
-        )
-        
-        heading_style = ParagraphStyle(
-            'CustomHeading',
-            parent=styles['Heading2'],
-            fontSize=16,
-            spaceAfter=12,
-            textColor=colors.darkblue
-        )
-        
-        # Generate AI-powered report content
-        trades = request.trades
-        behavioral_data = request.behavioralData or {}
-        
-        # Calculate basic stats
-        total_trades = len(trades)
-        winning_trades = len([t for t in trades if t.get('realized_pnl', 0) > 0])
-        win_rate = (winning_trades / total_trades * 100) if total_trades > 0 else 0
-        total_pnl = sum([t.get('realized_pnl', 0) for t in trades])
-        avg_pnl = total_pnl / total_trades if total_trades > 0 else 0
-        
-        print(f"Stats: {total_trades} trades, {win_rate:.1f}% win rate, ${total_pnl:.2f} total P&L")
-        
-        # Build PDF content
-        story = []
-        
-        # Title
-        story.append(Paragraph("Trading Behavior Analysis Report", title_style))
-        story.append(Spacer(1, 20))
-        
-        # Executive Summary
-        story.append(Paragraph("Executive Summary", heading_style))
-        story.append(Paragraph(f"""
-        This comprehensive report analyzes your trading behavior patterns based on {total_trades} trades. 
-        Your current win rate is {win_rate:.1f}%, with a total P&L of ${total_pnl:.2f} and average P&L per trade of ${avg_pnl:.2f}.
-        This indicates {'strong' if win_rate > 60 else 'moderate' if win_rate > 40 else 'room for improvement in'} performance consistency.
-        """, styles['Normal']))
-        story.append(Spacer(1, 12))
-        
-        # Trading Statistics Table
-        story.append(Paragraph("Trading Statistics", heading_style))
-        stats_data = [
-            ['Metric', 'Value'],
-            ['Total Trades', str(total_trades)],
-            ['Winning Trades', str(winning_trades)],
-            ['Losing Trades', str(total_trades - winning_trades)],
-            ['Win Rate', f"{win_rate:.1f}%"],
-            ['Total P&L', f"${total_pnl:.2f}"],
-            ['Average P&L per Trade', f"${avg_pnl:.2f}"],
-            ['Best Trade', f"${max([t.get('realized_pnl', 0) for t in trades]):.2f}"],
-            ['Worst Trade', f"${min([t.get('realized_pnl', 0) for t in trades]):.2f}"]
-        ]
-        
-        stats_table = Table(stats_data, colWidths=[2*inch, 2*inch])
-        stats_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.darkblue),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.lightgrey),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('FONTSIZE', (0, 1), (-1, -1), 10)
-        ]))
-        story.append(stats_table)
-        story.append(Spacer(1, 20))
-        
-        # Behavioral Analysis
-        story.append(Paragraph("Behavioral Analysis", heading_style))
-        
-        # Analyze trading patterns
-        analysis_text = f"""
-        Based on your trading data, here are the key behavioral patterns identified:
-        
-        <b>Performance Analysis:</b>
-        • Your win rate of {win_rate:.1f}% {'exceeds' if win_rate > 60 else 'meets' if win_rate > 40 else 'falls below'} the typical trader average of 50-60%
-        • Average P&L of ${avg_pnl:.2f} per trade suggests {'strong' if avg_pnl > 0 else 'room for improvement in'} position sizing
-        • Total P&L of ${total_pnl:.2f} indicates {'profitable' if total_pnl > 0 else 'unprofitable'} trading performance
-        
-        <b>Risk Management Assessment:</b>
-        • {'Good' if abs(min([t.get('realized_pnl', 0) for t in trades])) < abs(avg_pnl) * 2 else 'Poor'} risk management based on worst trade vs average trade ratio
-        • {'Consistent' if len(set([t.get('ticker', '') for t in trades])) < total_trades * 0.3 else 'Diversified'} trading approach across tickers
-        
-        <b>Behavioral Insights:</b>
-        • Focus on maintaining discipline during {'winning' if win_rate > 60 else 'losing'} streaks
-        • {'Consider' if avg_pnl < 0 else 'Continue'} implementing consistent position sizing rules
-        • Track emotional patterns that may impact trading decisions
-        """
-        
-        story.append(Paragraph(analysis_text, styles['Normal']))
-        story.append(Spacer(1, 20))
-        
-        # Recommendations
-        story.append(Paragraph("Key Recommendations", heading_style))
-        recommendations = [
-            "Implement a maximum daily loss limit to prevent emotional trading",
-            "Use consistent position sizing based on account size and risk tolerance",
-            "Take breaks after consecutive losses to avoid revenge trading",
-            "Track mood patterns and their impact on trading decisions",
-            "Develop a pre-trade checklist for discipline and consistency",
-            "Review and analyze losing trades to identify behavioral patterns",
-            "Set realistic profit targets and stick to your trading plan"
-        ]
-        
-        for i, rec in enumerate(recommendations, 1):
-            story.append(Paragraph(f"{i}. {rec}", styles['Normal']))
-        
-        story.append(Spacer(1, 20))
-        
-        # Action Plan
-        story.append(Paragraph("30-Day Action Plan", heading_style))
-        action_plan = f"""
-        <b>Week 1:</b> Implement daily loss limits and position sizing rules
-        <b>Week 2:</b> Start tracking mood and emotional state before each trade
-        <b>Week 3:</b> Review all trades and identify recurring behavioral patterns
-        <b>Week 4:</b> Refine your trading plan based on behavioral insights
-        
-        <b>Success Metrics:</b>
-        • Maintain win rate above {max(40, win_rate - 5):.0f}%
-        • Keep average loss below ${abs(avg_pnl) * 1.5:.2f}
-        • Complete daily trading journal entries
-        • Follow pre-trade checklist 100% of the time
-        """
-        
-        story.append(Paragraph(action_plan, styles['Normal']))
-        story.append(Spacer(1, 20))
-        
-        # Footer
-        story.append(Paragraph(f"Report generated on {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", 
-                             ParagraphStyle('Footer', parent=styles['Normal'], fontSize=8, alignment=TA_CENTER)))
-        
-        # Build PDF
-        doc.build(story)
-        buffer.seek(0)
-        
-        print(f"PDF generated successfully, size: {len(buffer.getvalue())} bytes")
-        
-        return StreamingResponse(
-            io.BytesIO(buffer.getvalue()),
-            media_type="application/pdf",
-            headers={"Content-Disposition": "attachment; filename=trading-behavior-report.pdf"}
-        )
+        path = await report_file(request.trades, request.behavioralData)
+        return pdf_response(path)
         
     except Exception as e:
         print(f"Report generation error: {str(e)}")
@@ -854,64 +724,31 @@ async def get_analytics():
     )
 
 # Data reset endpoint
+def delete_user_data(uid):
+    """Delete every stored row for uid in one transaction; returns (per-table counts, remaining trades)."""
+    try:
+        return get_storage().delete_user(uid)
+    finally:
+        # Bump first: a summary rebuild that read the old rows then skips its save
+        user_data_changed(uid)
+        discard_summary(uid)
+
 @app.post("/api/reset-data")
 async def reset_data():
     """Reset all data in Supabase for the current user"""
     try:
-        import psycopg
-        from app.ingest_to_supabase import UID, DB
-        
-        if not DB:
-            raise HTTPException(status_code=500, detail="Database connection not configured")
+        from app.ingest_to_supabase import UID
         
         print(f"Starting complete data reset for user: {UID}")
         
-        with psycopg.connect(DB, autocommit=True) as con:
-            with con.cursor() as cur:
-                # Clear any prepared statements first
-                try:
-                    cur.execute("DEALLOCATE ALL")
-                except:
-                    pass  # Ignore if no prepared statements exist
-                
-                # Delete all data for the user (in correct order due to foreign keys)
-                print("Deleting trade_scores...")
-                cur.execute("DELETE FROM public.trade_scores WHERE user_id = %s", (UID,))
-                deleted_scores = cur.rowcount
-                
-                print("Deleting day_scores...")
-                cur.execute("DELETE FROM public.day_scores WHERE user_id = %s", (UID,))
-                deleted_day_scores = cur.rowcount
-                
-                print("Deleting tags_raw...")
-                cur.execute("DELETE FROM public.tags_raw WHERE user_id = %s", (UID,))
-                deleted_tags = cur.rowcount
-                
-                print("Deleting daily_pnl...")
-                cur.execute("DELETE FROM public.daily_pnl WHERE user_id = %s", (UID,))
-                deleted_daily = cur.rowcount
-                
-                print("Deleting trades...")
-                cur.execute("DELETE FROM public.trades WHERE user_id = %s", (UID,))
-                deleted_trades = cur.rowcount
-                
-                # Get counts after deletion
-                cur.execute("SELECT COUNT(*) FROM public.trades WHERE user_id = %s", (UID,))
-                trades_count = cur.fetchone()[0]
-                
-                print(f"Reset complete. Deleted: {deleted_trades} trades, {deleted_scores} scores, {deleted_tags} tags, {deleted_daily} daily records")
+        deleted, trades_count = await run_blocking(delete_user_data, UID)
+        print(f"Reset complete. Deleted: {deleted['trades']} trades, {deleted['trade_scores']} scores, {deleted['tags_raw']} tags, {deleted['daily_pnl']} daily records")
                 
         return {
             "message": "Data reset completed successfully",
             "success": True,
             "remaining_trades": trades_count,
-            "deleted_counts": {
-                "trades": deleted_trades,
-                "trade_scores": deleted_scores,
-                "day_scores": deleted_day_scores,
-                "tags_raw": deleted_tags,
-                "daily_pnl": deleted_daily
-            }
+            "deleted_counts": deleted
         }
         
     except Exception as e:
@@ -919,107 +756,78 @@ async def reset_data():
         raise HTTPException(status_code=500, detail=f"Data reset failed: {str(e)}")
 
 # CSV Import endpoint
-@app.post("/api/import-csv")
-async def import_csv(file: UploadFile = File(...)):
-    """Import CSV file and run full analysis pipeline"""
-    tmp_path = None
+# Imports run as background jobs on their own bounded pool (app/jobs.py)
+IMPORT_PROGRESS_INTERVAL = 0.25  # seconds between progress checks on an events stream
+
+def save_upload(upload):
+    """Copy an upload to a temp file (the request's spooled file is closed once it returns)."""
+    import tempfile
+    import shutil
+
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.csv') as tmp_file:
+        shutil.copyfileobj(upload, tmp_file)
+        return tmp_file.name
+
+def run_import_pipeline(job, tmp_path, filename):
+    """
+    Import job body: ledger -> trades -> features -> rules -> labels -> DB, one job stage each.
+    Outputs stay in memory and are handed straight to the importer, so concurrent
+    jobs share no files.
+    """
+    uid = job.user_id
     try:
-        import tempfile
-        import shutil
-        from app.ingest_to_supabase import main as run_supabase_import
-        
-        print(f"Starting CSV import for file: {file.filename}")
-        
-        # Save uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.csv') as tmp_file:
-            shutil.copyfileobj(file.file, tmp_file)
-            tmp_path = tmp_file.name
-        
-        print(f"Saved temporary file to: {tmp_path}")
-        
-        # First reset existing data
-        import psycopg
-        from app.ingest_to_supabase import UID, DB
-        DB  = os.environ.get("DATABASE_URL")
-        UID = os.environ.get("TG_USER_ID")
-        
-        print(f"Resetting data for user: {UID}")
-        
-        if DB:
-            with psycopg.connect(DB, autocommit=True) as con:
-                with con.cursor() as cur:
-                    # Clear any prepared statements first
-                    try:
-                        cur.execute("DEALLOCATE ALL")
-                    except:
-                        pass  # Ignore if no prepared statements exist
-                    
-                    # Delete all data for the user (in correct order due to foreign keys)
-                    cur.execute("DELETE FROM public.trade_scores WHERE user_id = %s", (UID,))
-                    cur.execute("DELETE FROM public.day_scores WHERE user_id = %s", (UID,))
-                    cur.execute("DELETE FROM public.tags_raw WHERE user_id = %s", (UID,))
-                    cur.execute("DELETE FROM public.daily_pnl WHERE user_id = %s", (UID,))
-                    cur.execute("DELETE FROM public.trades WHERE user_id = %s", (UID,))
-        
-        print("Data reset completed")
+        print(f"Starting CSV import for file: {filename} (job {job.id})")
         
+        # Existing data is synced atomically by the import step (diff applied in
+        # one transaction), so a failed or empty import leaves it untouched
         # Run the full pipeline
-        print("Loading ledger...")
-        execs, cash = load_ledger(tmp_path, user_id=user_id)
+        with job.stage("ledger") as st:
+            execs, cash = load_ledger(tmp_path, user_id=uid)
+            st["rows"] = len(execs)
         print(f"Loaded {len(execs)} executions")
         
-        print("Computing FIFO round trips...")
-        trades = fifo_round_trips(execs)
+        with job.stage("round_trips") as st:
+            trades = fifo_round_trips(execs)
+            st["rows"] = len(trades)
         print(f"Generated {len(trades)} trades")
         
         if trades.empty:
             return {"message": "No completed trades found in CSV", "success": False}
         
-        # Save processed data to backend/data for Supabase import
-        data_dir = Path(__file__).parent / "data"
-        data_dir.mkdir(exist_ok=True)
-        
-        # Save trades
-        trades.to_csv(data_dir / "trades_roundtrips.csv", index=False)
-        print("Saved trades to CSV")
+        with job.stage("features") as st:
+            feat = compute_features(trades)
+            st["rows"] = len(feat)
         
-        # Compute features and run analysis
-        print("Computing features...")
-        feat = compute_features(trades)
-        print("Running rules...")
-        tags = run_all_rules(feat)
+        with job.stage("rules") as st:
+            tags = run_all_rules(feat)
+            st["rows"] = len(tags)
         print(f"Generated {len(tags)} tags")
         
-        # Save tags
-        if not tags.empty:
-            tags.to_csv(data_dir / "tags.csv", index=False)
-            print("Saved tags to CSV")
-        
-        # Build labels and save scores
-        print("Building labels...")
-        trades["trade_date"] = pd.to_datetime(trades["trade_date"])
-        if not tags.empty:
-            tags["trade_date"] = pd.to_datetime(tags["trade_date"])
-        
-        trade_scores, day_scores, trade_scores_with_day = build_labels(trades, tags)
+        with job.stage("labels") as st:
+            trades["trade_date"] = pd.to_datetime(trades["trade_date"])
+            if not tags.empty:
+                tags["trade_date"] = pd.to_datetime(tags["trade_date"])
+            
+            # Day scores are stored separately; nothing here reads the per-trade join
+            trade_scores, day_scores, _ = build_labels(trades, tags, propagate_day_to_trades=False)
+            st["rows"] = len(trade_scores)
+            st["day_rows"] = len(day_scores)
         print(f"Generated {len(trade_scores)} trade scores and {len(day_scores)} day scores")
         
-        # Save scores
-        if not trade_scores.empty:
-            trade_scores.to_csv(data_dir / "trade_scores.csv", index=False)
-        if not day_scores.empty:
-            day_scores.to_csv(data_dir / "day_scores.csv", index=False)
-        print("Saved scores to CSV")
-        
-        # Import to Supabase
-        print("Importing to Supabase...")
-        try:
-            run_supabase_import()
-            supabase_success = True
-            print("Supabase import successful")
-        except Exception as e:
-            print(f"Supabase import failed: {e}")
-            supabase_success = False
+        with job.stage("import") as st:
+            try:
+                counts, _ = import_outputs(uid, trades,
+                                           tags if not tags.empty else None,
+                                           trade_scores if not trade_scores.empty else None,
+                                           day_scores if not day_scores.empty else None)
+                st["rows"] = sum(c.get("inserted", 0) + c.get("updated", 0) + c.get("deleted", 0)
+                                 for c in counts.values())
+                supabase_success = True
+                print("Supabase import successful")
+            except Exception as e:
+                print(f"Supabase import failed: {e}")
+                st["error"] = str(e)
+                supabase_success = False
         
         return {
             "message": "CSV import completed successfully",
@@ -1030,18 +838,107 @@ async def import_csv(file: UploadFile = File(...)):
             "trade_scores_count": len(trade_scores) if not trade_scores.empty else 0,
             "day_scores_count": len(day_scores) if not day_scores.empty else 0
         }
-        
+    finally:
+        # Rebuild the similar-trade index now rather than on the first lookup
+        try:
+            with job.stage("similar_index") as st:
+                st["rows"] = len(get_similar_index())
+        except Exception as e:
+            print(f"Similar-trade index build failed: {e}")
+
+        # Clean up temporary file
+        if tmp_path and os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+@app.post("/api/import-csv", status_code=202)
+async def import_csv(file: UploadFile = File(...)):
+    """Queue a CSV import (full analysis pipeline); follow it at /api/import-jobs/{job_id}[/events]"""
+    try:
+        from app.ingest_to_supabase import UID
+
+        tmp_path = await run_blocking(save_upload, file.file)
+        job = import_jobs.submit("import", UID, functools.partial(run_import_pipeline, tmp_path=tmp_path,
+                                                                  filename=file.filename),
+                                 filename=file.filename)
+        print(f"Queued CSV import job {job.id} for file: {file.filename}")
+        return job.snapshot()
     except Exception as e:
         print(f"CSV import error: {str(e)}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"CSV import failed: {str(e)}")
-    finally:
-        # Clean up temporary file
-        if tmp_path and os.path.exists(tmp_path):
-            os.unlink(tmp_path)
+
+def find_import_job(job_id):
+    from app.ingest_to_supabase import UID
+
+    job = import_jobs.get(job_id)
+    if job is None or job.user_id != UID:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return job
+
+@app.get("/api/import-jobs/{job_id}")
+async def import_job_status(job_id: str):
+    """Current state of an import job: status, per-stage rows and timings, result or error"""
+    return find_import_job(job_id).snapshot()
+
+@app.get("/api/import-jobs/{job_id}/events")
+async def import_job_events(job_id: str):
+    """
+    Import progress as Server-Sent Events (text/event-stream):
+      event: progress  job snapshot, sent whenever a stage starts or finishes
+      event: done      final snapshot (status "done" or "failed"), then the stream ends
+    """
+    job = find_import_job(job_id)
+
+    async def events():
+        seen = -1
+        while True:
+            snap = job.snapshot()
+            if snap["version"] != seen:
+                seen = snap["version"]
+                # Decide from the snapshot: it is what the client receives
+                if snap["status"] in FINISHED:
+                    yield sse_event("done", snap)
+                    return
+                yield sse_event("progress", snap)
+            await asyncio.sleep(IMPORT_PROGRESS_INTERVAL)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 # Run analysis pipeline
+def analyze_ledger(ledger_path):
+    """Blocking body of /api/analyze: ledger -> trades -> features -> rules -> labels."""
+    execs, cash = load_ledger(ledger_path, user_id=user_id)
+    trades = fifo_round_trips(execs)
+    
+    if trades.empty:
+        return {"message": "No completed trades found"}
+    
+    # Compute features
+    feat = compute_features(trades)
+    
+    # Run rules
+    tags = run_all_rules(feat)
+    
+    # Build labels
+    trades["trade_date"] = pd.to_datetime(trades["trade_date"])
+    if not tags.empty:
+        tags["trade_date"] = pd.to_datetime(tags["trade_date"])
+    
+    trade_scores, day_scores, _ = build_labels(trades, tags, propagate_day_to_trades=False)
+    
+    return {
+        "message": "Analysis completed successfully",
+        "trades_count": len(trades),
+        "tags_count": len(tags),
+        "trade_scores": trade_scores.to_dict() if not trade_scores.empty else {},
+        "day_scores": day_scores.to_dict() if not day_scores.empty else {}
+    }
+
 @app.post("/api/analyze")
 async def run_analysis():
     """Run the full analysis pipeline on uploaded data"""
@@ -1053,32 +950,7 @@ async def run_analysis():
             raise HTTPException(status_code=404, detail="Mock data file not found")
         
         # Run the pipeline
-        execs, cash = load_ledger(ledger_path, user_id=user_id)
-        trades = fifo_round_trips(execs)
-        
-        if trades.empty:
-            return {"message": "No completed trades found"}
-        
-        # Compute features
-        feat = compute_features(trades)
-        
-        # Run rules
-        tags = run_all_rules(feat)
-        
-        # Build labels
-        trades["trade_date"] = pd.to_datetime(trades["trade_date"])
-        if not tags.empty:
-            tags["trade_date"] = pd.to_datetime(tags["trade_date"])
-        
-        trade_scores, day_scores, trade_scores_with_day = build_labels(trades, tags)
-        
-        return {
-            "message": "Analysis completed successfully",
-            "trades_count": len(trades),
-            "tags_count": len(tags),
-            "trade_scores": trade_scores.to_dict() if not trade_scores.empty else {},
-            "day_scores": day_scores.to_dict() if not day_scores.empty else {}
-        }
+        return await run_blocking(analyze_ledger, ledger_path)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
@@ -0,0 +1,52 @@
+"""
+Label matrices: build_labels_scatter() must return exactly what build_labels()
+does (same rows, columns, dtypes and float64 scores), on real and synthetic tags,
+and the lazy day join must materialize to the eager one.
+
+    cd backend && python -m pytest tests/
+"""
+
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from app.features import compute_features
+from app.ingest import fifo_round_trips, load_ledger
+from app.labels import _synthetic, build_labels, build_labels_scatter
+from app.rules import run_all_rules
+
+LEDGER = Path(__file__).resolve().parent.parent / "data" / "mock_trades_realistic.csv"
+KEYS = [["user_id", "trade_id"], ["user_id", "trade_date"], ["user_id", "trade_id"]]
+
+
+def _sorted(df: pd.DataFrame, keys) -> pd.DataFrame:
+    return df.sort_values(keys).reset_index(drop=True)
+
+
+def _ledger_inputs():
+    execs, _ = load_ledger(str(LEDGER), user_id="test-user")
+    trades = fifo_round_trips(execs)
+    tags = run_all_rules(compute_features(trades))
+    return trades.assign(trade_date=pd.to_datetime(trades["trade_date"])), \
+        tags.assign(trade_date=pd.to_datetime(tags["trade_date"]))
+
+
+@pytest.mark.parametrize("source", ["ledger", "synthetic"])
+@pytest.mark.parametrize("propagate", [True, False])
+def test_scatter_equals_build_labels(source, propagate):
+    trades, tags = _ledger_inputs() if source == "ledger" else _synthetic(20_000)
+    ref = build_labels(trades, tags, propagate_day_to_trades=propagate)
+    new = build_labels_scatter(trades, tags, propagate_day_to_trades=propagate)
+    for a, b, keys in zip(ref, new, KEYS):
+        a, b = _sorted(a, keys), _sorted(b, keys)
+        assert len(a)
+        pd.testing.assert_frame_equal(b[a.columns], a, check_exact=True)
+
+
+def test_lazy_day_scores_equal_eager_join():
+    trades, tags = _ledger_inputs()
+    eager = build_labels(trades, tags, propagate_day_to_trades=True)[2]
+    lazy = build_labels(trades, tags, propagate_day_to_trades="lazy")[2]
+    pd.testing.assert_frame_equal(_sorted(lazy.to_frame(), KEYS[2])[eager.columns],
+                                  _sorted(eager, KEYS[2]), check_exact=True)
@@ -0,0 +1,70 @@
+"""
+Chat reply cache: hits, misses (unknown key, other data version, expired,
+stale generation) and which inputs make up the key.
+
+    cd backend && python -m pytest tests/
+"""
+
+import pytest
+
+from app import llm_cache
+from app.cache import user_cache
+from app.llm_cache import ResponseCache
+
+USER = "test-user"
+
+
+@pytest.fixture
+def cache(tmp_path) -> ResponseCache:
+    # Directory does not exist yet: the cache must create it
+    return ResponseCache(tmp_path / "nested" / "llm_cache.sqlite3", ttl=60, max_entries=100)
+
+
+def _key(cache: ResponseCache, message="How am I doing?", **kw) -> str:
+    args = dict(context={"page": "dashboard"}, history=[], model="gpt-4o-mini", system_prompt="ctx v1")
+    args.update(kw)
+    return cache.key(USER, message, **args)
+
+
+def test_hit_after_put(cache):
+    k = _key(cache)
+    cache.put(k, USER, "gpt-4o-mini", "You're doing fine.", data_version="v1")
+    assert cache.path.exists()
+    assert cache.get(k, data_version="v1") == "You're doing fine."
+
+
+def test_misses(cache, monkeypatch):
+    k = _key(cache)
+    assert cache.get(k, data_version="v1") is None
+    cache.put(k, USER, "gpt-4o-mini", "reply", data_version="v1")
+    assert cache.get(k, data_version="v2") is None
+    # A version mismatch drops the entry
+    assert cache.get(k, data_version="v1") is None
+
+    cache.put(k, USER, "gpt-4o-mini", "reply", data_version="v1")
+    now = llm_cache.time.time()
+    monkeypatch.setattr(llm_cache.time, "time", lambda: now + cache.ttl + 1)
+    assert cache.get(k, data_version="v1") is None
+
+
+def test_stale_generation_is_not_stored(cache):
+    k = _key(cache)
+    generation = user_cache.generation(USER)
+    user_cache.bump(USER)
+    cache.put(k, USER, "gpt-4o-mini", "reply", data_version="v1", generation=generation)
+    assert cache.get(k, data_version="v1") is None
+
+
+def test_key_normalizes_message(cache):
+    assert _key(cache, "How am I doing?") == _key(cache, "  how am   i doing ")
+
+
+@pytest.mark.parametrize("change", [
+    {"message": "What went wrong?"},
+    {"system_prompt": "ctx v2"},
+    {"model": "gpt-4o"},
+    {"context": {"page": "trades"}},
+    {"history": [{"role": "user", "content": "hi"}]},
+])
+def test_key_varies_with_inputs(cache, change):
+    assert _key(cache, **change) != _key(cache)
@@ -0,0 +1,67 @@
+"""
+Rule DSL regression: RULE_SPECS must reproduce rules.run_all_rules() exactly, and
+an incremental run after a change must equal a full run over the new data.
+
+    cd backend && python -m pytest tests/
+"""
+
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from app.features import compute_features
+from app.ingest import fifo_round_trips, load_ledger
+from app.rules import run_all_rules
+from app.rulespec import RULE_SPECS, changed_partitions, run_rule_specs, run_rule_specs_incremental
+
+LEDGER = Path(__file__).resolve().parent.parent / "data" / "mock_trades_realistic.csv"
+KEYS = ["user_id", "trade_id", "trade_date", "tag", "scope", "rationale"]
+
+
+def normalized(tags: pd.DataFrame) -> pd.DataFrame:
+    """Tags in a canonical row order and dtypes, for frame comparison."""
+    t = tags.assign(trade_date=pd.to_datetime(tags["trade_date"]),
+                    trade_id=pd.to_numeric(tags["trade_id"], errors="coerce"),
+                    confidence=tags["confidence"].astype(float),
+                    # rule_focused_day / rule_green_day_low_activity leave source unset
+                    source=tags["source"].fillna("rule"))
+    return t[KEYS + ["confidence", "source"]].sort_values(KEYS, na_position="first").reset_index(drop=True)
+
+
+@pytest.fixture(scope="module")
+def trades() -> pd.DataFrame:
+    execs, _ = load_ledger(str(LEDGER), user_id="test-user")
+    return fifo_round_trips(execs)
+
+
+@pytest.fixture(scope="module")
+def features(trades) -> pd.DataFrame:
+    return compute_features(trades)
+
+
+def test_specs_match_run_all_rules(features):
+    expected = normalized(run_all_rules(features))
+    assert len(expected)
+    pd.testing.assert_frame_equal(normalized(run_rule_specs(features, RULE_SPECS)), expected)
+
+
+def _drop_days(trades: pd.DataFrame, days) -> pd.DataFrame:
+    return trades[~pd.to_datetime(trades["trade_date"]).isin(pd.to_datetime(list(days)))]
+
+
+@pytest.mark.parametrize("change", ["append_days", "remove_day", "remove_trade"])
+def test_incremental_matches_full_run(trades, change):
+    days = sorted(pd.to_datetime(trades["trade_date"]).unique())
+    if change == "append_days":
+        old_trades, new_trades = _drop_days(trades, days[-3:]), trades
+    elif change == "remove_day":
+        old_trades, new_trades = trades, _drop_days(trades, [days[len(days) // 2]])
+    else:
+        old_trades, new_trades = trades, trades.drop(trades.index[len(trades) // 3])
+    old_features, new_features = compute_features(old_trades), compute_features(new_trades)
+
+    changed_days, changed_tickers = changed_partitions(old_features, new_features)
+    incremental = run_rule_specs_incremental(new_features, run_rule_specs(old_features),
+                                             changed_days, changed_tickers)
+    pd.testing.assert_frame_equal(normalized(incremental), normalized(run_rule_specs(new_features)))
@@ -155,7 +155,8 @@ export default function LLMPage() {
         starplotData: behavioralData?.starplotData || []
       }
 
-      const response = await fetch('/api/chat', {
+      // Streamed reply: tokens are appended to the assistant message as they arrive
+      const response = await fetch('/api/chat/stream', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -170,16 +171,53 @@ export default function LLMPage() {
         })
       })
 
-      const data = await response.json()
-      
-      const aiResponse: Message = {
-        id: (Date.now() + 1).toString(),
-        content: data.response,
-        role: 'assistant',
-        timestamp: new Date()
+      if (!response.ok || !response.body) {
+        throw new Error(`HTTP error! status: ${response.status}`)
+      }
+
+      const assistantId = (Date.now() + 1).toString()
+      let started = false
+      const appendToken = (text: string) => {
+        if (!started) {
+          started = true
+          setMessages(prev => [...prev, { id: assistantId, content: text, role: 'assistant', timestamp: new Date() }])
+        } else {
+          setMessages(prev => prev.map(m => m.id === assistantId ? { ...m, content: m.content + text } : m))
+        }
+      }
+
+      const reader = response.body.getReader()
+      const decoder = new TextDecoder()
+      let buffer = ''
+      while (true) {
+        const { done, value } = await reader.read()
+        if (done) break
+        buffer += decoder.decode(value, { stream: true })
+
+        // SSE frames are separated by a blank line: "event: <name>\ndata: <json>"
+        let sep
+        while ((sep = buffer.indexOf('\n\n')) >= 0) {
+          const frame = buffer.slice(0, sep)
+          buffer = buffer.slice(sep + 2)
+          let event = 'message'
+          let data = ''
+          for (const line of frame.split('\n')) {
+            if (line.startsWith('event: ')) event = line.slice(7)
+            else if (line.startsWith('data: ')) data += line.slice(6)
+          }
+          if (!data) continue
+          const payload = JSON.parse(data)
+          if (event === 'token') {
+            appendToken(payload.text)
+          } else if (event === 'error') {
+            throw new Error(payload.message)
+          }
+        }
+      }
+
+      if (!started) {
+        throw new Error('Empty response')
       }
-      
-      setMessages(prev => [...prev, aiResponse])
     } catch (error) {
       console.error('Error calling AI:', error)
       const errorResponse: Message = {
@@ -217,18 +255,10 @@ export default function LLMPage() {
   const generateComprehensiveReport = async () => {
     setIsGeneratingReport(true)
     try {
-      console.log('Generating report with trades:', trades.length)
+      console.log('Generating report from stored trades')
       
-      const response = await fetch('/api/generate-report', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({
-          trades: trades,
-          behavioralData: behavioralData
-        })
-      })
+      // The server loads trades and behavioral data itself; nothing to upload
+      const response = await fetch('/api/report')
 
       if (!response.ok) {
         throw new Error(`HTTP error! status: ${response.status}`)
@@ -527,7 +557,7 @@ export default function LLMPage() {
                 ))}
               </AnimatePresence>
               
-              {isLoading && (
+              {isLoading && messages[messages.length - 1]?.role !== 'assistant' && (
                 <motion.div
                   initial={{ opacity: 0 }}
                   animate={{ opacity: 1 }}
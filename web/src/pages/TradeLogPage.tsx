@@ -241,7 +241,10 @@ export default function TradeLogPage() {
       setError('')
       
       // Show import progress
-      const result = await TradeService.importTradesFromCSV(file)
+      const result = await TradeService.importTradesFromCSV(file, (job) => {
+        const stage = job.stages[job.stages.length - 1]
+        console.log(`Import ${job.status}` + (stage ? `: ${stage.name} ${stage.status}` : ''))
+      })
       
       if (result.success) {
         // Reload trades from Supabase
@@ -1,5 +1,30 @@
 import { supabase, fixedUserId, type Trade, type TradeWithScores, type DailyPnL, type TradeScore, type DayScore } from '../lib/supabase'
 
+export interface ImportResult {
+  success: boolean;
+  message: string;
+  trades_count: number;
+  tags_count: number;
+  supabase_imported: boolean;
+  trade_scores_count: number;
+  day_scores_count: number;
+}
+
+export interface ImportJobStage {
+  name: string;
+  status: 'running' | 'done' | 'failed';
+  rows: number | null;
+  seconds: number | null;
+}
+
+export interface ImportJob {
+  job_id: string;
+  status: 'queued' | 'running' | 'done' | 'failed';
+  stages: ImportJobStage[];
+  result: ImportResult | null;
+  error: string | null;
+}
+
 export class TradeService {
   // ====== TRADE OPERATIONS ======
   
@@ -363,15 +388,9 @@ export class TradeService {
 
   // ====== CSV IMPORT ======
 
-  static async importTradesFromCSV(file: File): Promise<{
-    success: boolean;
-    message: string;
-    trades_count: number;
-    tags_count: number;
-    supabase_imported: boolean;
-    trade_scores_count: number;
-    day_scores_count: number;
-  }> {
+  // The server queues the import as a background job; progress arrives as
+  // Server-Sent Events until the job is done or failed
+  static async importTradesFromCSV(file: File, onProgress?: (job: ImportJob) => void): Promise<ImportResult> {
     const formData = new FormData()
     formData.append('file', file)
 
@@ -389,7 +408,13 @@ export class TradeService {
         throw new Error(`CSV import failed: ${error}`)
       }
 
-      return await response.json()
+      const queued: ImportJob = await response.json()
+      onProgress?.(queued)
+      const job = await TradeService.followImportJob(queued.job_id, onProgress)
+      if (job.status === 'failed' || !job.result) {
+        throw new Error(`CSV import failed: ${job.error || 'unknown error'}`)
+      }
+      return job.result
     } catch (error: any) {
       if (error.message.includes('Failed to fetch') || error.message.includes('ERR_CONNECTION_REFUSED')) {
         throw new Error('Cannot connect to backend server. Please ensure the backend is running on port 8000.')
@@ -398,6 +423,23 @@ export class TradeService {
     }
   }
 
+  static followImportJob(jobId: string, onProgress?: (job: ImportJob) => void): Promise<ImportJob> {
+    return new Promise((resolve, reject) => {
+      const source = new EventSource(`http://localhost:8000/api/import-jobs/${jobId}/events`)
+      source.addEventListener('progress', (e) => onProgress?.(JSON.parse((e as MessageEvent).data)))
+      source.addEventListener('done', (e) => {
+        source.close()
+        const job: ImportJob = JSON.parse((e as MessageEvent).data)
+        onProgress?.(job)
+        resolve(job)
+      })
+      source.onerror = () => {
+        source.close()
+        reject(new Error('Lost connection while waiting for the CSV import to finish'))
+      }
+    })
+  }
+
   static async resetData(): Promise<{
     success: boolean;
     message: string;